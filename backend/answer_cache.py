@@ -0,0 +1,126 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+
+# Semantic cache of generated chat answers. A cached answer is reused when a
+# new question in the same inquiry and reference sets is close enough to an
+# earlier one (cosine similarity of the query embeddings) AND retrieval
+# returned exactly the same chunks, so the model would have seen the same
+# context.
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE", "1") != "0"
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "2048"))
+
+def context_fingerprint(matches):
+    """Hash of the retrieved chunk ids and texts, in rank order"""
+    digest = hashlib.sha256()
+    for match in matches:
+        digest.update(str(match.id).encode("utf-8") + b"\0")
+        digest.update(str((match.metadata or {}).get("text", "")).encode("utf-8") + b"\0")
+    return digest.hexdigest()
+
+class _Bucket:
+    """Answers that share a scope and retrieved context"""
+
+    def __init__(self, dimension):
+        self.vectors = np.empty((0, dimension), dtype=np.float32)
+        self.answers = []
+
+class AnswerCache:
+    """Cosine-similarity answer cache with LRU eviction of context buckets"""
+
+    def __init__(self, threshold=ANSWER_CACHE_THRESHOLD, max_entries=ANSWER_CACHE_MAX_ENTRIES):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.saved_latency_ms = 0.0
+        self._entries = 0
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(inquiry_id, ref_set_ids, fingerprint):
+        return (inquiry_id or "", tuple(sorted(set(ref_set_ids or ()))), fingerprint)
+
+    @staticmethod
+    def _unit(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get(self, inquiry_id, ref_set_ids, fingerprint, embedding):
+        """Cached answer dict for a question, or None"""
+        key = self._key(inquiry_id, ref_set_ids, fingerprint)
+        query = self._unit(embedding)
+        with self._lock:
+            bucket = self._buckets.get(key)
+            best = None
+            if bucket is not None and len(bucket.answers) and bucket.vectors.shape[1] == len(query):
+                scores = bucket.vectors @ query
+                index = int(np.argmax(scores))
+                if scores[index] >= self.threshold:
+                    best = bucket.answers[index]
+            if best is None:
+                self.misses += 1
+                return None
+            self._buckets.move_to_end(key)
+            self.hits += 1
+            self.saved_latency_ms += best.get("latency_ms", 0.0)
+            return best
+
+    def put(self, inquiry_id, ref_set_ids, fingerprint, embedding, answer):
+        """Cache an answer (a dict with response, citations and latency_ms)"""
+        key = self._key(inquiry_id, ref_set_ids, fingerprint)
+        query = self._unit(embedding)
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None or bucket.vectors.shape[1] != len(query):
+                if bucket is not None:
+                    self._entries -= len(bucket.answers)
+                bucket = self._buckets[key] = _Bucket(len(query))
+            bucket.vectors = np.vstack([bucket.vectors, query[None, :]])
+            bucket.answers.append(answer)
+            self._entries += 1
+            self._buckets.move_to_end(key)
+            while self._entries > self.max_entries and len(self._buckets) > 1:
+                _, evicted = self._buckets.popitem(last=False)
+                self._entries -= len(evicted.answers)
+                self.evictions += len(evicted.answers)
+            if self._entries > self.max_entries:
+                # One bucket holds everything; drop its oldest answers
+                excess = self._entries - self.max_entries
+                bucket.vectors = bucket.vectors[excess:]
+                del bucket.answers[:excess]
+                self._entries -= excess
+                self.evictions += excess
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "saved_latency_ms": round(self.saved_latency_ms, 1),
+                "evictions": self.evictions,
+                "entries": self._entries,
+                "threshold": self.threshold,
+            }
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_answer_cache():
+    """Shared answer cache, or None when disabled"""
+    global _cache
+    if not ANSWER_CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = AnswerCache()
+        return _cache
@@ -1,100 +1,103 @@
-from flask import Flask, jsonify, send_from_directory, request
+from flask import Flask, Response, jsonify, send_from_directory, request
 from flask_cors import CORS
 import os
 import json
 import uuid
+import time
+import heapq
+import hashlib
+import itertools
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from supabase import create_client, Client
-from pinecone import Pinecone
-import openai
-from docling.document_converter import DocumentConverter
-from docling.datamodel.base_models import InputFormat
-from docling.datamodel.pipeline_options import PdfPipelineOptions
-from docling.document_converter import PdfFormatOption
 import tempfile
 from werkzeug.utils import secure_filename
-from replit import db
+from embeddings import EMBEDDING_BATCH_SIZE, EMBEDDING_MAX_WORKERS, embed_texts, get_embedding_cache
+from jobs import create_job, get_job, update_job, increment_job, add_job_error, submit_job, check_cancelled, cancel_jobs
+from pipeline import run_pipeline, batched, map_ordered, call_with_retry
+from parsers import iter_json_file, iter_jsonl_file_auto
+from conversion import convert_document, get_conversion_cache, pdf_page_count
+from vector_store import Match
+from reference_index import get_reference_index, parse_citations
+from lexical_index import get_lexical_index, drop_lexical_index, search_lexical, reciprocal_rank_fusion
+from dedup import DEDUP_ENABLED, get_dedup_index, drop_dedup_index
+from rerank import MMR_POOL_SIZE, diversify_matches
+from context_packer import CONTEXT_CANDIDATES, count_tokens, pack_context
+from retrieval_cache import get_retrieval_cache
+from answer_cache import get_answer_cache, context_fingerprint
+from services import SERVICE_WARM_UP, get_openai, get_supabase, get_vector_store, service_status, start_warm_up
+from metrics import REQUESTS, REQUEST_SECONDS, span, timed_iter, start_request_timings, current_request_timings, render as render_metrics
+import storage
 
 load_dotenv()
 
 app = Flask(__name__, static_folder="../frontend/build", static_url_path="/")
 CORS(app)
 
-# Initialize services
-supabase_url = os.getenv("SUPABASE_URL")
-supabase_key = os.getenv("SUPABASE_KEY")
-supabase: Client = create_client(supabase_url, supabase_key)
-
-pinecone_api_key = os.getenv("PINECONE_API_KEY")
-pinecone_client = Pinecone(api_key=pinecone_api_key) if pinecone_api_key else None
-openai.api_key = os.getenv("OPENAI_API_KEY")
-
-# Initialize Docling converter
-converter = DocumentConverter()
-
-# Persistent storage using Replit Key-Value Store
-def get_reference_sets():
-    """Get all reference sets from persistent storage"""
-    try:
-        return db.get("reference_sets", {})
-    except:
-        return {}
-
-def save_reference_set(ref_set_id, reference_set):
-    """Save reference set to persistent storage"""
-    reference_sets = get_reference_sets()
-    reference_sets[ref_set_id] = reference_set
-    db["reference_sets"] = reference_sets
-
-def get_inquiries():
-    """Get all inquiries from persistent storage"""
-    try:
-        return db.get("inquiries", {})
-    except:
-        return {}
-
-def save_inquiry(inquiry_id, inquiry):
-    """Save inquiry to persistent storage"""
-    inquiries = get_inquiries()
-    inquiries[inquiry_id] = inquiry
-    db["inquiries"] = inquiries
-
-# Get or create Pinecone index
-PINECONE_INDEX_NAME = "research-assistant"
-if pinecone_client:
+def start_server_process():
+    """One-time startup work of the server process"""
+    # Persistent storage: one SQLite row per reference set / inquiry (see storage.py).
+    # Data from the old Replit Key-Value Store layout is copied over on first start.
     try:
-        # Try to get existing index
-        index = pinecone_client.Index(PINECONE_INDEX_NAME)
-    except:
-        # Create index if it doesn't exist
-        try:
-            pinecone_client.create_index(
-                name=PINECONE_INDEX_NAME,
-                dimension=1536,  # OpenAI embedding dimension
-                metric="cosine",
-                spec={
-                    "serverless": {
-                        "cloud": "aws",
-                        "region": "us-east-1"
-                    }
-                }
-            )
-            index = pinecone_client.Index(PINECONE_INDEX_NAME)
-        except Exception as e:
-            print(f"Error creating Pinecone index: {e}")
-            index = None
-else:
-    index = None
+        from replit import db as replit_db
+        storage.migrate_from_kv(replit_db)
+    except ImportError:
+        pass
+
+    # Service clients (Supabase, Pinecone/vector store, OpenAI, Docling) are created on
+    # first use; SERVICE_WARM_UP=1 creates them in the background at startup instead
+    if SERVICE_WARM_UP:
+        start_warm_up()
+
+# Conversion and JSONL parse workers are spawned, and a spawned worker imports
+# this file again (as __mp_main__ when it was run as a script) before it knows
+# its parent; only the server process itself may migrate data or start warm-up,
+# which creates worker pools. A spawned worker is already named at that point.
+if multiprocessing.current_process().name == "MainProcess":
+    start_server_process()
+
+@app.before_request
+def start_request_metrics():
+    start_request_timings()
+
+@app.after_request
+def record_request_metrics(response):
+    timings = current_request_timings()
+    if timings is not None and request.path.startswith("/api/"):
+        # Route templates (not raw paths) as labels, so ids don't create a series each
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        REQUEST_SECONDS.observe(time.perf_counter() - timings.started, method=request.method, endpoint=endpoint)
+        REQUESTS.inc(method=request.method, endpoint=endpoint, status=response.status_code)
+    return response
+
+@app.route("/metrics")
+def metrics():
+    """Stage timings and request counters in the Prometheus text format"""
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+def with_timings(result, data):
+    """Add the per-stage timing breakdown to a response body when the request asked for it ("timings": true)"""
+    timings = current_request_timings()
+    if data.get("timings") and timings is not None:
+        result["timings"] = timings.breakdown()
+    return result
 
 @app.route("/api/hello")
 def hello():
     return jsonify(message="Research Assistant API is running!")
 
+@app.route("/api/ready")
+def ready():
+    """Readiness probe: 503 until background warm-up (if enabled) has finished; lists initialized services"""
+    status = service_status()
+    return jsonify(status), 200 if status["ready"] else 503
+
 @app.route("/api/auth/login", methods=["POST"])
 def login():
     data = request.get_json()
     try:
-        response = supabase.auth.sign_in_with_password({
+        response = get_supabase().auth.sign_in_with_password({
             "email": data["email"],
             "password": data["password"]
         })
@@ -106,7 +109,7 @@ def login():
 def signup():
     data = request.get_json()
     try:
-        response = supabase.auth.sign_up({
+        response = get_supabase().auth.sign_up({
             "email": data["email"],
             "password": data["password"]
         })
@@ -117,10 +120,7 @@ def signup():
 @app.route("/api/reference-sets", methods=["GET"])
 def api_get_reference_sets():
     # Return stored reference sets
-    reference_sets_dict = get_reference_sets()
-    # Convert ObservedDict objects to regular dicts for JSON serialization
-    reference_sets_list = [dict(ref_set) for ref_set in reference_sets_dict.values()]
-    return jsonify({"reference_sets": reference_sets_list})
+    return jsonify({"reference_sets": storage.list_reference_sets()})
 
 @app.route("/api/reference-sets", methods=["POST"])
 def create_reference_set():
@@ -141,18 +141,39 @@ def create_reference_set():
         "description": description,
         "file_count": 0
     }
-    save_reference_set(ref_set_id, reference_set)
+    storage.save_reference_set(ref_set_id, reference_set)
 
     print(f"Creating reference set with domain: {domain} - {description}")
     return jsonify({"success": True, "message": "Reference set created", "id": ref_set_id, "domain": domain})
 
 @app.route("/api/inquiries", methods=["GET"])
 def api_get_inquiries():
-    # Return stored inquiries
-    inquiries_dict = get_inquiries()
-    # Convert ObservedDict objects to regular dicts for JSON serialization
-    inquiries_list = [dict(inquiry) for inquiry in inquiries_dict.values()]
-    return jsonify({"inquiries": inquiries_list})
+    # Return inquiry summaries; message history is paged from /api/inquiries/<id>/messages
+    return jsonify({"inquiries": storage.list_inquiries()})
+
+MESSAGES_PAGE_SIZE = 50
+MESSAGES_MAX_PAGE_SIZE = 200
+
+@app.route("/api/inquiries/<inquiry_id>/messages", methods=["GET"])
+def api_get_inquiry_messages(inquiry_id):
+    """Page through an inquiry's chat history, newest page first
+
+    Pass the returned next_cursor as ?cursor= to fetch the page before it.
+    """
+    if not storage.get_inquiry(inquiry_id):
+        return jsonify({"error": "Inquiry not found"}), 404
+
+    cursor = request.args.get("cursor") or None
+    if cursor is not None and not cursor.isdigit():
+        return jsonify({"error": "Invalid cursor"}), 400
+    try:
+        limit = int(request.args.get("limit", MESSAGES_PAGE_SIZE))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    limit = max(1, min(limit, MESSAGES_MAX_PAGE_SIZE))
+
+    messages, next_cursor = storage.list_messages(inquiry_id, cursor=cursor, limit=limit)
+    return jsonify({"messages": messages, "next_cursor": next_cursor})
 
 @app.route("/api/inquiries", methods=["POST"])
 def create_inquiry():
@@ -175,25 +196,242 @@ def create_inquiry():
         "id": inquiry_id,
         "title": title,
         "description": description,
-        "reference_sets": reference_sets,
-        "messages": []
+        "reference_sets": reference_sets
     }
-    save_inquiry(inquiry_id, inquiry)
+    storage.save_inquiry(inquiry_id, inquiry)
 
     print(f"Creating inquiry: {title} - {description} with reference sets: {reference_sets}")
     return jsonify({"success": True, "message": "Inquiry created", "inquiry_id": inquiry_id})
 
 def get_embedding(text):
-    """Get OpenAI embedding for text"""
-    try:
-        response = openai.embeddings.create(
-            model="text-embedding-ada-002",
-            input=text
-        )
-        return response.data[0].embedding
-    except Exception as e:
-        print(f"Error getting embedding: {e}")
+    """Get OpenAI embedding for text (served from the embedding cache when possible)"""
+    return embed_texts([text])[0]
+
+@app.route("/api/cache/stats", methods=["GET"])
+def cache_stats():
+    """Report hit/miss counters for the local caches"""
+    embedding_cache = get_embedding_cache()
+    retrieval_cache = get_retrieval_cache()
+    answer_cache = get_answer_cache()
+    conversion_cache = get_conversion_cache()
+    return jsonify({
+        "embedding_cache": embedding_cache.stats() if embedding_cache else None,
+        "retrieval_cache": retrieval_cache.stats() if retrieval_cache else None,
+        "answer_cache": answer_cache.stats() if answer_cache else None,
+        "conversion_cache": conversion_cache.stats() if conversion_cache else None
+    })
+
+def invalidate_retrieval_cache(ref_set_id):
+    """Drop cached search results that cover a reference set"""
+    retrieval_cache = get_retrieval_cache()
+    if retrieval_cache:
+        retrieval_cache.bump(ref_set_id)
+
+def lookup_cited_verses(query, ref_set_ids):
+    """Matches for verse citations in the query ("2:255", "Al-Baqarah 255"), or None"""
+    reference_index = get_reference_index()
+    citations = parse_citations(query, reference_index.names())
+    if not citations:
         return None
+    verses = reference_index.lookup(citations, ref_set_ids)
+    if not verses:
+        return None
+    return [Match(chunk_id, 1.0, metadata) for chunk_id, metadata in verses]
+
+# "vector", "lexical" (BM25 only, no embedding call) or "hybrid" (both, fused by reciprocal rank)
+SEARCH_MODE = os.getenv("SEARCH_MODE", "hybrid")
+SEARCH_MODES = ("vector", "lexical", "hybrid")
+QUERY_FANOUT_WORKERS = int(os.getenv("QUERY_FANOUT_WORKERS", "8"))
+
+def search_reference_sets(query, ref_set_ids, top_k, min_score=None, mode=None, diversify=False):
+    """Search reference sets for a query, served from the retrieval cache when possible
+
+    Verse citations are answered straight from the reference index without an
+    embedding (the returned embedding is then None). If the query can't be
+    embedded, vector and hybrid searches fall back to lexical results. With
+    `diversify`, a wider candidate pool is fetched (with vectors) and re-ranked
+    by maximal marginal relevance down to top_k.
+
+    Returns (query embedding, matches, mode used), where the mode is one of
+    SEARCH_MODES or "reference"; matches is None if nothing could be searched.
+    """
+    result, plan = start_search(query, ref_set_ids, top_k, min_score, mode, diversify)
+    if plan is None:
+        return result
+
+    query_embedding = get_embedding(query)
+    if not query_embedding:
+        return lexical_fallback(query, plan["ref_set_ids"], top_k, plan["mode"])
+    matches = query_vectors(query_embedding, plan["ref_set_ids"], plan["pool_size"], include_values=diversify)
+    lexical_matches = keyword_search(query, plan["ref_set_ids"], plan["pool_size"]) if plan["mode"] == "hybrid" else None
+    return finish_search(plan, query_embedding, matches, lexical_matches)
+
+def start_search(query, ref_set_ids, top_k, min_score=None, mode=None, diversify=False):
+    """The steps of a search that come before embedding the query (shared with the async server)
+
+    Returns (result, None) when the search is already answered (no known
+    reference sets, a verse citation, keyword-only mode, or a cached result),
+    else (None, plan), where the plan holds what the remaining steps need.
+    """
+    mode = mode or SEARCH_MODE
+    if ref_set_ids:
+        # Only search reference sets that exist; an empty list would mean all of them
+        ref_set_ids = known_reference_sets(ref_set_ids)
+        if not ref_set_ids:
+            return (None, [], mode), None
+    matches = lookup_cited_verses(query, ref_set_ids)
+    if matches is not None:
+        return (None, matches, "reference"), None
+
+    if mode == "lexical":
+        return (None, keyword_search(query, ref_set_ids, top_k), "lexical"), None
+
+    cache_key = None
+    retrieval_cache = get_retrieval_cache()
+    if retrieval_cache:
+        cache_key = retrieval_cache.key(query, ref_set_ids, top_k=top_k, min_score=min_score, mode=mode,
+                                        diversify=diversify)
+        cached = retrieval_cache.get(cache_key)
+        if cached is not None:
+            return cached, None
+
+    return None, {
+        "ref_set_ids": ref_set_ids,
+        "top_k": top_k,
+        "min_score": min_score,
+        "mode": mode,
+        "diversify": diversify,
+        "pool_size": search_pool_size(top_k, diversify),
+        "cache_key": cache_key,
+    }
+
+def finish_search(plan, query_embedding, vector_matches, lexical_matches):
+    """Fuse and re-rank a planned search's candidates, and cache the result"""
+    matches = combine_matches(vector_matches, lexical_matches, plan["top_k"], plan["pool_size"], plan["diversify"],
+                              plan["min_score"])
+    result = (query_embedding, matches, plan["mode"])
+    retrieval_cache = get_retrieval_cache()
+    if retrieval_cache and plan["cache_key"] is not None:
+        retrieval_cache.put(plan["cache_key"], result)
+    return result
+
+def search_pool_size(top_k, diversify):
+    """Candidates to fetch per search: a wider pool when it will be re-ranked with MMR"""
+    return max(top_k, MMR_POOL_SIZE) if diversify else top_k
+
+def known_reference_sets(ref_set_ids):
+    """The ids that name existing reference sets (request ids also name namespaces and index directories)"""
+    return [ref_set_id for ref_set_id in ref_set_ids
+            if isinstance(ref_set_id, str) and storage.get_reference_set(ref_set_id)]
+
+def searchable_reference_sets(ref_set_ids):
+    """The existing reference sets among ref_set_ids, or all of them when none are given"""
+    if ref_set_ids:
+        return known_reference_sets(ref_set_ids)
+    return [ref_set["id"] for ref_set in storage.list_reference_sets()]
+
+def keyword_search(query, ref_set_ids, top_k):
+    """BM25 matches in reference sets (all existing ones when none are given)"""
+    return search_lexical(query, searchable_reference_sets(ref_set_ids), top_k)
+
+def vector_namespaces(ref_set_ids):
+    """(namespace, filter) pairs to query for reference sets (all of them when none are given)
+
+    Each reference set's vectors live in a namespace named after it. Vectors
+    upserted before that are in the default namespace, told apart by their
+    reference_set_id metadata, and are searched there too while any remain.
+    """
+    ref_set_ids = searchable_reference_sets(ref_set_ids)
+    targets = [(ref_set_id, None) for ref_set_id in ref_set_ids]
+    if ref_set_ids and has_legacy_vectors():
+        if len(ref_set_ids) == 1:
+            targets.append(("", {"reference_set_id": ref_set_ids[0]}))
+        else:
+            targets.append(("", {"reference_set_id": {"$in": ref_set_ids}}))
+    return targets
+
+_legacy_vectors = None
+
+def has_legacy_vectors():
+    """Whether the default namespace still holds vectors from before per-reference-set namespaces
+
+    Checked once, then again after each deletion from the default namespace
+    (see delete_legacy_vectors), so searches stop querying it once it is empty.
+    """
+    global _legacy_vectors
+    if _legacy_vectors is None:
+        try:
+            _legacy_vectors = get_vector_store().namespace_size("") > 0
+        except Exception as e:
+            print(f"Error checking the default namespace: {e}")
+            return True
+    return _legacy_vectors
+
+def delete_legacy_vectors(filter):
+    """Delete vectors matching a metadata filter from the default namespace"""
+    global _legacy_vectors
+    try:
+        get_vector_store().delete(filter=filter, namespace="")
+    finally:
+        _legacy_vectors = None
+
+def query_namespace(query_embedding, namespace, filter, top_k, include_values=False):
+    """Vector store matches for an embedding in one namespace"""
+    return get_vector_store().query(
+        vector=query_embedding, top_k=top_k, include_metadata=True, include_values=include_values,
+        filter=filter, namespace=namespace
+    ).matches
+
+def merge_matches(match_lists, top_k):
+    """Best top_k matches across per-namespace results, highest score first"""
+    if len(match_lists) == 1:
+        return match_lists[0][:top_k]
+    return heapq.nlargest(top_k, itertools.chain.from_iterable(match_lists), key=lambda match: match.score)
+
+_query_executor = None
+_query_executor_lock = threading.Lock()
+
+def get_query_executor():
+    """Shared pool for fanning a search out over reference set namespaces"""
+    global _query_executor
+    with _query_executor_lock:
+        if _query_executor is None:
+            _query_executor = ThreadPoolExecutor(max_workers=QUERY_FANOUT_WORKERS, thread_name_prefix="query")
+        return _query_executor
+
+def query_vectors(query_embedding, ref_set_ids, top_k, include_values=False):
+    """Vector store matches for an embedding within reference sets, one parallel query per namespace"""
+    targets = vector_namespaces(ref_set_ids)
+    with span("query"):
+        if len(targets) <= 1:
+            return [match for namespace, filter in targets
+                    for match in query_namespace(query_embedding, namespace, filter, top_k, include_values)]
+        futures = [get_query_executor().submit(query_namespace, query_embedding, namespace, filter, top_k, include_values)
+                   for namespace, filter in targets]
+        return merge_matches([future.result() for future in futures], top_k)
+
+def combine_matches(vector_matches, lexical_matches, top_k, pool_size, diversify, min_score=None):
+    """Fuse vector and (for hybrid search) lexical candidates, then re-rank with MMR if asked
+
+    Fused scores are rank based, so for hybrid search min_score is applied to
+    the vector candidates' similarities before fusion.
+    """
+    matches = vector_matches
+    if lexical_matches is not None:
+        if min_score is not None:
+            matches = [match for match in matches if match.score >= min_score]
+        matches = reciprocal_rank_fusion([matches, lexical_matches], pool_size)
+    if diversify:
+        matches = diversify_matches(matches, top_k)
+    return matches
+
+def lexical_fallback(query, ref_set_ids, top_k, mode):
+    """Search result when the query couldn't be embedded: lexical matches if there are any"""
+    lexical_matches = keyword_search(query, ref_set_ids, top_k)
+    if lexical_matches:
+        print("Query embedding failed; using lexical results only")
+        return None, lexical_matches, "lexical"
+    return None, None, mode
 
 def chunk_text(text, max_chunk_size=1000, overlap=100):
     """Split text into overlapping chunks"""
@@ -222,9 +460,47 @@ def chunk_text(text, max_chunk_size=1000, overlap=100):
 
     return chunks
 
+def chunk_content_hash(metadata):
+    """Hash of everything stored with a chunk, used to spot unchanged chunks on re-upload"""
+    return hashlib.sha256(json.dumps(metadata, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+def chunk_namespaces(ref_set_id):
+    """Namespaces that may hold a reference set's vectors (its own, plus the default one for older uploads)"""
+    return [ref_set_id, ""] if has_legacy_vectors() else [ref_set_id]
+
+def index_promoted_chunks(ref_set_id, chunks):
+    """Embed and upsert duplicates promoted to canonical chunks outside an ingestion job"""
+    embeddings = embed_texts(chunk['metadata']['text'] for chunk in chunks)
+    vectors = []
+    for chunk, embedding in zip(chunks, embeddings):
+        if not embedding:
+            print(f"Failed to get embedding for promoted duplicate {chunk['id']}")
+            continue
+        vectors.append(dict(chunk, values=embedding))
+    for batch in batched(vectors, UPSERT_BATCH_SIZE):
+        call_with_retry(get_vector_store().upsert, batch, namespace=ref_set_id)
+        get_lexical_index(ref_set_id).add(batch)
+    return len(vectors)
+
+def delete_chunks(ref_set_id, chunk_ids):
+    """Remove chunks from the vector store and search indexes in batches, promoting a duplicate of each; returns vectors deleted"""
+    if DEDUP_ENABLED:
+        dedup_index = get_dedup_index(ref_set_id)
+        promoted = dedup_index.release(chunk_ids)
+        dedup_index.discard(chunk_ids)
+        if promoted:
+            index_promoted_chunks(ref_set_id, promoted)
+    for namespace in chunk_namespaces(ref_set_id):
+        for batch in batched(chunk_ids, UPSERT_BATCH_SIZE):
+            call_with_retry(get_vector_store().delete, ids=batch, namespace=namespace)
+    get_lexical_index(ref_set_id).remove(chunk_ids)
+    get_reference_index().remove(ref_set_id, chunk_ids)
+    invalidate_retrieval_cache(ref_set_id)
+    return len(chunk_ids)
+
 @app.route("/api/reference-sets/<ref_set_id>/upload", methods=["POST"])
 def upload_file_to_reference_set(ref_set_id):
-    """Upload and process file for a specific reference set"""
+    """Accept a file for a reference set and queue it for background ingestion"""
     if 'file' not in request.files:
         return jsonify({"error": "No file provided"}), 400
 
@@ -232,393 +508,300 @@ def upload_file_to_reference_set(ref_set_id):
     if file.filename == '':
         return jsonify({"error": "No file selected"}), 400
 
+    if not storage.get_reference_set(ref_set_id):
+        return jsonify({"error": "Reference set not found"}), 404
+
     # Get domain from form data
     domain = request.form.get('domain', 'Unknown Domain')
 
     try:
-        # Save file temporarily
+        # Save file temporarily (unique name so concurrent uploads of the same file don't collide)
         filename = secure_filename(file.filename)
-        temp_path = os.path.join(tempfile.gettempdir(), filename)
-        file.save(temp_path)
-
+        temp_path = os.path.join(tempfile.gettempdir(), f"{uuid.uuid4().hex}_{filename}")
+        with span("file_save"):
+            file.save(temp_path)
+    except Exception as e:
+        print(f"Error saving upload: {e}")
+        return jsonify({"error": f"Error saving file: {str(e)}"}), 500
+
+    invalidate_retrieval_cache(ref_set_id)
+    job_id = create_job("ingest", reference_set_id=ref_set_id, filename=filename)
+    submit_job(job_id, ingest_file, ref_set_id, temp_path, filename, domain)
+
+    print(f"Queued ingestion job {job_id} for {filename}")
+    return jsonify({
+        "success": True,
+        "message": "File queued for processing",
+        "job_id": job_id,
+        "status_url": f"/api/jobs/{job_id}"
+    }), 202
+
+@app.route("/api/jobs/<job_id>", methods=["GET"])
+def api_get_job(job_id):
+    """Report progress of a background job"""
+    job = get_job(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
+UPSERT_BATCH_SIZE = 100
+PIPELINE_QUEUE_SIZE = 8
+JOB_CANCEL_TIMEOUT = 60  # Seconds a reference set delete waits for its running uploads to stop
+
+def iter_upload_pages(job_id, temp_path, file_extension):
+    """Yield page/entry dicts from an uploaded file"""
+    if file_extension == 'jsonl':
+        # Process JSONL file with structure preservation
+        yield from timed_iter("parse", iter_jsonl_file_auto(temp_path))
+    elif file_extension == 'json':
+        # Process JSON file with structure preservation
+        yield from timed_iter("parse", iter_json_file(temp_path))
+    else:
+        # Process with Docling for other formats (in worker processes, cached by file content)
+        update_job(job_id, stage="converting")
+        if file_extension == 'pdf':
+            # Only a PDF's page count is known before it is converted; for other files it is set at the end
+            update_job(job_id, pages_total=pdf_page_count(temp_path) or 0)
+        for page_index, page in enumerate(timed_iter("convert", convert_document(temp_path))):
+            if page_index == 0:
+                update_job(job_id, stage="streaming")
+            yield page
+
+def ingest_file(job_id, ref_set_id, temp_path, filename, domain):
+    """Stream an uploaded file through parse -> chunk -> embed -> upsert, reporting progress on the job"""
+    try:
         # Check file extension and process accordingly
         file_extension = filename.split('.')[-1].lower() if '.' in filename else ''
+        file_type = file_extension or 'unknown'
+        stats = {"pages": 0, "chunks": 0, "vectors": 0, "deduplicated": 0, "unchanged": 0}
 
-        print(f"Processing file: {filename}")
-
-        if file_extension == 'jsonl':
-            # Process JSONL file with structure preservation
-            pages_info = process_jsonl_file(temp_path)
-            if not pages_info:
-                raise Exception("No valid JSON objects found in JSONL file")
-        elif file_extension == 'json':
-            # Process JSON file with structure preservation
-            pages_info = process_json_file(temp_path)
-            if not pages_info:
-                raise Exception("No valid data found in JSON file")
-        else:
-            # Process with Docling for other formats
-            result = converter.convert(temp_path)
-
-            # Extract text and page information
-            document_text = result.document.export_to_markdown()
-
-            # Get page information if available
-            pages_info = []
-            if hasattr(result.document, 'pages') and result.document.pages:
-                for i, page in enumerate(result.document.pages):
-                    pages_info.append({
-                        'page_num': i + 1,
-                        'text': page.export_to_markdown() if hasattr(page, 'export_to_markdown') else str(page)
-                    })
-            else:
-                # If no page info available, treat as single page
-                pages_info = [{'page_num': 1, 'text': document_text}]
+        # Chunks already ingested with identical content are skipped; chunks the
+        # new version no longer has are deleted once it has been ingested
+        old_hashes = storage.get_document_manifest(ref_set_id, filename) or {}
+        manifest = {}
+        failed_ids = set()
 
-        # Process each page
-        total_chunks = 0
-        vectors_to_upsert = []
-        
-        print(f"Processing {len(pages_info)} pages/entries from {filename}...")
-
-        for idx, page_info in enumerate(pages_info):
-            if idx % 10 == 0:  # Log progress every 10 pages
-                print(f"  Processing entry {idx + 1}/{len(pages_info)}...")
-            page_text = page_info['text']
-            page_num = page_info['page_num']
-            metadata = page_info.get('metadata', {})
-            raw_json = page_info.get('raw_json')
-
-            # Split page into chunks
-            chunks = chunk_text(page_text)
-
-            for i, chunk in enumerate(chunks):
-                if len(chunk.strip()) < 50:  # Skip very short chunks
-                    continue
-
-                # Get embedding
-                embedding = get_embedding(chunk)
-                if not embedding:
-                    print(f"    Failed to get embedding for chunk {i} on page {page_num}")
-                    continue
-
-                # Create unique ID for this chunk
-                chunk_id = f"{ref_set_id}_{filename}_{page_num}_{i}"
-
-                # Prepare metadata
-                chunk_metadata = {
-                    'domain': domain,
-                    'reference_set_id': ref_set_id,
-                    'document_name': filename,
-                    'page_number': page_num,
-                    'chunk_index': i,
-                    'text': chunk,
-                    'file_type': filename.split('.')[-1].lower() if '.' in filename else 'unknown',
-                }
-                chunk_metadata.update(metadata)  # Add extracted metadata
-
-                vectors_to_upsert.append({
-                    'id': chunk_id,
-                    'values': embedding,
-                    'metadata': chunk_metadata
-                })
-
-                total_chunks += 1
-
-        # Upsert to Pinecone in batches
-        if index and vectors_to_upsert:
-            print(f"Uploading {len(vectors_to_upsert)} chunks to vector database...")
-            batch_size = 100
-            for i in range(0, len(vectors_to_upsert), batch_size):
-                batch = vectors_to_upsert[i:i + batch_size]
+        print(f"Processing file: {filename}")
+        update_job(job_id, stage="streaming")
+
+        def chunk_stage(pages):
+            for page_info in pages:
+                if stats["pages"] % 10 == 0:  # Log progress every 10 pages
+                    print(f"  Processing entry {stats['pages'] + 1}...")
+                stats["pages"] += 1
+                page_num = page_info['page_num']
+                metadata = page_info.get('metadata', {})
+
+                # Split page into chunks
+                with span("chunk"):
+                    chunks = chunk_text(page_info['text'])
+                for i, chunk in enumerate(chunks):
+                    if len(chunk.strip()) < 50:  # Skip very short chunks
+                        continue
+
+                    # Prepare metadata
+                    chunk_metadata = {
+                        'domain': domain,
+                        'reference_set_id': ref_set_id,
+                        'document_name': filename,
+                        'page_number': page_num,
+                        'chunk_index': i,
+                        'text': chunk,
+                        'file_type': file_type,
+                    }
+                    chunk_metadata.update(metadata)  # Add extracted metadata
+
+                    # Create unique ID for this chunk
+                    chunk_id = f"{ref_set_id}_{filename}_{page_num}_{i}"
+                    manifest[chunk_id] = chunk_content_hash(chunk_metadata)
+                    if old_hashes.get(chunk_id) == manifest[chunk_id]:
+                        stats["unchanged"] += 1
+                        increment_job(job_id, chunks_unchanged=1, embedding_calls_saved=1)
+                        continue
+
+                    yield {
+                        'id': chunk_id,
+                        'metadata': chunk_metadata
+                    }
+                increment_job(job_id, pages_done=1)
+
+        def dedup_stage(chunks):
+            # Link exact and near-duplicate chunks to the chunk they repeat, before anything is embedded.
+            # Duplicates of a changed chunk lose what they were linked to, so one of them is promoted
+            # and goes on to be embedded like a new chunk.
+            dedup_index = get_dedup_index(ref_set_id)
+            for batch in batched(chunks, EMBEDDING_BATCH_SIZE):
+                duplicates = 0
+                with span("dedup"):
+                    promoted = dedup_index.release([chunk['id'] for chunk in batch])
+                    canonical_ids = dedup_index.check(batch)
+                yield from promoted
+                for chunk, canonical_id in zip(batch, canonical_ids):
+                    if canonical_id:
+                        duplicates += 1
+                        chunk = dict(chunk, duplicate_of=canonical_id)
+                    yield chunk
+                stats["deduplicated"] += duplicates
+                increment_job(job_id, chunks_deduplicated=duplicates, embedding_calls_saved=duplicates)
+
+        def embed_stage(chunks):
+            # Several embedding batches in flight; results come back in chunk order.
+            # Duplicates pass through without an embedding.
+            def embed_batch(batch):
+                texts = [chunk['metadata']['text'] for chunk in batch if 'duplicate_of' not in chunk]
+                return iter(embed_texts(texts) if texts else [])
+
+            for batch, embeddings in map_ordered(embed_batch, batched(chunks, EMBEDDING_BATCH_SIZE), EMBEDDING_MAX_WORKERS):
+                embedded = 0
+                failed = []
+                for chunk in batch:
+                    if 'duplicate_of' in chunk:
+                        yield chunk
+                        continue
+                    embedding = next(embeddings)
+                    if not embedding:
+                        metadata = chunk['metadata']
+                        print(f"    Failed to get embedding for chunk {metadata['chunk_index']} on page {metadata['page_number']}")
+                        add_job_error(job_id, f"Failed to get embedding for chunk {metadata['chunk_index']} on page {metadata['page_number']}")
+                        failed.append(chunk['id'])
+                        continue
+                    embedded += 1
+                    yield dict(chunk, values=embedding)
+                failed_ids.update(failed)
+                if failed and DEDUP_ENABLED:
+                    # Duplicates linked to a failed chunk have no vector either; retry them with it next upload
+                    failed_ids.update(get_dedup_index(ref_set_id).discard(failed))
+                stats["chunks"] += embedded
+                increment_job(job_id, chunks_embedded=embedded)
+
+        def upsert_stage(vectors):
+            # Upsert to the vector store in batches; a failed batch is retried on its own
+            # Duplicates get no vector of their own, but still go into the verse index so
+            # every cited verse can be looked up
+            for batch_num, batch in enumerate(batched(vectors, UPSERT_BATCH_SIZE), start=1):
+                check_cancelled(job_id)  # The reference set is being deleted; write nothing more
+                unique = [vector for vector in batch if 'duplicate_of' not in vector]
+                # A changed chunk that is now a duplicate drops the vector of its old content
+                replaced = [vector['id'] for vector in batch if 'duplicate_of' in vector and vector['id'] in old_hashes]
                 try:
-                    index.upsert(vectors=batch)
-                    print(f"  Uploaded batch {i//batch_size + 1}/{(len(vectors_to_upsert) + batch_size - 1)//batch_size}")
+                    if unique:
+                        with span("upsert"):
+                            call_with_retry(get_vector_store().upsert, unique, namespace=ref_set_id)
+                        get_lexical_index(ref_set_id).add(unique)
+                    if replaced:
+                        for namespace in chunk_namespaces(ref_set_id):
+                            call_with_retry(get_vector_store().delete, ids=replaced, namespace=namespace)
+                        get_lexical_index(ref_set_id).remove(replaced)
+                    get_reference_index().add(ref_set_id, batch)
+                    # New vectors are searchable now; don't serve results from before them
+                    invalidate_retrieval_cache(ref_set_id)
+                    stats["vectors"] += len(unique)
+                    increment_job(job_id, vectors_upserted=len(unique))
+                    print(f"  Uploaded batch {batch_num}")
                 except Exception as e:
                     print(f"  Error uploading batch: {e}")
-        elif not index:
-            print("Warning: No Pinecone index available - content processed but not stored for search")
-        elif not vectors_to_upsert:
-            print("Warning: No valid chunks created - check OpenAI API connection")
+                    add_job_error(job_id, f"Error uploading batch {batch_num}: {e}")
+                    failed_ids.update(vector['id'] for vector in unique)
+                    if DEDUP_ENABLED:
+                        failed_ids.update(get_dedup_index(ref_set_id).discard([vector['id'] for vector in unique]))
+                yield batch_num
+
+        pages = iter_upload_pages(job_id, temp_path, file_extension)
+        stages = [chunk_stage, dedup_stage, embed_stage, upsert_stage] if DEDUP_ENABLED else [chunk_stage, embed_stage, upsert_stage]
+        for _ in run_pipeline(pages, stages, queue_size=PIPELINE_QUEUE_SIZE):
+            pass
+
+        if not stats["pages"]:
+            if file_extension == 'jsonl':
+                raise Exception("No valid JSON objects found in JSONL file")
+            if file_extension == 'json':
+                raise Exception("No valid data found in JSON file")
+        update_job(job_id, pages_total=stats["pages"])
 
+        if not stats["chunks"] and not stats["deduplicated"] and not stats["unchanged"]:
+            print("Warning: No valid chunks created - check OpenAI API connection")
+            add_job_error(job_id, "No valid chunks created - check OpenAI API connection")
+
+        # Delete chunks the new version dropped, then record what is stored now.
+        # Chunks that failed keep their previous hash (or none) so the next upload retries them.
+        check_cancelled(job_id)
+        update_job(job_id, stage="finalizing")
+        stale = [chunk_id for chunk_id in old_hashes if chunk_id not in manifest]
+        deleted = 0
+        if stale:
+            deleted = delete_chunks(ref_set_id, stale)
+            increment_job(job_id, vectors_deleted=deleted)
+            print(f"  Deleted {deleted} stale chunks")
+        if not old_hashes and has_legacy_vectors():
+            # A document uploaded before manifests has no record of its chunks; its vectors
+            # in the default namespace are superseded by the ones just upserted
+            try:
+                delete_legacy_vectors({"reference_set_id": ref_set_id, "document_name": filename})
+            except Exception as e:
+                print(f"  Error deleting legacy vectors for {filename}: {e}")
+        for chunk_id in failed_ids:
+            if chunk_id in old_hashes:
+                manifest[chunk_id] = old_hashes[chunk_id]
+            else:
+                manifest.pop(chunk_id, None)
+
+        # Only a document new to the reference set adds to its file count
+        if storage.save_document_manifest(ref_set_id, filename, manifest):
+            file_count = storage.increment_file_count(ref_set_id)
+            if file_count is not None:
+                print(f"Updated file count for reference set {ref_set_id}: {file_count} files")
+
+        print(f"Successfully processed {filename}: {stats['chunks']} chunks across {stats['pages']} pages"
+              f" ({stats['unchanged']} unchanged, {stats['deduplicated']} duplicates linked, {deleted} stale deleted)")
+
+        return {
+            "filename": filename,
+            "pages": stats["pages"],
+            "chunks": stats["chunks"],
+            "unchanged": stats["unchanged"],
+            "stale_deleted": deleted,
+            "deduplicated": stats["deduplicated"],
+            "embedding_calls_saved": stats["deduplicated"] + stats["unchanged"],
+            "domain": domain
+        }
+
+    finally:
         # Clean up temp file
-        os.remove(temp_path)
-
-        # Update file count for the reference set (fix: always increment, even if embeddings failed)
-        reference_sets = get_reference_sets()
-        if ref_set_id in reference_sets:
-            reference_sets[ref_set_id]["file_count"] += 1
-            save_reference_set(ref_set_id, reference_sets[ref_set_id])
-            print(f"Updated file count for reference set {ref_set_id}: {reference_sets[ref_set_id]['file_count']} files")
-
-        print(f"Successfully processed {filename}: {total_chunks} chunks across {len(pages_info)} pages")
-
-        return jsonify({
-            "success": True, 
-            "message": f"File processed successfully",
-            "stats": {
-                "filename": filename,
-                "pages": len(pages_info),
-                "chunks": total_chunks,
-                "domain": domain
-            }
-        })
-
-    except Exception as e:
-        # Clean up temp file if it exists
-        if 'temp_path' in locals() and os.path.exists(temp_path):
+        if os.path.exists(temp_path):
             os.remove(temp_path)
 
-        print(f"Error processing file: {e}")
-        return jsonify({"error": f"Error processing file: {str(e)}"}), 500
-
-def process_jsonl_file(file_path):
-    """Process JSONL file and preserve structure with metadata"""
-    pages_info = []
-
-    try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            line_num = 0
-
-            for line in file:
-                line = line.strip()
-                if not line:
-                    continue
-
-                line_num += 1
-                try:
-                    json_obj = json.loads(line)
-
-                    # Create structured content that preserves metadata
-                    structured_content = {
-                        'line_number': line_num,
-                        'raw_data': json_obj,
-                        'searchable_text': '',
-                        'metadata': {}
-                    }
-
-                    # Extract searchable text while preserving structure
-                    text_parts = []
-
-                    # Handle different content structures
-                    if 'verse' in json_obj:
-                        # Quran/religious text structure
-                        structured_content['metadata']['content_type'] = 'verse'
-                        if 'chapter' in json_obj:
-                            structured_content['metadata']['chapter'] = json_obj['chapter']
-                        if 'verse_number' in json_obj:
-                            structured_content['metadata']['verse_number'] = json_obj['verse_number']
-
-                        # Add verse content
-                        if isinstance(json_obj['verse'], str):
-                            text_parts.append(f"Verse: {json_obj['verse']}")
-                        elif isinstance(json_obj['verse'], dict):
-                            for lang, text in json_obj['verse'].items():
-                                text_parts.append(f"{lang}: {text}")
-                                structured_content['metadata'][f'verse_{lang}'] = text
-
-                    # Handle Quran verse structure with ayah, arabic, and English translation
-                    if 'ayah' in json_obj:
-                        structured_content['metadata']['content_type'] = 'verse'
-                        structured_content['metadata']['verse_number'] = int(json_obj['ayah'])
-                        
-                        # Store Arabic text
-                        if 'arabic' in json_obj:
-                            structured_content['metadata']['arabic'] = json_obj['arabic']
-                            text_parts.append(f"Arabic: {json_obj['arabic']}")
-                        
-                        # Store English translation from "Clear Quran English"
-                        if 'Clear Quran English' in json_obj:
-                            structured_content['metadata']['english'] = json_obj['Clear Quran English']
-                            text_parts.append(f"English: {json_obj['Clear Quran English']}")
-
-                    # Handle translations
-                    for lang_field in ['arabic', 'english', 'translation']:
-                        if lang_field in json_obj:
-                            if isinstance(json_obj[lang_field], str):
-                                text_parts.append(f"{lang_field}: {json_obj[lang_field]}")
-                                structured_content['metadata'][lang_field] = json_obj[lang_field]
-
-                    # Handle general text fields
-                    for field in ['text', 'content', 'title', 'description', 'passage']:
-                        if field in json_obj and isinstance(json_obj[field], str):
-                            text_parts.append(f"{field}: {json_obj[field]}")
-                            structured_content['metadata'][field] = json_obj[field]
-
-                    # Preserve all other metadata
-                    for key, value in json_obj.items():
-                        if key not in ['verse', 'arabic', 'english', 'translation', 'text', 'content', 'title', 'description', 'passage']:
-                            if isinstance(value, (str, int, float, bool)):
-                                structured_content['metadata'][key] = value
-
-                    # Combine all text for searching
-                    structured_content['searchable_text'] = ' | '.join(text_parts)
-
-                    # Create a "page" for each JSON object to maintain granularity
-                    if structured_content['searchable_text'].strip():
-                        pages_info.append({
-                            'page_num': line_num,
-                            'text': structured_content['searchable_text'],
-                            'metadata': structured_content['metadata'],
-                            'raw_json': json_obj
-                        })
-
-                except json.JSONDecodeError as e:
-                    print(f"Invalid JSON on line {line_num}: {e}")
-                    continue
-
-        return pages_info
-
-    except Exception as e:
-        print(f"Error processing JSONL file: {e}")
-        return []
-
-def process_json_file(file_path):
-    """Process JSON file and preserve structure with metadata"""
-    pages_info = []
-
-    try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            json_data = json.load(file)
-
-            # Handle different JSON structures
-            if isinstance(json_data, list):
-                # Array of objects - check for Quran surah structure
-                for i, obj in enumerate(json_data):
-                    if isinstance(obj, dict):
-                        # Check if this is a Quran surah with ayahs array
-                        if 'ayahs' in obj and isinstance(obj['ayahs'], list):
-                            # Extract surah-level metadata
-                            surah_number = int(obj.get('Surah Number', i + 1))
-                            surah_name_english = obj.get('Surah Name English', f'Surah {surah_number}')
-                            surah_name_arabic = obj.get('Surah Name Arabic', '')
-                            
-                            # Process each ayah in the surah
-                            for ayah in obj['ayahs']:
-                                if isinstance(ayah, dict):
-                                    text_parts = []
-                                    metadata = {
-                                        'content_type': 'verse',
-                                        'surah_number': surah_number,
-                                        'surah_name_english': surah_name_english,
-                                        'surah_name_arabic': surah_name_arabic,
-                                        'chapter': surah_number,  # For compatibility
-                                    }
-                                    
-                                    # Extract verse number
-                                    if 'ayah' in ayah:
-                                        verse_number = int(ayah['ayah'])
-                                        metadata['verse_number'] = verse_number
-                                        metadata['ayah'] = verse_number
-                                    
-                                    # Extract Arabic text
-                                    if 'arabic' in ayah:
-                                        metadata['arabic'] = ayah['arabic']
-                                        text_parts.append(f"Arabic: {ayah['arabic']}")
-                                    
-                                    # Extract English translation
-                                    if 'Clear Quran English' in ayah:
-                                        metadata['english'] = ayah['Clear Quran English']
-                                        text_parts.append(f"English: {ayah['Clear Quran English']}")
-                                    
-                                    # Create searchable text
-                                    searchable_text = ' | '.join(text_parts)
-                                    
-                                    if searchable_text.strip():
-                                        pages_info.append({
-                                            'page_num': f"{surah_number}:{ayah.get('ayah', 'unknown')}",
-                                            'text': searchable_text,
-                                            'metadata': metadata,
-                                            'raw_json': ayah
-                                        })
-                        else:
-                            # Process as regular flat object
-                            structured_content = {
-                                'index': i,
-                                'raw_data': obj,
-                                'searchable_text': '',
-                                'metadata': {}
-                            }
-
-                            # Extract searchable text
-                            text_parts = []
-                            for key, value in obj.items():
-                                if isinstance(value, str) and len(value) > 5:
-                                    text_parts.append(f"{key}: {value}")
-                                    structured_content['metadata'][key] = value
-                                elif isinstance(value, (int, float, bool)):
-                                    structured_content['metadata'][key] = value
-
-                            structured_content['searchable_text'] = ' | '.join(text_parts)
-
-                            if structured_content['searchable_text'].strip():
-                                pages_info.append({
-                                    'page_num': i + 1,
-                                    'text': structured_content['searchable_text'],
-                                    'metadata': structured_content['metadata'],
-                                    'raw_json': obj
-                                })
-
-            elif isinstance(json_data, dict):
-                # Single object or nested structure
-                def extract_from_dict(data, prefix="", page_num=1):
-                    text_parts = []
-                    metadata = {}
-
-                    for key, value in data.items():
-                        full_key = f"{prefix}.{key}" if prefix else key
-
-                        if isinstance(value, str) and len(value) > 5:
-                            text_parts.append(f"{full_key}: {value}")
-                            metadata[full_key] = value
-                        elif isinstance(value, (int, float, bool)):
-                            metadata[full_key] = value
-                        elif isinstance(value, dict):
-                            # Recursively handle nested objects
-                            nested_text, nested_meta = extract_from_dict(value, full_key, page_num)
-                            text_parts.extend(nested_text)
-                            metadata.update(nested_meta)
-
-                    return text_parts, metadata
-
-                text_parts, metadata = extract_from_dict(json_data)
-
-                if text_parts:
-                    pages_info.append({
-                        'page_num': 1,
-                        'text': ' | '.join(text_parts),
-                        'metadata': metadata,
-                        'raw_json': json_data
-                    })
-
-        return pages_info
-
-    except Exception as e:
-        print(f"Error processing JSON file: {e}")
-        return []
-
 @app.route("/api/reference-sets/<ref_set_id>", methods=["DELETE"])
 def delete_reference_set(ref_set_id):
     """Delete a reference set and all its associated data"""
     try:
-        # Get current reference sets
-        reference_sets = get_reference_sets()
-        
-        if ref_set_id not in reference_sets:
+        if not storage.get_reference_set(ref_set_id):
             return jsonify({"success": False, "error": "Reference set not found"}), 404
-        
-        # Delete from Pinecone index if available
-        if index:
+
+        # Stop uploads still ingesting into the set first, so they don't write to it after it is gone
+        cancelled = cancel_jobs(timeout=JOB_CANCEL_TIMEOUT, kind="ingest", reference_set_id=ref_set_id)
+        if cancelled:
+            print(f"Cancelled {len(cancelled)} ingestion jobs for reference set {ref_set_id}")
+
+        # Delete from the vector store: older uploads in the default namespace go by filter,
+        # then the reference set's own namespace is dropped (each step even if the other fails)
+        if has_legacy_vectors():
             try:
-                # Delete all vectors for this reference set
-                index.delete(filter={"reference_set_id": ref_set_id})
-                print(f"Deleted vectors for reference set {ref_set_id} from Pinecone")
+                delete_legacy_vectors({"reference_set_id": ref_set_id})
             except Exception as e:
-                print(f"Error deleting vectors from Pinecone: {e}")
+                print(f"Error deleting legacy vectors from the vector store: {e}")
+        try:
+            get_vector_store().delete(delete_all=True, namespace=ref_set_id)
+            print(f"Deleted vectors for reference set {ref_set_id} from the vector store")
+        except Exception as e:
+            print(f"Error deleting vectors from the vector store: {e}")
         
+        get_reference_index().delete_reference_set(ref_set_id)
+        drop_lexical_index(ref_set_id)
+        drop_dedup_index(ref_set_id)
+
         # Remove from persistent storage
-        del reference_sets[ref_set_id]
-        db["reference_sets"] = reference_sets
+        storage.delete_reference_set(ref_set_id)
+        invalidate_retrieval_cache(ref_set_id)
         
         print(f"Deleted reference set: {ref_set_id}")
         return jsonify({"success": True, "message": "Reference set deleted successfully"})
@@ -631,15 +814,9 @@ def delete_reference_set(ref_set_id):
 def delete_inquiry(inquiry_id):
     """Delete an inquiry"""
     try:
-        # Get current inquiries
-        inquiries = get_inquiries()
-        
-        if inquiry_id not in inquiries:
-            return jsonify({"success": False, "error": "Inquiry not found"}), 404
-        
         # Remove from persistent storage
-        del inquiries[inquiry_id]
-        db["inquiries"] = inquiries
+        if not storage.delete_inquiry(inquiry_id):
+            return jsonify({"success": False, "error": "Inquiry not found"}), 404
         
         print(f"Deleted inquiry: {inquiry_id}")
         return jsonify({"success": True, "message": "Inquiry deleted successfully"})
@@ -648,6 +825,106 @@ def delete_inquiry(inquiry_id):
         print(f"Error deleting inquiry: {e}")
         return jsonify({"success": False, "error": str(e)}), 500
 
+def test_search_results(query, ref_set_id, top_k, min_score, matches, mode_used):
+    """Response body for /api/test-search: matches formatted for display, filtered by min_score"""
+    # Only cosine similarities can be held to min_score: hybrid search applied it to its vector
+    # candidates before fusion, and BM25 scores are on another scale
+    similarity_scores = mode_used in ("vector", "reference")
+    relevant_results = []
+
+    if matches is not None:
+        # Extract relevant chunks with all metadata, filtering by minimum score
+        filtered_matches = [match for match in matches if not similarity_scores or match.score >= min_score]
+        
+        # If no matches meet the minimum score, take the top result anyway but mark it
+        if not filtered_matches and matches:
+            filtered_matches = [matches[0]]
+            
+        # Limit to requested number of results
+        filtered_matches = filtered_matches[:top_k]
+        
+        for i, match in enumerate(filtered_matches):
+            metadata = match.metadata
+            score = float(match.score)
+            
+            # Determine score quality
+            if mode_used == "lexical":
+                score_quality = "Keyword match"
+            elif mode_used == "hybrid":
+                score_quality = "Hybrid match"
+            elif score >= 0.9:
+                score_quality = "Excellent match"
+            elif score >= 0.8:
+                score_quality = "Very good match"
+            elif score >= 0.7:
+                score_quality = "Good match"
+            elif score >= 0.6:
+                score_quality = "Fair match"
+            else:
+                score_quality = "Poor match"
+            
+            # Extract Quran-specific information
+            arabic_text = metadata.get('arabic', '')
+            english_text = metadata.get('english', '')
+            chapter = metadata.get('chapter', '')
+            verse_number = metadata.get('verse_number', '')
+            
+            # Format display text for Quran verses
+            formatted_text = ""
+            if arabic_text and english_text:
+                formatted_text = f"Arabic: {arabic_text}\n\nEnglish: {english_text}"
+            elif arabic_text:
+                formatted_text = f"Arabic: {arabic_text}"
+            elif english_text:
+                formatted_text = f"English: {english_text}"
+            else:
+                # Fallback to original text
+                formatted_text = metadata.get('text', '')
+            
+            # Format verse reference
+            verse_reference = ""
+            if chapter and verse_number:
+                # Try to get surah names if available
+                surah_name_english = metadata.get('surah_name_english', '')
+                surah_name_arabic = metadata.get('surah_name_arabic', '')
+                
+                if surah_name_arabic and surah_name_english:
+                    verse_reference = f"Surah {surah_name_arabic} ({surah_name_english}) {int(chapter)}:{int(verse_number)}"
+                elif surah_name_english:
+                    verse_reference = f"Surah {surah_name_english} {int(chapter)}:{int(verse_number)}"
+                else:
+                    verse_reference = f"Surah {int(chapter)} {int(chapter)}:{int(verse_number)}"
+            elif chapter:
+                verse_reference = f"Surah {int(chapter)}"
+            
+            relevant_results.append({
+                "rank": i + 1,
+                "score": score,
+                "score_quality": score_quality,
+                "text_preview": formatted_text[:400] + "..." if len(formatted_text) > 400 else formatted_text,
+                "full_text": formatted_text,
+                "arabic": arabic_text if arabic_text else None,
+                "english": english_text if english_text else None,
+                "verse_reference": verse_reference,
+                "chapter": chapter,
+                "verse_number": verse_number,
+                "document": metadata.get('document_name', 'Unknown'),
+                "domain": metadata.get('domain', 'Unknown'),
+                "page_number": metadata.get('page_number', 'N/A'),
+                "chunk_index": metadata.get('chunk_index', 'N/A'),
+                "metadata_keys": list(metadata.keys())
+            })
+
+    return {
+        "query": query,
+        "results_found": len(relevant_results),
+        "total_candidates": len(matches),
+        "min_score_used": min_score if mode_used != "lexical" else None,
+        "mode": mode_used,
+        "results": relevant_results,
+        "ref_set_filter": ref_set_id if ref_set_id else "No filter (all reference sets)"
+    }
+
 @app.route("/api/test-search", methods=["POST"])
 def test_search():
     """Test search functionality without affecting anything"""
@@ -656,121 +933,137 @@ def test_search():
     ref_set_id = data.get("ref_set_id", "")
     top_k = data.get("top_k", 5)  # Allow configurable result count
     min_score = data.get("min_score", 0.7)  # Only return results above this similarity score
+    mode = data.get("mode", SEARCH_MODE)  # "vector", "lexical" or "hybrid"
+    diversify = bool(data.get("diversify", False))  # Re-rank a wider pool with MMR
 
     if not query:
         return jsonify({"error": "Query is required"}), 400
+    if mode not in SEARCH_MODES:
+        return jsonify({"error": f"mode must be one of {', '.join(SEARCH_MODES)}"}), 400
 
     try:
-        # Get embedding for the query
-        query_embedding = get_embedding(query)
-        if not query_embedding:
+        # Search for relevant chunks (get more results to filter by score)
+        _, matches, mode_used = search_reference_sets(query, [ref_set_id] if ref_set_id else [], max(top_k, 10), min_score, mode, diversify)
+        if matches is None:
             return jsonify({"error": "Failed to generate query embedding"}), 500
 
-        # Search Pinecone for relevant chunks
-        relevant_results = []
-
-        if index and query_embedding:
-            # Query Pinecone
-            search_results = index.query(
-                vector=query_embedding,
-                top_k=max(top_k, 10),  # Get more results to filter by score
-                include_metadata=True,
-                filter={
-                    "reference_set_id": ref_set_id
-                } if ref_set_id else None
-            )
-
-            # Extract relevant chunks with all metadata, filtering by minimum score
-            filtered_matches = [match for match in search_results.matches if match.score >= min_score]
-            
-            # If no matches meet the minimum score, take the top result anyway but mark it
-            if not filtered_matches and search_results.matches:
-                filtered_matches = [search_results.matches[0]]
-                
-            # Limit to requested number of results
-            filtered_matches = filtered_matches[:top_k]
-            
-            for i, match in enumerate(filtered_matches):
-                metadata = match.metadata
-                score = float(match.score)
-                
-                # Determine score quality
-                if score >= 0.9:
-                    score_quality = "Excellent match"
-                elif score >= 0.8:
-                    score_quality = "Very good match"
-                elif score >= 0.7:
-                    score_quality = "Good match"
-                elif score >= 0.6:
-                    score_quality = "Fair match"
-                else:
-                    score_quality = "Poor match"
-                
-                # Extract Quran-specific information
-                arabic_text = metadata.get('arabic', '')
-                english_text = metadata.get('english', '')
-                chapter = metadata.get('chapter', '')
-                verse_number = metadata.get('verse_number', '')
-                
-                # Format display text for Quran verses
-                formatted_text = ""
-                if arabic_text and english_text:
-                    formatted_text = f"Arabic: {arabic_text}\n\nEnglish: {english_text}"
-                elif arabic_text:
-                    formatted_text = f"Arabic: {arabic_text}"
-                elif english_text:
-                    formatted_text = f"English: {english_text}"
-                else:
-                    # Fallback to original text
-                    formatted_text = metadata.get('text', '')
-                
-                # Format verse reference
-                verse_reference = ""
-                if chapter and verse_number:
-                    # Try to get surah names if available
-                    surah_name_english = metadata.get('surah_name_english', '')
-                    surah_name_arabic = metadata.get('surah_name_arabic', '')
-                    
-                    if surah_name_arabic and surah_name_english:
-                        verse_reference = f"Surah {surah_name_arabic} ({surah_name_english}) {int(chapter)}:{int(verse_number)}"
-                    elif surah_name_english:
-                        verse_reference = f"Surah {surah_name_english} {int(chapter)}:{int(verse_number)}"
-                    else:
-                        verse_reference = f"Surah {int(chapter)} {int(chapter)}:{int(verse_number)}"
-                elif chapter:
-                    verse_reference = f"Surah {int(chapter)}"
-                
-                relevant_results.append({
-                    "rank": i + 1,
-                    "score": score,
-                    "score_quality": score_quality,
-                    "text_preview": formatted_text[:400] + "..." if len(formatted_text) > 400 else formatted_text,
-                    "full_text": formatted_text,
-                    "arabic": arabic_text if arabic_text else None,
-                    "english": english_text if english_text else None,
-                    "verse_reference": verse_reference,
-                    "chapter": chapter,
-                    "verse_number": verse_number,
-                    "document": metadata.get('document_name', 'Unknown'),
-                    "domain": metadata.get('domain', 'Unknown'),
-                    "page_number": metadata.get('page_number', 'N/A'),
-                    "chunk_index": metadata.get('chunk_index', 'N/A'),
-                    "metadata_keys": list(metadata.keys())
-                })
-
-        return jsonify({
-            "query": query,
-            "results_found": len(relevant_results),
-            "total_candidates": len(search_results.matches) if index and query_embedding else 0,
-            "min_score_used": min_score,
-            "results": relevant_results,
-            "ref_set_filter": ref_set_id if ref_set_id else "No filter (all reference sets)"
-        })
+        return jsonify(with_timings(test_search_results(query, ref_set_id, top_k, min_score, matches, mode_used), data))
 
     except Exception as e:
         print(f"Test search error: {e}")
         return jsonify({"error": f"Search test failed: {str(e)}"}), 500
 
+CHAT_COMPLETION_OPTIONS = {"model": "gpt-3.5-turbo", "max_tokens": 500, "temperature": 0.7}
+CHAT_SYSTEM_PROMPT = """You are a research assistant helping analyze documents. Use the provided context to answer questions accurately. Always cite your sources and indicate when information is not available in the context."""
+
+def chat_completion_messages(context, query):
+    """Prompt messages for answering a query from retrieved context"""
+    return [
+        {
+            "role": "system",
+            "content": CHAT_SYSTEM_PROMPT
+        },
+        {
+            "role": "user",
+            "content": f"""Context from research documents:
+{context}
+
+Question: {query}
+
+Please provide a detailed answer based on the context above. If the context doesn't contain enough information to fully answer the question, please indicate that."""
+        }
+    ]
+
+def no_context_response(query):
+    return f"I couldn't find relevant information in the selected reference sets for your query: '{query}'. You may need to upload more documents to these domains or try a different query."
+
+def generation_error_response(context):
+    return f"I found relevant information but encountered an error generating the response. Here's what I found in the documents: {context[:500]}..."
+
+def retrieve_chat_context(query, reference_sets, inquiry_id):
+    """Retrieve chunks for a chat query and look up a cached answer
+
+    Returns None if the query could not be embedded, otherwise a dict with
+    the context, citations, chunk ids and (if any) the cached answer.
+    """
+    query_embedding, matches, _ = search_reference_sets(query, reference_sets, CONTEXT_CANDIDATES, diversify=True)
+    if matches is None:
+        return None
+    return prepare_chat_context(query, reference_sets, inquiry_id, query_embedding, matches)
+
+def prepare_chat_context(query, reference_sets, inquiry_id, query_embedding, matches):
+    """Pack retrieved matches into the prompt context and look up a cached answer (see retrieve_chat_context)"""
+    # Build context from the best chunks that fit the token budget
+    context, used_matches, context_tokens = pack_context(matches)
+
+    citations = []
+    chunk_ids = []
+
+    # Build citations for the chunks that made it into the context
+    for match in used_matches:
+        metadata = match.metadata
+        chunk_ids.append(match.id)
+
+        citation = f"{metadata.get('document_name', 'Unknown')} (Domain: {metadata.get('domain', 'Unknown')}, Page: {metadata.get('page_number', 'N/A')})"
+        if citation not in citations:
+            citations.append(citation)
+
+    # Reuse the answer to an earlier, near-identical question over the same chunks
+    answer_cache = get_answer_cache() if context and query_embedding else None
+    fingerprint = context_fingerprint(used_matches) if answer_cache else None
+    cached_answer = answer_cache.get(inquiry_id, reference_sets, fingerprint, query_embedding) if answer_cache else None
+    if cached_answer:
+        citations = list(cached_answer["citations"])
+
+    return {
+        "query_embedding": query_embedding,
+        "chunks_found": len(matches),
+        "citations": citations,
+        "chunk_ids": chunk_ids,
+        "context": context,
+        "context_tokens": context_tokens,
+        # Tokens sent to the model if it is asked to answer (system prompt, context and question)
+        "prompt_tokens": sum(count_tokens(message["content"]) for message in chat_completion_messages(context, query))
+                         if context else 0,
+        "fingerprint": fingerprint,
+        "cached_answer": cached_answer
+    }
+
+def cache_chat_answer(inquiry_id, reference_sets, retrieval, response, generation_ms):
+    answer_cache = get_answer_cache()
+    if answer_cache and retrieval["fingerprint"]:
+        answer_cache.put(inquiry_id, reference_sets, retrieval["fingerprint"], retrieval["query_embedding"], {
+            "response": response,
+            "citations": list(retrieval["citations"]),
+            "latency_ms": generation_ms
+        })
+
+def record_chat_turn(inquiry_id, query, response, retrieval, latency_ms):
+    """Append a turn to the inquiry's history; returns the message id or None"""
+    if not inquiry_id:
+        return None
+    try:
+        return storage.append_message(
+            inquiry_id, query, response, citations=retrieval["citations"], chunk_ids=retrieval["chunk_ids"],
+            latency_ms=latency_ms
+        )
+    except Exception as e:
+        print(f"Error saving chat message: {e}")
+        return None
+
+def chat_result(reference_sets, retrieval, response, latency_ms):
+    """Response body for /api/chat"""
+    return {
+        "response": response,
+        "citations": retrieval["citations"],
+        "sources": reference_sets,
+        "chunks_found": retrieval["chunks_found"],
+        "context_tokens": retrieval["context_tokens"],
+        "prompt_tokens": retrieval["prompt_tokens"],
+        "cached": bool(retrieval["cached_answer"]),
+        "latency_ms": round(latency_ms, 1)
+    }
+
 @app.route("/api/chat", methods=["POST"])
 def chat():
     data = request.get_json()
@@ -781,82 +1074,149 @@ def chat():
     if not query:
         return jsonify({"error": "Query is required"}), 400
 
+    started = time.perf_counter()
     try:
-        # Get embedding for the query
-        query_embedding = get_embedding(query)
-        if not query_embedding:
+        # Search the vector store for relevant chunks
+        retrieval = retrieve_chat_context(query, reference_sets, inquiry_id)
+        if retrieval is None:
             return jsonify({"error": "Failed to generate query embedding"}), 500
 
-        # Search Pinecone for relevant chunks
-        relevant_chunks = []
-        citations = []
-
-        if index and query_embedding:
-            # Query Pinecone
-            search_results = index.query(
-                vector=query_embedding,
-                top_k=5,
-                include_metadata=True,
-                filter={
-                    "reference_set_id": {"$in": reference_sets}
-                } if reference_sets else None
-            )
-
-            # Extract relevant chunks and build citations
-            for match in search_results.matches:
-                metadata = match.metadata
-                relevant_chunks.append(metadata.get('text', ''))
-
-                citation = f"{metadata.get('document_name', 'Unknown')} (Domain: {metadata.get('domain', 'Unknown')}, Page: {metadata.get('page_number', 'N/A')})"
-                if citation not in citations:
-                    citations.append(citation)
-
-        # Build context from relevant chunks
-        context = "\n\n".join(relevant_chunks[:3])  # Use top 3 chunks
-
-        if not context:
-            response = f"I couldn't find relevant information in the selected reference sets for your query: '{query}'. You may need to upload more documents to these domains or try a different query."
+        context = retrieval["context"]
+        cached_answer = retrieval["cached_answer"]
+
+        if cached_answer:
+            response = cached_answer["response"]
+        elif not context:
+            response = no_context_response(query)
         else:
             # Generate response using OpenAI with context
             try:
-                chat_response = openai.chat.completions.create(
-                    model="gpt-3.5-turbo",
-                    messages=[
-                        {
-                            "role": "system",
-                            "content": """You are a research assistant helping analyze documents. Use the provided context to answer questions accurately. Always cite your sources and indicate when information is not available in the context."""
-                        },
-                        {
-                            "role": "user",
-                            "content": f"""Context from research documents:
-{context}
-
-Question: {query}
-
-Please provide a detailed answer based on the context above. If the context doesn't contain enough information to fully answer the question, please indicate that."""
-                        }
-                    ],
-                    max_tokens=500,
-                    temperature=0.7
-                )
+                generation_started = time.perf_counter()
+                with span("completion"):
+                    chat_response = get_openai().chat.completions.create(
+                        messages=chat_completion_messages(context, query),
+                        **CHAT_COMPLETION_OPTIONS
+                    )
 
                 response = chat_response.choices[0].message.content
+                cache_chat_answer(inquiry_id, reference_sets, retrieval, response,
+                                  (time.perf_counter() - generation_started) * 1000)
 
             except Exception as e:
                 print(f"OpenAI API error: {e}")
-                response = f"I found relevant information but encountered an error generating the response. Here's what I found in the documents: {context[:500]}..."
+                response = generation_error_response(context)
 
-        return jsonify({
-            "response": response,
-            "citations": citations,
-            "sources": reference_sets,
-            "chunks_found": len(relevant_chunks)
-        })
+        latency_ms = (time.perf_counter() - started) * 1000
+        result = chat_result(reference_sets, retrieval, response, latency_ms)
+
+        # Record the turn in the inquiry's history
+        message_id = record_chat_turn(inquiry_id, query, response, retrieval, latency_ms)
+        if message_id is not None:
+            result["message_id"] = message_id
+
+        return jsonify(with_timings(result, data))
 
     except Exception as e:
         print(f"Chat error: {e}")
         return jsonify({"error": f"An error occurred: {str(e)}"}), 500
 
+def sse_event(event, data):
+    """Format one Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route("/api/chat/stream", methods=["POST"])
+def chat_stream():
+    """Chat over Server-Sent Events: a `citations` event as soon as retrieval is done,
+    then `token` events as the completion arrives, then `done` (or `error`)
+
+    If the client disconnects, the upstream completion stream is closed so the
+    model stops generating.
+    """
+    data = request.get_json()
+    query = data.get("query", "")
+    reference_sets = data.get("reference_sets", [])
+    inquiry_id = data.get("inquiry_id", "")
+
+    if not query:
+        return jsonify({"error": "Query is required"}), 400
+
+    def generate():
+        started = time.perf_counter()
+        completion = None
+        try:
+            retrieval = retrieve_chat_context(query, reference_sets, inquiry_id)
+            if retrieval is None:
+                yield sse_event("error", {"error": "Failed to generate query embedding"})
+                return
+
+            context = retrieval["context"]
+            cached_answer = retrieval["cached_answer"]
+            yield sse_event("citations", {
+                "citations": retrieval["citations"],
+                "sources": reference_sets,
+                "chunks_found": retrieval["chunks_found"],
+                "context_tokens": retrieval["context_tokens"],
+                "prompt_tokens": retrieval["prompt_tokens"],
+                "cached": bool(cached_answer)
+            })
+
+            if cached_answer:
+                response = cached_answer["response"]
+                yield sse_event("token", {"text": response})
+            elif not context:
+                response = no_context_response(query)
+                yield sse_event("token", {"text": response})
+            else:
+                parts = []
+                try:
+                    generation_started = time.perf_counter()
+                    with span("completion"):  # Until the stream is open; tokens arrive as the client reads
+                        completion = get_openai().chat.completions.create(
+                            messages=chat_completion_messages(context, query),
+                            stream=True,
+                            **CHAT_COMPLETION_OPTIONS
+                        )
+                    for chunk in completion:
+                        text = chunk.choices[0].delta.content if chunk.choices else None
+                        if text:
+                            parts.append(text)
+                            yield sse_event("token", {"text": text})
+                    response = "".join(parts)
+                    cache_chat_answer(inquiry_id, reference_sets, retrieval, response,
+                                      (time.perf_counter() - generation_started) * 1000)
+                except Exception as e:
+                    print(f"OpenAI API error: {e}")
+                    if parts:
+                        yield sse_event("error", {"error": f"Generation interrupted: {str(e)}"})
+                        return
+                    response = generation_error_response(context)
+                    yield sse_event("token", {"text": response})
+
+            latency_ms = (time.perf_counter() - started) * 1000
+            done = {"cached": bool(cached_answer), "latency_ms": round(latency_ms, 1)}
+            message_id = record_chat_turn(inquiry_id, query, response, retrieval, latency_ms)
+            if message_id is not None:
+                done["message_id"] = message_id
+            yield sse_event("done", done)
+
+        except GeneratorExit:
+            print("Chat stream cancelled by client")
+            raise
+        except Exception as e:
+            print(f"Chat error: {e}")
+            yield sse_event("error", {"error": f"An error occurred: {str(e)}"})
+        finally:
+            # Stop the upstream generation if we are exiting early (e.g. client disconnected)
+            # (an openai Stream is closed through its httpx response; the stub stream is a generator)
+            upstream = getattr(completion, "response", completion)
+            if upstream is not None and hasattr(upstream, "close"):
+                upstream.close()
+
+    return Response(generate(), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
 @app.route("/", defaults={"path": ""})
 @app.route("/<path:path>")
 def serve_react_app(path):
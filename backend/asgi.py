@@ -0,0 +1,259 @@
+import os
+import json
+import time
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import httpx
+from asgiref.wsgi import WsgiToAsgi
+from app import (
+    app as flask_app, SEARCH_MODE, SEARCH_MODES, CONTEXT_CANDIDATES, CHAT_COMPLETION_OPTIONS, get_embedding,
+    start_search, finish_search, keyword_search, vector_namespaces, query_namespace, merge_matches, lexical_fallback,
+    test_search_results, prepare_chat_context, chat_completion_messages, no_context_response,
+    generation_error_response, cache_chat_answer, record_chat_turn, chat_result,
+)
+from completions import COMPLETION_BACKEND, StubAsyncOpenAI
+from embeddings import EMBEDDING_BACKEND, EMBEDDING_MODEL, EMBEDDING_MAX_RETRIES, get_embedding_cache
+from metrics import REQUESTS, REQUEST_SECONDS, span, start_request_timings
+from pipeline import async_call_with_retry
+
+# Asyncio serving mode: `uvicorn asgi:application` (from backend/). /api/chat
+# and /api/test-search are handled natively here so a request waiting on
+# OpenAI doesn't hold a worker thread: embeddings and completions go through
+# AsyncOpenAI over a pooled HTTP client, and independent steps run
+# concurrently (the keyword search alongside the query embedding, one vector
+# query per reference set namespace). Blocking local work (SQLite, the local
+# vector store) runs on a bounded thread pool. Every other route is the Flask app,
+# served through WsgiToAsgi, so responses are the same in both modes.
+
+ASYNC_HTTP_MAX_CONNECTIONS = int(os.getenv("ASYNC_HTTP_MAX_CONNECTIONS", "100"))
+ASYNC_BLOCKING_THREADS = int(os.getenv("ASYNC_BLOCKING_THREADS", "32"))
+
+_blocking = ThreadPoolExecutor(max_workers=ASYNC_BLOCKING_THREADS, thread_name_prefix="asgi-blocking")
+_async_openai = None
+
+def get_async_openai():
+    """Shared AsyncOpenAI client with a pooled HTTP connection (created on first use)"""
+    global _async_openai
+    if _async_openai is None and COMPLETION_BACKEND == "stub":
+        _async_openai = StubAsyncOpenAI()
+    if _async_openai is None:
+        from openai import AsyncOpenAI
+        _async_openai = AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            http_client=httpx.AsyncClient(limits=httpx.Limits(
+                max_connections=ASYNC_HTTP_MAX_CONNECTIONS, max_keepalive_connections=ASYNC_HTTP_MAX_CONNECTIONS
+            ), timeout=httpx.Timeout(60.0, connect=5.0)),
+        )
+    return _async_openai
+
+async def run_blocking(fn, *args, **kwargs):
+    """Run blocking work on the bounded thread pool (in the caller's context, so its stage timings count)"""
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(_blocking, partial(context.run, fn, *args, **kwargs))
+
+async def embed_query(text):
+    """Embedding for a query (embedding cache first), or None on failure"""
+    if EMBEDDING_BACKEND != "openai":
+        return await run_blocking(get_embedding, text)
+    cache = get_embedding_cache()
+    if cache:
+        cached = (await run_blocking(cache.get_many, EMBEDDING_MODEL, [text]))[0]
+        if cached is not None:
+            return cached
+    try:
+        with span("embed"):
+            response = await async_call_with_retry(get_async_openai().embeddings.create, model=EMBEDDING_MODEL,
+                                                   input=[text], attempts=EMBEDDING_MAX_RETRIES + 1)
+    except Exception as e:
+        print(f"Error getting embedding: {e}")
+        return None
+    embedding = response.data[0].embedding
+    if cache:
+        await run_blocking(cache.put_many, EMBEDDING_MODEL, [text], [embedding])
+    return embedding
+
+async def query_vectors_async(query_embedding, ref_set_ids, top_k, include_values=False):
+    """query_vectors() with the per-namespace queries awaited concurrently"""
+    targets = await run_blocking(vector_namespaces, ref_set_ids)
+    with span("query"):
+        results = await asyncio.gather(*(
+            run_blocking(query_namespace, query_embedding, namespace, filter, top_k, include_values)
+            for namespace, filter in targets
+        ))
+    return merge_matches(results, top_k) if results else []
+
+async def search_reference_sets_async(query, ref_set_ids, top_k, min_score=None, mode=None, diversify=False):
+    """Async counterpart of app.search_reference_sets: the same steps, with the I/O awaited"""
+    result, plan = await run_blocking(start_search, query, ref_set_ids, top_k, min_score, mode, diversify)
+    if plan is None:
+        return result
+
+    # The keyword search doesn't need the embedding, so it runs while the query is embedded
+    lexical_search = (asyncio.ensure_future(run_blocking(keyword_search, query, plan["ref_set_ids"], plan["pool_size"]))
+                      if plan["mode"] == "hybrid" else None)
+    try:
+        query_embedding = await embed_query(query)
+        if not query_embedding:
+            return await run_blocking(lexical_fallback, query, plan["ref_set_ids"], top_k, plan["mode"])
+        matches = await query_vectors_async(query_embedding, plan["ref_set_ids"], plan["pool_size"],
+                                            include_values=diversify)
+        lexical_matches = await lexical_search if lexical_search else None
+    finally:
+        if lexical_search:
+            # Not needed if the search failed or fell back; collect its outcome so it is never left pending
+            lexical_search.cancel()
+            await asyncio.gather(lexical_search, return_exceptions=True)
+    return finish_search(plan, query_embedding, matches, lexical_matches)
+
+async def test_search(data):
+    """POST /api/test-search"""
+    query = data.get("query", "")
+    ref_set_id = data.get("ref_set_id", "")
+    top_k = data.get("top_k", 5)
+    min_score = data.get("min_score", 0.7)
+    mode = data.get("mode", SEARCH_MODE)
+    diversify = bool(data.get("diversify", False))
+
+    if not query:
+        return 400, {"error": "Query is required"}
+    if mode not in SEARCH_MODES:
+        return 400, {"error": f"mode must be one of {', '.join(SEARCH_MODES)}"}
+
+    try:
+        _, matches, mode_used = await search_reference_sets_async(
+            query, [ref_set_id] if ref_set_id else [], max(top_k, 10), min_score, mode, diversify
+        )
+        if matches is None:
+            return 500, {"error": "Failed to generate query embedding"}
+        return 200, test_search_results(query, ref_set_id, top_k, min_score, matches, mode_used)
+    except Exception as e:
+        print(f"Test search error: {e}")
+        return 500, {"error": f"Search test failed: {str(e)}"}
+
+async def chat(data):
+    """POST /api/chat"""
+    query = data.get("query", "")
+    reference_sets = data.get("reference_sets", [])
+    inquiry_id = data.get("inquiry_id", "")
+
+    if not query:
+        return 400, {"error": "Query is required"}
+
+    started = time.perf_counter()
+    try:
+        query_embedding, matches, _ = await search_reference_sets_async(
+            query, reference_sets, CONTEXT_CANDIDATES, diversify=True
+        )
+        if matches is None:
+            return 500, {"error": "Failed to generate query embedding"}
+        retrieval = await run_blocking(prepare_chat_context, query, reference_sets, inquiry_id, query_embedding, matches)
+
+        context = retrieval["context"]
+        cached_answer = retrieval["cached_answer"]
+        if cached_answer:
+            response = cached_answer["response"]
+        elif not context:
+            response = no_context_response(query)
+        else:
+            try:
+                generation_started = time.perf_counter()
+                with span("completion"):
+                    chat_response = await get_async_openai().chat.completions.create(
+                        messages=chat_completion_messages(context, query),
+                        **CHAT_COMPLETION_OPTIONS
+                    )
+                response = chat_response.choices[0].message.content
+                cache_chat_answer(inquiry_id, reference_sets, retrieval, response,
+                                  (time.perf_counter() - generation_started) * 1000)
+            except Exception as e:
+                print(f"OpenAI API error: {e}")
+                response = generation_error_response(context)
+
+        latency_ms = (time.perf_counter() - started) * 1000
+        result = chat_result(reference_sets, retrieval, response, latency_ms)
+        message_id = await run_blocking(record_chat_turn, inquiry_id, query, response, retrieval, latency_ms)
+        if message_id is not None:
+            result["message_id"] = message_id
+        return 200, result
+
+    except Exception as e:
+        print(f"Chat error: {e}")
+        return 500, {"error": f"An error occurred: {str(e)}"}
+
+ASYNC_ROUTES = {
+    "/api/chat": chat,
+    "/api/test-search": test_search,
+}
+
+async def _read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        body += message.get("body", b"")
+        if not message.get("more_body", False):
+            return body
+
+async def _send_json(send, status, data):
+    # Same serialization (and CORS header) as the Flask routes
+    body = f"{flask_app.json.dumps(data, separators=(',', ':'))}\n".encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode("ascii")),
+            (b"access-control-allow-origin", b"*"),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            if _async_openai is not None:
+                await _async_openai.close()
+            _blocking.shutdown(wait=False)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+_wsgi = WsgiToAsgi(flask_app)
+
+async def application(scope, receive, send):
+    """ASGI entry point"""
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    handler = ASYNC_ROUTES.get(scope["path"]) if scope["type"] == "http" and scope["method"] == "POST" else None
+    if handler is None:
+        await _wsgi(scope, receive, send)
+        return
+
+    timings = start_request_timings()
+    body = await _read_body(receive)
+    if body is None:
+        return
+    try:
+        data = json.loads(body)
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        status, result = 400, {"error": "Request body must be a JSON object"}
+    else:
+        status, result = await handler(data)
+        if status == 200 and data.get("timings"):
+            result["timings"] = timings.breakdown()
+    await _send_json(send, status, result)
+    # Same series as the Flask routes (see app.record_request_metrics)
+    REQUEST_SECONDS.observe(time.perf_counter() - timings.started, method="POST", endpoint=scope["path"])
+    REQUESTS.inc(method="POST", endpoint=scope["path"], status=status)
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(application, host="0.0.0.0", port=int(os.getenv("PORT", "5000")))
@@ -0,0 +1,224 @@
+"""Throughput under concurrent load: sync Flask server vs the asyncio (ASGI) server
+
+Starts a local stand-in for the OpenAI API (embeddings and chat completions,
+each answering after --upstream-latency seconds), seeds two reference sets
+through the normal upload path, then drives mixed /api/chat and
+/api/test-search traffic at --concurrency against:
+
+- sync: the Flask app on a WSGI server with --sync-threads worker threads
+- asgi: backend/asgi.py on uvicorn (one process)
+
+Result caches are disabled so every request reaches the stand-in services.
+Needs uvicorn and asgiref (see requirements.txt).
+
+    python3 backend/benchmarks/bench_asgi.py --requests 400 --concurrency 32 --upstream-latency 0.1
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+QUERIES = [
+    "mercy and forgiveness", "patience in hardship", "gratitude to the creator", "charity to the poor",
+    "justice between people", "the day of judgement", "prayer and remembrance", "honesty in trade",
+]
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def serve_openai_stand_in(port, latency):
+    """Minimal OpenAI-compatible API: deterministic stub embeddings and a canned completion"""
+    from embeddings import stub_embed_batch
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            time.sleep(latency)
+            if self.path.endswith("/embeddings"):
+                inputs = request["input"] if isinstance(request["input"], list) else [request["input"]]
+                body = {
+                    "object": "list", "model": request["model"],
+                    "data": [{"object": "embedding", "index": i, "embedding": vector}
+                             for i, vector in enumerate(stub_embed_batch(inputs, latency=0))],
+                    "usage": {"prompt_tokens": 1, "total_tokens": 1},
+                }
+            else:
+                body = {
+                    "id": "stand-in", "object": "chat.completion", "created": 0, "model": request["model"],
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": "A canned answer from the stand-in."}}],
+                    "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+                }
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def seed():
+    """Child process: create two reference sets through the upload path and print their ids"""
+    import app
+    from jobs import get_job
+    client = app.app.test_client()
+    ref_set_ids = []
+    for name in ("first", "second"):
+        ref_set_id = client.post("/api/reference-sets", json={"domain": f"Bench {name}", "description": ""}).json["id"]
+        lines = "\n".join(json.dumps({"text": f"{QUERIES[i % len(QUERIES)]} is discussed in passage {i} of the {name} set. " * 3})
+                          for i in range(200))
+        job_id = client.post(f"/api/reference-sets/{ref_set_id}/upload", content_type="multipart/form-data",
+                             data={"file": (io.BytesIO(lines.encode("utf-8")), f"{name}.jsonl")}).json["job_id"]
+        while get_job(job_id)["status"] not in ("completed", "failed"):
+            time.sleep(0.05)
+        ref_set_ids.append(ref_set_id)
+    print(json.dumps(ref_set_ids))
+
+def serve(kind, port, sync_threads):
+    """Child process: run the app with the sync or the ASGI server"""
+    if kind == "asgi":
+        import uvicorn
+        import asgi
+        uvicorn.run(asgi.application, host="127.0.0.1", port=port, log_level="warning")
+        return
+
+    import logging
+    from werkzeug.serving import BaseWSGIServer
+    import app
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+    class PooledWSGIServer(BaseWSGIServer):
+        """WSGI server with a fixed number of worker threads, like a gthread worker"""
+        pool = ThreadPoolExecutor(max_workers=sync_threads)
+
+        def process_request(self, request, client_address):
+            self.pool.submit(self._handle, request, client_address)
+
+        def _handle(self, request, client_address):
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    PooledWSGIServer("127.0.0.1", port, app.app).serve_forever()
+
+async def drive(port, ref_set_ids, requests, concurrency):
+    """Send mixed chat/test-search traffic; returns (seconds, latencies in ms, errors)"""
+    import httpx
+    latencies = []
+    errors = 0
+    counter = iter(range(requests))
+
+    async def worker(client):
+        nonlocal errors
+        for i in counter:
+            query = QUERIES[i % len(QUERIES)]
+            if i % 2:
+                path, body = "/api/chat", {"query": query, "reference_sets": ref_set_ids}
+            else:
+                path, body = "/api/test-search", {"query": query, "ref_set_id": ref_set_ids[i % 4 // 2]}
+            start = time.perf_counter()
+            response = await client.post(f"http://127.0.0.1:{port}{path}", json=body)
+            latencies.append((time.perf_counter() - start) * 1000)
+            if response.status_code != 200:
+                errors += 1
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=120) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        return time.perf_counter() - start, latencies, errors
+
+def wait_for(port, process):
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("server exited during startup")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("server did not start")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--upstream-latency", type=float, default=0.1, help="seconds per stand-in API call")
+    parser.add_argument("--sync-threads", type=int, default=8, help="worker threads of the sync server")
+    parser.add_argument("--seed", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--serve", choices=["sync", "asgi"], help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.seed:
+        seed()
+        return
+    if args.serve:
+        serve(args.serve, args.port, args.sync_threads)
+        return
+
+    openai_port = free_port()
+    stand_in = serve_openai_stand_in(openai_port, args.upstream_latency)
+    data_dir = tempfile.mkdtemp(prefix="bench_asgi_")
+    env = dict(os.environ, DATA_DIR=data_dir, EMBEDDING_BACKEND="openai", VECTOR_BACKEND="local",
+               OPENAI_API_KEY="stand-in", OPENAI_BASE_URL=f"http://127.0.0.1:{openai_port}/v1",
+               EMBEDDING_CACHE="0", RETRIEVAL_CACHE="0", ANSWER_CACHE="0")
+    try:
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), "--seed"], env=env, cwd=BACKEND_DIR,
+                                check=True, capture_output=True, text=True).stdout
+        ref_set_ids = json.loads(output.strip().splitlines()[-1])
+
+        print(f"{args.requests} requests, concurrency {args.concurrency}, upstream latency {args.upstream_latency * 1000:.0f} ms")
+        for kind in ("sync", "asgi"):
+            port = free_port()
+            server = subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), "--serve", kind, "--port", str(port),
+                 "--sync-threads", str(args.sync_threads)],
+                env=env, cwd=BACKEND_DIR, stdout=subprocess.DEVNULL,
+            )
+            try:
+                wait_for(port, server)
+                asyncio.run(drive(port, ref_set_ids, 2 * args.concurrency, args.concurrency))  # warm up
+                seconds, latencies, errors = asyncio.run(drive(port, ref_set_ids, args.requests, args.concurrency))
+            finally:
+                server.terminate()
+                server.wait()
+            quantiles = statistics.quantiles(latencies, n=100)
+            label = f"sync ({args.sync_threads} threads)" if kind == "sync" else "asgi"
+            print(f"{label:<18} {args.requests / seconds:8.1f} req/s  p50 {quantiles[49]:7.1f} ms  "
+                  f"p95 {quantiles[94]:7.1f} ms  errors {errors}")
+    finally:
+        stand_in.shutdown()
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
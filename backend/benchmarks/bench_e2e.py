@@ -0,0 +1,340 @@
+"""End-to-end benchmark against local stand-ins: ingest throughput, endpoint latency, peak memory
+
+Runs the app in-process with no external services: the stub embedder
+(EMBEDDING_BACKEND=stub, --embed-latency per batch), the in-memory vector
+store (VECTOR_BACKEND=memory) and the stub chat completion service
+(COMPLETION_BACKEND=stub, --completion-latency per answer). Each workload
+runs in a fresh interpreter against an empty DATA_DIR:
+
+- quran_json:  upload a Quran-style JSON file (surahs with nested ayahs)
+- quran_jsonl: upload the same verses as JSONL, one verse per line
+- pdf:         upload a generated text PDF (Docling conversion; skipped if Docling isn't installed)
+- traffic:     ingest both Quran files into two reference sets, then replay mixed
+               /api/chat, /api/test-search and verse-citation traffic at --concurrency
+
+Results (chunks/s, p50/p95/p99 latency per endpoint, peak RSS) are written
+as JSON to --output. Pass a previous results file to --compare to print the
+change for every metric, e.g. between two commits:
+
+    python3 backend/benchmarks/bench_e2e.py --output before.json
+    python3 backend/benchmarks/bench_e2e.py --output after.json --compare before.json
+"""
+import argparse
+import io
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+WORKLOADS = ("quran_json", "quran_jsonl", "pdf", "traffic")
+
+VOCABULARY = (
+    "mercy patience gratitude charity justice prayer fasting pilgrimage forgiveness guidance light "
+    "heavens earth mountains rivers gardens night day sun moon stars rain seed harvest orphans parents "
+    "neighbours travellers truth falsehood reward punishment remembrance knowledge wisdom signs people "
+    "messengers prophets scripture covenant trust steadfast humble generous grateful believers hearts"
+).split()
+
+def sentence(rng, words=18):
+    """A deterministic pseudo-verse: varied enough that chunks aren't near-duplicates"""
+    return " ".join(rng.choice(VOCABULARY) for _ in range(words)).capitalize() + "."
+
+def verses(surahs, ayahs, seed):
+    rng = random.Random(seed)
+    for s in range(1, surahs + 1):
+        for a in range(1, ayahs + 1):
+            yield s, a, f"{sentence(rng)} {sentence(rng)}"
+
+def write_quran_json(path, surahs, ayahs, seed):
+    by_surah = {}
+    for s, a, english in verses(surahs, ayahs, seed):
+        by_surah.setdefault(s, []).append({"ayah": a, "arabic": "بِسْمِ اللَّهِ الرَّحْمَـٰنِ الرَّحِيمِ", "Clear Quran English": english})
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump([{"Surah Number": s, "Surah Name English": f"Surah-{s}", "Surah Name Arabic": "سورة", "ayahs": ayahs}
+                   for s, ayahs in by_surah.items()], f, ensure_ascii=False)
+
+def write_quran_jsonl(path, surahs, ayahs, seed):
+    with open(path, "w", encoding="utf-8") as f:
+        for s, a, english in verses(surahs, ayahs, seed):
+            f.write(json.dumps({"chapter": s, "ayah": a, "arabic": "بِسْمِ اللَّهِ الرَّحْمَـٰنِ الرَّحِيمِ",
+                                "Clear Quran English": english}, ensure_ascii=False) + "\n")
+
+def write_pdf(path, pages, seed):
+    """A plain-text PDF (Helvetica, one column) with a few paragraphs per page"""
+    rng = random.Random(seed)
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for page in range(pages):
+        lines = [f"Chapter {page + 1}"] + [sentence(rng, 12) for _ in range(30)]
+        text = "".join(f"({line}) Tj T* " for line in lines)
+        stream = f"BT /F1 10 Tf 14 TL 50 790 Td {text}ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>")
+        page_ids.append(len(objects))
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(f'{i} 0 R' for i in page_ids)}] /Count {pages} >>"
+
+    body = b"%PDF-1.4\n"
+    offsets = []
+    for number, obj in enumerate(objects, start=1):
+        offsets.append(len(body))
+        body += f"{number} 0 obj\n{obj}\nendobj\n".encode("latin-1")
+    xref = len(body)
+    body += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    body += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode("latin-1")
+    body += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1")
+    with open(path, "wb") as f:
+        f.write(body)
+
+def peak_rss_mb():
+    """Peak resident set size of this process"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KiB on Linux
+
+def percentiles(values):
+    """Nearest-rank p50/p95/p99 (ms) of a list of latencies"""
+    ordered = sorted(values)
+    if not ordered:
+        return {}
+    return {f"p{p}_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))], 2) for p in (50, 95, 99)}
+
+class Harness:
+    """The app in this process, driven through Flask's test client"""
+
+    def __init__(self):
+        import app
+        from jobs import get_job
+        self.app = app.app
+        self.get_job = get_job
+
+    def post(self, path, **kwargs):
+        start = time.perf_counter()
+        response = self.app.test_client().post(path, **kwargs)
+        return response, (time.perf_counter() - start) * 1000
+
+    def create_reference_set(self, domain):
+        response, _ = self.post("/api/reference-sets", json={"domain": domain, "description": "benchmark"})
+        return response.json["id"]
+
+    def ingest(self, ref_set_id, path):
+        """Upload a file and wait for its ingestion job; returns the job and the upload request latency"""
+        with open(path, "rb") as f:
+            response, upload_ms = self.post(f"/api/reference-sets/{ref_set_id}/upload",
+                                            content_type="multipart/form-data",
+                                            data={"file": (io.BytesIO(f.read()), os.path.basename(path))})
+        job_id = response.json["job_id"]
+        while self.get_job(job_id)["status"] not in ("completed", "failed"):
+            time.sleep(0.01)
+        return self.get_job(job_id), upload_ms
+
+def ingest_summary(job, upload_ms):
+    result = job.get("result") or {}
+    seconds = job["finished_at"] - job["started_at"]
+    chunks = result.get("chunks", 0)
+    return {
+        "status": job["status"],
+        "pages": result.get("pages", 0),
+        "chunks": chunks,
+        "deduplicated": result.get("deduplicated", 0),
+        "seconds": round(seconds, 3),
+        "chunks_per_s": round(chunks / seconds, 1) if seconds else None,
+        "pages_per_s": round(result.get("pages", 0) / seconds, 1) if seconds else None,
+        "upload_request_ms": round(upload_ms, 2),
+        "errors": len(job.get("errors", [])),
+    }
+
+def run_ingest(workload, args, work_dir):
+    path = os.path.join(work_dir, {"quran_json": "quran.json", "quran_jsonl": "quran.jsonl", "pdf": "document.pdf"}[workload])
+    if workload == "quran_json":
+        write_quran_json(path, args.surahs, args.ayahs, args.seed)
+    elif workload == "quran_jsonl":
+        write_quran_jsonl(path, args.surahs, args.ayahs, args.seed)
+    else:
+        write_pdf(path, args.pdf_pages, args.seed)
+    harness = Harness()
+    job, upload_ms = harness.ingest(harness.create_reference_set(workload), path)
+    return ingest_summary(job, upload_ms)
+
+def traffic_requests(rng, ref_set_ids, inquiry_id, count, surahs, ayahs):
+    """Deterministic mix: 50% chat, 35% semantic test search, 15% verse citations"""
+    requests = []
+    for _ in range(count):
+        roll = rng.random()
+        query = " ".join(rng.sample(VOCABULARY, 4))
+        if roll < 0.5:
+            sets = ref_set_ids if rng.random() < 0.5 else [rng.choice(ref_set_ids)]
+            requests.append(("chat", "/api/chat", {"query": f"What is said about {query}?",
+                                                   "reference_sets": sets, "inquiry_id": inquiry_id}))
+        elif roll < 0.85:
+            requests.append(("test_search", "/api/test-search", {
+                "query": query, "ref_set_id": rng.choice(ref_set_ids), "mode": rng.choice(["vector", "hybrid", "lexical"]),
+            }))
+        else:
+            citation = f"{rng.randint(1, surahs)}:{rng.randint(1, ayahs)}"
+            requests.append(("citation", "/api/test-search", {"query": citation, "ref_set_id": rng.choice(ref_set_ids)}))
+    return requests
+
+def run_traffic(args, work_dir):
+    harness = Harness()
+    json_path = os.path.join(work_dir, "quran.json")
+    jsonl_path = os.path.join(work_dir, "quran.jsonl")
+    write_quran_json(json_path, args.surahs, args.ayahs, args.seed)
+    write_quran_jsonl(jsonl_path, args.surahs, args.ayahs, args.seed + 1)
+    ref_set_ids = [harness.create_reference_set("traffic-json"), harness.create_reference_set("traffic-jsonl")]
+    for ref_set_id, path in zip(ref_set_ids, (json_path, jsonl_path)):
+        harness.ingest(ref_set_id, path)
+    response, _ = harness.post("/api/inquiries", json={"title": "Benchmark", "reference_sets": ref_set_ids})
+    inquiry_id = response.json["inquiry_id"]
+
+    requests = traffic_requests(random.Random(args.seed), ref_set_ids, inquiry_id, args.requests, args.surahs, args.ayahs)
+    latencies = {}
+    errors = {}
+
+    def send(request):
+        kind, path, body = request
+        response, ms = harness.post(path, json=body)
+        return kind, ms, response.status_code
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for kind, ms, status in executor.map(send, requests):
+            latencies.setdefault(kind, []).append(ms)
+            if status != 200:
+                errors[kind] = errors.get(kind, 0) + 1
+    seconds = time.perf_counter() - start
+
+    endpoints = {kind: dict(requests=len(values), errors=errors.get(kind, 0), **percentiles(values))
+                 for kind, values in sorted(latencies.items())}
+    return {
+        "requests": len(requests),
+        "concurrency": args.concurrency,
+        "seconds": round(seconds, 3),
+        "requests_per_s": round(len(requests) / seconds, 1),
+        "all": percentiles([ms for values in latencies.values() for ms in values]),
+        "endpoints": endpoints,
+    }
+
+def measure(workload, args):
+    """Runs in the child process: print one JSON line with the workload's results"""
+    if workload == "pdf":
+        import importlib.util
+        if importlib.util.find_spec("docling") is None:
+            print(json.dumps({"skipped": "docling is not installed"}))
+            return
+    work_dir = tempfile.mkdtemp(prefix="bench_e2e_files_")
+    try:
+        result = run_traffic(args, work_dir) if workload == "traffic" else run_ingest(workload, args, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    result["peak_rss_mb"] = round(peak_rss_mb(), 1)
+    # Docling conversion runs in worker processes; report their high-water mark separately
+    children_mb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    if children_mb:
+        result["peak_worker_rss_mb"] = round(children_mb, 1)
+    print(json.dumps(result))
+
+def run_workload(workload, args):
+    data_dir = tempfile.mkdtemp(prefix="bench_e2e_")
+    env = dict(os.environ, DATA_DIR=data_dir, EMBEDDING_BACKEND="stub", VECTOR_BACKEND="memory",
+               COMPLETION_BACKEND="stub", STUB_EMBEDDING_LATENCY=str(args.embed_latency),
+               STUB_COMPLETION_LATENCY=str(args.completion_latency), SERVICE_WARM_UP="0")
+    env.pop("STORAGE_PATH", None)
+    command = [sys.executable, os.path.abspath(__file__), "--measure", workload]
+    for option in ("surahs", "ayahs", "pdf_pages", "requests", "concurrency", "seed"):
+        command += [f"--{option.replace('_', '-')}", str(getattr(args, option))]
+    try:
+        output = subprocess.run(command, check=True, capture_output=True, text=True, env=env, cwd=BACKEND_DIR).stdout
+        return json.loads(output.strip().splitlines()[-1])
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+def flatten(results, prefix=""):
+    """{'a': {'b': 1}} -> {'a.b': 1}, numbers only"""
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+def compare(previous, current):
+    before = flatten(previous["workloads"])
+    after = flatten(current["workloads"])
+    print(f"\nChange vs {previous.get('commit') or 'previous run'}:")
+    for key in sorted(before.keys() & after.keys()):
+        old, new = before[key], after[key]
+        change = f"{(new - old) / old * 100:+7.1f}%" if old else "      -"
+        print(f"  {key:<45} {old:>12} -> {new:<12} {change}")
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, check=True,
+                              capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workloads", nargs="+", choices=WORKLOADS, default=list(WORKLOADS))
+    parser.add_argument("--surahs", type=int, default=20)
+    parser.add_argument("--ayahs", type=int, default=100)
+    parser.add_argument("--pdf-pages", type=int, default=40)
+    parser.add_argument("--requests", type=int, default=400, help="requests replayed by the traffic workload")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="seconds per stub embedding batch")
+    parser.add_argument("--completion-latency", type=float, default=0.3, help="seconds per stub chat completion")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_e2e.json")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--measure", choices=WORKLOADS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(args.measure, args)
+        return
+
+    results = {
+        "commit": git_commit(),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "config": {option: getattr(args, option) for option in (
+            "surahs", "ayahs", "pdf_pages", "requests", "concurrency", "embed_latency", "completion_latency", "seed")},
+        "workloads": {},
+    }
+    for workload in args.workloads:
+        result = results["workloads"][workload] = run_workload(workload, args)
+        if "skipped" in result:
+            print(f"{workload:<12} skipped: {result['skipped']}")
+        elif workload == "traffic":
+            print(f"{workload:<12} {result['requests_per_s']:8.1f} req/s  peak RSS {result['peak_rss_mb']:.0f} MB")
+            for kind, endpoint in result["endpoints"].items():
+                print(f"  {kind:<12} p50 {endpoint['p50_ms']:8.1f} ms  p95 {endpoint['p95_ms']:8.1f} ms  "
+                      f"p99 {endpoint['p99_ms']:8.1f} ms  errors {endpoint['errors']}")
+        else:
+            print(f"{workload:<12} {result['chunks']:6d} chunks  {result['chunks_per_s'] or 0:8.1f} chunks/s  "
+                  f"peak RSS {result['peak_rss_mb']:.0f} MB")
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Wrote {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+if __name__ == "__main__":
+    main()
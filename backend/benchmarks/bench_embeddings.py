@@ -0,0 +1,56 @@
+"""Offline throughput benchmark for the embedding engine
+
+Compares one-chunk-per-request sequential embedding (the old upload loop)
+against batched, concurrent embedding, using the local stub embedder with a
+simulated round-trip latency.
+
+    python3 backend/benchmarks/bench_embeddings.py --chunks 6000 --latency 0.05
+"""
+import argparse
+import os
+import sys
+import time
+from functools import partial
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from embeddings import embed_texts, stub_embed_batch
+
+def make_chunks(count):
+    """Synthetic verse-sized chunks"""
+    return [f"Verse {i}: In the name of God, the Most Compassionate, the Most Merciful {i % 97}" for i in range(count)]
+
+def run(label, chunks, embed_batch, batch_size):
+    start = time.perf_counter()
+    embeddings = embed_texts(chunks, batch_size=batch_size, embed_batch=embed_batch)
+    elapsed = time.perf_counter() - start
+    assert len(embeddings) == len(chunks) and all(embeddings)
+    print(f"{label:<28} {len(chunks):>7} chunks  {elapsed:8.2f}s  {len(chunks) / elapsed:10.1f} chunks/s")
+    return embeddings
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.05, help="simulated seconds per API request")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--sequential-sample", type=int, default=200,
+                        help="chunks to time for the sequential baseline (it is slow)")
+    args = parser.parse_args()
+
+    embed_batch = partial(stub_embed_batch, latency=args.latency)
+    chunks = make_chunks(args.chunks)
+
+    sample = chunks[:args.sequential_sample]
+    start = time.perf_counter()
+    for chunk in sample:
+        embed_batch([chunk])
+    elapsed = time.perf_counter() - start
+    print(f"{'sequential (1 per request)':<28} {len(sample):>7} chunks  {elapsed:8.2f}s  {len(sample) / elapsed:10.1f} chunks/s")
+
+    batched = run("batched + concurrent", chunks, embed_batch, args.batch_size)
+
+    # Results must line up with the input chunks
+    assert batched[:len(sample)] == embed_batch(sample)
+
+if __name__ == "__main__":
+    main()
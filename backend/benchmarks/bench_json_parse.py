@@ -0,0 +1,224 @@
+"""Peak memory and time: streaming JSON parser vs the previous json.load parser
+
+Generates a synthetic Quran-style JSON file (surahs with nested ayahs
+arrays), then parses it in a fresh subprocess per implementation and
+reports wall time and peak RSS.
+
+    python3 backend/benchmarks/bench_json_parse.py --surahs 2000 --ayahs 300
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from parsers import iter_json_file
+
+def eager_process_json_file(file_path):
+    """The previous json.load-based parser, kept verbatim as the baseline"""
+    pages_info = []
+
+    try:
+        with open(file_path, 'r', encoding='utf-8') as file:
+            json_data = json.load(file)
+
+            # Handle different JSON structures
+            if isinstance(json_data, list):
+                # Array of objects - check for Quran surah structure
+                for i, obj in enumerate(json_data):
+                    if isinstance(obj, dict):
+                        # Check if this is a Quran surah with ayahs array
+                        if 'ayahs' in obj and isinstance(obj['ayahs'], list):
+                            # Extract surah-level metadata
+                            surah_number = int(obj.get('Surah Number', i + 1))
+                            surah_name_english = obj.get('Surah Name English', f'Surah {surah_number}')
+                            surah_name_arabic = obj.get('Surah Name Arabic', '')
+                            
+                            # Process each ayah in the surah
+                            for ayah in obj['ayahs']:
+                                if isinstance(ayah, dict):
+                                    text_parts = []
+                                    metadata = {
+                                        'content_type': 'verse',
+                                        'surah_number': surah_number,
+                                        'surah_name_english': surah_name_english,
+                                        'surah_name_arabic': surah_name_arabic,
+                                        'chapter': surah_number,  # For compatibility
+                                    }
+                                    
+                                    # Extract verse number
+                                    if 'ayah' in ayah:
+                                        verse_number = int(ayah['ayah'])
+                                        metadata['verse_number'] = verse_number
+                                        metadata['ayah'] = verse_number
+                                    
+                                    # Extract Arabic text
+                                    if 'arabic' in ayah:
+                                        metadata['arabic'] = ayah['arabic']
+                                        text_parts.append(f"Arabic: {ayah['arabic']}")
+                                    
+                                    # Extract English translation
+                                    if 'Clear Quran English' in ayah:
+                                        metadata['english'] = ayah['Clear Quran English']
+                                        text_parts.append(f"English: {ayah['Clear Quran English']}")
+                                    
+                                    # Create searchable text
+                                    searchable_text = ' | '.join(text_parts)
+                                    
+                                    if searchable_text.strip():
+                                        pages_info.append({
+                                            'page_num': f"{surah_number}:{ayah.get('ayah', 'unknown')}",
+                                            'text': searchable_text,
+                                            'metadata': metadata,
+                                            'raw_json': ayah
+                                        })
+                        else:
+                            # Process as regular flat object
+                            structured_content = {
+                                'index': i,
+                                'raw_data': obj,
+                                'searchable_text': '',
+                                'metadata': {}
+                            }
+
+                            # Extract searchable text
+                            text_parts = []
+                            for key, value in obj.items():
+                                if isinstance(value, str) and len(value) > 5:
+                                    text_parts.append(f"{key}: {value}")
+                                    structured_content['metadata'][key] = value
+                                elif isinstance(value, (int, float, bool)):
+                                    structured_content['metadata'][key] = value
+
+                            structured_content['searchable_text'] = ' | '.join(text_parts)
+
+                            if structured_content['searchable_text'].strip():
+                                pages_info.append({
+                                    'page_num': i + 1,
+                                    'text': structured_content['searchable_text'],
+                                    'metadata': structured_content['metadata'],
+                                    'raw_json': obj
+                                })
+
+            elif isinstance(json_data, dict):
+                # Single object or nested structure
+                def extract_from_dict(data, prefix="", page_num=1):
+                    text_parts = []
+                    metadata = {}
+
+                    for key, value in data.items():
+                        full_key = f"{prefix}.{key}" if prefix else key
+
+                        if isinstance(value, str) and len(value) > 5:
+                            text_parts.append(f"{full_key}: {value}")
+                            metadata[full_key] = value
+                        elif isinstance(value, (int, float, bool)):
+                            metadata[full_key] = value
+                        elif isinstance(value, dict):
+                            # Recursively handle nested objects
+                            nested_text, nested_meta = extract_from_dict(value, full_key, page_num)
+                            text_parts.extend(nested_text)
+                            metadata.update(nested_meta)
+
+                    return text_parts, metadata
+
+                text_parts, metadata = extract_from_dict(json_data)
+
+                if text_parts:
+                    pages_info.append({
+                        'page_num': 1,
+                        'text': ' | '.join(text_parts),
+                        'metadata': metadata,
+                        'raw_json': json_data
+                    })
+
+        return pages_info
+
+    except Exception as e:
+        print(f"Error processing JSON file: {e}")
+        return []
+
+def write_corpus(path, surahs, ayahs):
+    """Write a multi-translation-sized Quran JSON file one surah at a time"""
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("[\n")
+        for s in range(1, surahs + 1):
+            surah = {
+                "Surah Number": s,
+                "Surah Name English": f"Surah-{s}",
+                "Surah Name Arabic": "سورة",
+                "ayahs": [
+                    {
+                        "ayah": a,
+                        "arabic": "بِسْمِ اللَّهِ الرَّحْمَـٰنِ الرَّحِيمِ " * 3,
+                        "Clear Quran English": f"In the name of Allah, the Most Compassionate, the Most Merciful ({s}:{a}).",
+                    }
+                    for a in range(1, ayahs + 1)
+                ],
+            }
+            f.write(json.dumps(surah, ensure_ascii=False, indent=2))
+            f.write(",\n" if s < surahs else "\n")
+        f.write("]\n")
+
+def peak_rss_mb():
+    """Peak resident set size of this process"""
+    # ru_maxrss survives exec on Linux, so prefer the per-address-space high-water mark
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KiB on Linux
+
+def measure(implementation, path):
+    """Parse the file in this process and report time, record count and peak RSS"""
+    start = time.perf_counter()
+    if implementation == "eager":
+        count = len(eager_process_json_file(path))
+    else:
+        count = sum(1 for _ in iter_json_file(path))
+    elapsed = time.perf_counter() - start
+    print(json.dumps({"implementation": implementation, "records": count, "seconds": elapsed, "peak_rss_mb": peak_rss_mb()}))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--surahs", type=int, default=1000)
+    parser.add_argument("--ayahs", type=int, default=200)
+    parser.add_argument("--file", help="parse an existing JSON file instead of generating one")
+    parser.add_argument("--measure", choices=["eager", "streaming"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(args.measure, args.file)
+        return
+
+    path = args.file
+    if not path:
+        fd, path = tempfile.mkstemp(suffix=".json")
+        os.close(fd)
+        write_corpus(path, args.surahs, args.ayahs)
+    try:
+        print(f"File: {path} ({os.path.getsize(path) / 2**20:.1f} MB)")
+        for implementation in ("eager", "streaming"):
+            output = subprocess.run(
+                [sys.executable, __file__, "--measure", implementation, "--file", path],
+                check=True, capture_output=True, text=True,
+            ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            print(f"{implementation:<10} {result['records']:>9} records  {result['seconds']:7.2f}s  peak RSS {result['peak_rss_mb']:8.1f} MB")
+
+        # Both parsers must produce the same records
+        assert list(iter_json_file(path)) == eager_process_json_file(path)
+    finally:
+        if not args.file:
+            os.remove(path)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Throughput of serial vs parallel JSONL parsing
+
+Generates a synthetic Quran-style JSONL corpus and parses it with the serial
+parser and with the process-pool parser at 1, 2, 4 and N workers, checking
+that every variant yields exactly the serial output.
+
+    python3 backend/benchmarks/bench_jsonl_parse.py --lines 1000000
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from parsers import iter_jsonl_file, iter_jsonl_file_parallel
+
+def write_corpus(path, lines):
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(lines):
+            if i % 1000 == 999:
+                f.write("{not valid json\n")
+                continue
+            if i % 500 == 0:
+                f.write("\n")
+            f.write(json.dumps({
+                "surah": i // 200 + 1,
+                "ayah": i % 200 + 1,
+                "arabic": "بِسْمِ اللَّهِ الرَّحْمَـٰنِ الرَّحِيمِ",
+                "Clear Quran English": f"In the name of Allah, the Most Compassionate, the Most Merciful ({i}).",
+                "translation": "Au nom d'Allah, le Tout Miséricordieux, le Très Miséricordieux.",
+            }, ensure_ascii=False) + "\n")
+
+def checksum(records):
+    digest = hashlib.sha256()
+    count = 0
+    for record in records:
+        digest.update(json.dumps(record, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+        count += 1
+    return count, digest.hexdigest()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", type=int, default=500000)
+    parser.add_argument("--file", help="parse an existing JSONL file instead of generating one")
+    args = parser.parse_args()
+
+    path = args.file
+    if not path:
+        fd, path = tempfile.mkstemp(suffix=".jsonl")
+        os.close(fd)
+        write_corpus(path, args.lines)
+
+    # Invalid lines are reported on stdout by the parsers; keep the table readable
+    real_stdout = sys.stdout
+    def timed(label, make_records):
+        sys.stdout = open(os.devnull, "w")
+        try:
+            start = time.perf_counter()
+            count = sum(1 for _ in make_records())
+            elapsed = time.perf_counter() - start
+        finally:
+            sys.stdout.close()
+            sys.stdout = real_stdout
+        print(f"{label:<14} {count:>9} records  {elapsed:7.2f}s  {count / elapsed:12.0f} records/s")
+
+    try:
+        print(f"File: {path} ({os.path.getsize(path) / 2**20:.1f} MB), {os.cpu_count()} CPUs")
+        timed("serial", lambda: iter_jsonl_file(path))
+        worker_counts = sorted({1, 2, 4, os.cpu_count() or 1})
+        for workers in worker_counts:
+            timed(f"parallel x{workers}", lambda: iter_jsonl_file_parallel(path, workers=workers))
+
+        sys.stdout = open(os.devnull, "w")
+        try:
+            expected = checksum(iter_jsonl_file(path))
+            actual = checksum(iter_jsonl_file_parallel(path, workers=worker_counts[-1]))
+        finally:
+            sys.stdout.close()
+            sys.stdout = real_stdout
+        assert actual == expected, "parallel output differs from serial output"
+        print(f"Output identical to serial ({expected[0]} records)")
+    finally:
+        if not args.file:
+            os.remove(path)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""Latency benchmark for MMR re-ranking
+
+Times mmr_select over candidate pools of embedding-sized vectors, with a
+group of near-duplicate candidates at the top of the pool, and checks that
+the near-duplicates don't fill the selected set.
+
+    python3 backend/benchmarks/bench_mmr.py --pool 40 100 300 --k 5
+"""
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from embeddings import EMBEDDING_DIMENSION
+from rerank import mmr_select
+
+def make_pool(size, dimension, duplicates, rng):
+    """Random candidates whose first `duplicates` rows are near-copies of one vector"""
+    vectors = rng.standard_normal((size, dimension)).astype(np.float32)
+    vectors[:duplicates] = vectors[0] + 0.01 * rng.standard_normal((duplicates, dimension)).astype(np.float32)
+    relevance = np.sort(rng.random(size).astype(np.float32))[::-1]
+    relevance[:duplicates] = 1.0 - 0.001 * np.arange(duplicates)
+    return relevance, vectors
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pool", type=int, nargs="+", default=[40, 100, 300])
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--duplicates", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    for size in args.pool:
+        relevance, vectors = make_pool(size, EMBEDDING_DIMENSION, args.duplicates, rng)
+        mmr_select(relevance, vectors, args.k)  # warm up
+
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            selected = mmr_select(relevance, vectors, args.k)
+        elapsed = (time.perf_counter() - start) / args.repeat
+
+        duplicates_kept = sum(1 for i in selected if i < args.duplicates)
+        print(f"pool {size:>5}  k {args.k:>3}  {elapsed * 1000:8.3f} ms  near-duplicates kept {duplicates_kept}/{args.duplicates}")
+        assert duplicates_kept == 1
+
+if __name__ == "__main__":
+    main()
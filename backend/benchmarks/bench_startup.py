@@ -0,0 +1,87 @@
+"""Cold start: time to import the app and serve its first requests
+
+Each run starts a fresh interpreter against an empty DATA_DIR with the stub
+embedder and the local vector store, then reports how long `import app`
+takes and the latency of the first /api/hello and first search (which is
+where lazily created services get initialized). With --warm-up the app is
+started with SERVICE_WARM_UP=1 and the time until /api/ready returns 200 is
+reported too.
+
+    python3 backend/benchmarks/bench_startup.py --runs 5 --warm-up
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+def measure():
+    """Runs in the child process: print one JSON line of timings"""
+    start = time.perf_counter()
+    import app
+    imported = time.perf_counter()
+    client = app.app.test_client()
+
+    def timed(method, path, **kwargs):
+        request_start = time.perf_counter()
+        response = getattr(client, method)(path, **kwargs)
+        return response, (time.perf_counter() - request_start) * 1000
+
+    _, hello_ms = timed("get", "/api/hello")
+    _, search_ms = timed("post", "/api/test-search", json={"query": "mercy and forgiveness", "mode": "vector"})
+    _, second_search_ms = timed("post", "/api/test-search", json={"query": "patience in hardship", "mode": "vector"})
+
+    ready_ms = None
+    while True:
+        if client.get("/api/ready").status_code == 200:
+            ready_ms = (time.perf_counter() - start) * 1000
+            break
+        time.sleep(0.01)
+
+    print(json.dumps({
+        "import_ms": (imported - start) * 1000,
+        "first_hello_ms": hello_ms,
+        "first_search_ms": search_ms,
+        "second_search_ms": second_search_ms,
+        "ready_ms": ready_ms,
+    }))
+
+def run_once(warm_up):
+    data_dir = tempfile.mkdtemp(prefix="bench_startup_")
+    env = dict(os.environ, DATA_DIR=data_dir, EMBEDDING_BACKEND="stub", VECTOR_BACKEND="local",
+               SERVICE_WARM_UP="1" if warm_up else "0")
+    try:
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--measure"],
+            check=True, capture_output=True, text=True, env=env, cwd=BACKEND_DIR,
+        ).stdout
+        return json.loads(output.strip().splitlines()[-1])
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--warm-up", action="store_true", help="also measure with SERVICE_WARM_UP=1")
+    parser.add_argument("--measure", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure()
+        return
+
+    for warm_up in ((False, True) if args.warm_up else (False,)):
+        runs = [run_once(warm_up) for _ in range(args.runs)]
+        print(f"SERVICE_WARM_UP={int(warm_up)} (median of {args.runs} runs)")
+        for field in ("import_ms", "first_hello_ms", "first_search_ms", "second_search_ms", "ready_ms"):
+            print(f"  {field:<18} {statistics.median(run[field] for run in runs):9.1f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+import os
+import time
+import asyncio
+from types import SimpleNamespace
+
+# Chat completion backend: the OpenAI API, or a deterministic local stand-in
+# (COMPLETION_BACKEND=stub) for offline runs and benchmarks. The stub mimics
+# the part of the client API the app uses, chat.completions.create() with and
+# without stream=True, so it can be swapped in for the openai module.
+
+COMPLETION_BACKEND = os.getenv("COMPLETION_BACKEND", "openai")  # "openai" or "stub"
+STUB_COMPLETION_LATENCY = float(os.getenv("STUB_COMPLETION_LATENCY", "0"))  # Seconds until the first token
+STUB_COMPLETION_TOKEN_LATENCY = float(os.getenv("STUB_COMPLETION_TOKEN_LATENCY", "0"))  # Seconds per streamed token
+
+def stub_answer(messages, max_tokens=500):
+    """Deterministic answer for a prompt: restates the question and quotes the start of each context passage"""
+    prompt = messages[-1]["content"] if messages else ""
+    context, _, question = prompt.rpartition("Question:")
+    context = context.split("\n", 1)[1] if "\n" in context else ""  # Drop the "Context from ..." line
+    passages = [passage for passage in context.split("\n\n") if passage.strip()]
+    words = f"Regarding {question.strip().splitlines()[0] if question.strip() else 'the question'}:".split()
+    for passage in passages:
+        words += passage.split()[:20] + ["..."]
+    return " ".join(words[:max_tokens])
+
+class _StubCompletions:
+    def __init__(self, latency, token_latency):
+        self.latency = latency
+        self.token_latency = token_latency
+
+    def _response(self, answer, model):
+        message = SimpleNamespace(role="assistant", content=answer)
+        return SimpleNamespace(model=model, choices=[SimpleNamespace(index=0, message=message, finish_reason="stop")])
+
+    def _chunks(self, answer, model):
+        for i, word in enumerate(answer.split(" ")):
+            delta = SimpleNamespace(content=word if i == 0 else f" {word}")
+            yield SimpleNamespace(model=model, choices=[SimpleNamespace(index=0, delta=delta, finish_reason=None)])
+
+    def create(self, messages, model="stub", max_tokens=500, stream=False, **kwargs):
+        time.sleep(self.latency)
+        answer = stub_answer(messages, max_tokens)
+        if not stream:
+            return self._response(answer, model)
+        return self._stream(answer, model)
+
+    def _stream(self, answer, model):
+        for chunk in self._chunks(answer, model):
+            if self.token_latency:
+                time.sleep(self.token_latency)
+            yield chunk
+
+class _StubAsyncCompletions(_StubCompletions):
+    async def create(self, messages, model="stub", max_tokens=500, stream=False, **kwargs):
+        await asyncio.sleep(self.latency)
+        return self._response(stub_answer(messages, max_tokens), model)
+
+class StubOpenAI:
+    """Stand-in for the openai client's chat completions"""
+
+    def __init__(self, latency=None, token_latency=None):
+        latency = STUB_COMPLETION_LATENCY if latency is None else latency
+        token_latency = STUB_COMPLETION_TOKEN_LATENCY if token_latency is None else token_latency
+        self.chat = SimpleNamespace(completions=self._completions(latency, token_latency))
+
+    def _completions(self, latency, token_latency):
+        return _StubCompletions(latency, token_latency)
+
+class StubAsyncOpenAI(StubOpenAI):
+    """Stand-in for AsyncOpenAI's chat completions (non-streaming)"""
+
+    def _completions(self, latency, token_latency):
+        return _StubAsyncCompletions(latency, token_latency)
+
+    async def close(self):
+        pass
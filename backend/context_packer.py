@@ -0,0 +1,120 @@
+import os
+import threading
+
+# Packs retrieved chunks into the chat prompt under a token budget. Chunks are
+# measured with the model's tokenizer (tiktoken when installed, otherwise a
+# characters-per-token estimate), adjacent chunks of the same page are merged
+# so their overlapping text is sent once, and pieces are added best score
+# first while they fit.
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+CONTEXT_CANDIDATES = int(os.getenv("CONTEXT_CANDIDATES", "8"))
+CONTEXT_TOKENIZER_MODEL = "gpt-3.5-turbo"
+CHARS_PER_TOKEN = 4
+CONTEXT_SEPARATOR = "\n\n"
+MAX_OVERLAP_CHARS = 400
+MIN_OVERLAP_CHARS = 20
+
+_encoding = None
+_encoding_lock = threading.Lock()
+
+def _get_encoding():
+    global _encoding
+    with _encoding_lock:
+        if _encoding is None:
+            try:
+                import tiktoken
+                _encoding = tiktoken.encoding_for_model(CONTEXT_TOKENIZER_MODEL)
+            except Exception:
+                # tiktoken missing, or its encoding files can't be loaded (e.g. offline)
+                _encoding = False
+        return _encoding
+
+def count_tokens(text):
+    """Tokens in text for the chat model (estimated if tiktoken is unavailable)"""
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+def truncate_to_tokens(text, max_tokens):
+    """Longest prefix of text that fits in max_tokens"""
+    encoding = _get_encoding()
+    if encoding:
+        return encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens])
+    return text[:max_tokens * CHARS_PER_TOKEN]
+
+def merge_overlap(first, second):
+    """Join two consecutive chunks, dropping text the second repeats from the end of the first"""
+    longest = min(len(first), len(second), MAX_OVERLAP_CHARS)
+    for size in range(longest, MIN_OVERLAP_CHARS - 1, -1):
+        if first.endswith(second[:size]):
+            return first + second[size:]
+    return first + "\n" + second
+
+def _page_key(match):
+    metadata = match.metadata or {}
+    return (metadata.get("reference_set_id"), metadata.get("document_name"), metadata.get("page_number"))
+
+def _merge_adjacent(matches):
+    """Group matches into (matches, text) passages, merging consecutive chunks of the same page
+
+    Passages keep the rank of their best chunk.
+    """
+    by_position = {}
+    for match in matches:
+        index = (match.metadata or {}).get("chunk_index")
+        if isinstance(index, int):
+            by_position[(_page_key(match), index)] = match
+
+    passages = []
+    seen = set()
+    for match in matches:
+        if match.id in seen:
+            continue
+        index = (match.metadata or {}).get("chunk_index")
+        if not isinstance(index, int):
+            seen.add(match.id)
+            passages.append(([match], (match.metadata or {}).get("text", "")))
+            continue
+
+        # Walk back to the first retrieved chunk of this run, then forward through it
+        key = _page_key(match)
+        while (key, index - 1) in by_position and by_position[(key, index - 1)].id not in seen:
+            index -= 1
+        run = []
+        while (key, index) in by_position and by_position[(key, index)].id not in seen:
+            run.append(by_position[(key, index)])
+            seen.add(run[-1].id)
+            index += 1
+
+        text = (run[0].metadata or {}).get("text", "")
+        for part in run[1:]:
+            text = merge_overlap(text, (part.metadata or {}).get("text", ""))
+        passages.append((run, text))
+    return passages
+
+def pack_context(matches, budget=CONTEXT_TOKEN_BUDGET):
+    """Fill a token budget with retrieved chunks, best first
+
+    `matches` must be in relevance order. Returns (context text, matches
+    used, tokens used).
+    """
+    separator_tokens = count_tokens(CONTEXT_SEPARATOR)
+    pieces = []
+    used = []
+    tokens = 0
+    for run, text in _merge_adjacent(matches):
+        if not text.strip():
+            continue
+        cost = count_tokens(text) + (separator_tokens if pieces else 0)
+        if tokens + cost > budget:
+            if pieces:
+                continue  # a shorter passage further down may still fit
+            # The best passage alone is over budget: send as much of it as fits
+            text = truncate_to_tokens(text, budget)
+            cost = count_tokens(text)
+        pieces.append(text)
+        used.extend(run)
+        tokens += cost
+    return CONTEXT_SEPARATOR.join(pieces), used, tokens
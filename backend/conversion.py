@@ -0,0 +1,222 @@
+import os
+import time
+import inspect
+import hashlib
+import sqlite3
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from settings import data_dir
+
+# Docling conversion for non-JSON uploads. Documents are converted in a pool
+# of worker processes (each keeps its own DocumentConverter, so models load
+# once per worker); PDFs longer than CONVERT_PAGES_PER_TASK are split into
+# page ranges converted in parallel (if the installed Docling's convert() takes
+# a page_range; otherwise the whole file is one task). Workers are spawned rather than forked, so
+# they don't inherit the server's threads and locks. A document's items are
+# grouped by page in one pass and each group is exported to markdown, and the
+# pages are cached by file content hash so uploading the same file again skips
+# OCR and layout analysis.
+
+CONVERT_WORKERS = int(os.getenv("CONVERT_WORKERS", str(min(4, os.cpu_count() or 1))))
+CONVERT_PAGES_PER_TASK = int(os.getenv("CONVERT_PAGES_PER_TASK", "20"))
+CONVERSION_CACHE_ENABLED = os.getenv("CONVERSION_CACHE", "1") != "0"
+CONVERSION_CACHE_MAX_DOCUMENTS = int(os.getenv("CONVERSION_CACHE_MAX_DOCUMENTS", "200"))
+
+_worker_converter = None
+
+def _get_worker_converter():
+    global _worker_converter
+    if _worker_converter is None:
+        from docling.document_converter import DocumentConverter
+        _worker_converter = DocumentConverter()
+    return _worker_converter
+
+def export_pages(document):
+    """[(page number, markdown)] for a converted Docling document, one export per run of items on a page"""
+    pages = getattr(document, "pages", None)
+    if not pages:
+        # No page information (e.g. DOCX): the whole document is one page
+        return [(1, document.export_to_markdown())]
+
+    # [page, first item, end] runs in the item order export_to_markdown uses; items without
+    # provenance (groups such as lists) go with the page of the item before them
+    runs = []
+    for index, (item, _level) in enumerate(document.iterate_items(with_groups=True)):
+        prov = getattr(item, "prov", None)
+        page_no = int(prov[0].page_no) if prov else runs[-1][0] if runs else min(int(page_no) for page_no in pages)
+        if runs and runs[-1][0] == page_no:
+            runs[-1][2] = index + 1
+        else:
+            runs.append([page_no, index, index + 1])
+
+    markdown = {}
+    for page_no, start, end in runs:
+        text = document.export_to_markdown(from_element=start, to_element=end)
+        markdown[page_no] = f"{markdown[page_no]}\n\n{text}" if page_no in markdown else text
+    return [(page_no, markdown.get(page_no, "")) for page_no in sorted(int(page_no) for page_no in pages)]
+
+def convert_pages(path, page_range=None):
+    """Worker: convert a file (or an inclusive (first, last) page range of a PDF) into page markdown"""
+    converter = _get_worker_converter()
+    if page_range is None:
+        return export_pages(converter.convert(path).document)
+    return export_pages(converter.convert(path, page_range=page_range).document)
+
+def _converter_takes_page_range():
+    """Worker: whether this Docling's DocumentConverter.convert accepts a page_range"""
+    from docling.document_converter import DocumentConverter
+    return "page_range" in inspect.signature(DocumentConverter.convert).parameters
+
+def pdf_page_count(path):
+    """Number of pages in a PDF, or None if it can't be read"""
+    try:
+        from PyPDF2 import PdfReader
+        return len(PdfReader(path).pages)
+    except Exception:
+        return None
+
+def page_ranges(page_count, pages_per_task=CONVERT_PAGES_PER_TASK):
+    """Inclusive 1-based (first, last) page ranges covering a document"""
+    return [(first, min(first + pages_per_task - 1, page_count))
+            for first in range(1, page_count + 1, pages_per_task)]
+
+def file_hash(path):
+    """sha256 of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+class ConversionCache:
+    """SQLite cache of converted page markdown keyed by file content hash, LRU by document"""
+
+    def __init__(self, directory, max_documents=CONVERSION_CACHE_MAX_DOCUMENTS):
+        os.makedirs(directory, exist_ok=True)
+        self.max_documents = max_documents
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(directory, "index.db"), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS documents (hash TEXT PRIMARY KEY, pages INTEGER NOT NULL, last_used REAL NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS documents_last_used ON documents(last_used);"
+            "CREATE TABLE IF NOT EXISTS pages ("
+            "hash TEXT NOT NULL, page_num INTEGER NOT NULL, text TEXT NOT NULL, PRIMARY KEY (hash, page_num)) WITHOUT ROWID;"
+        )
+        self._db.commit()
+
+    def get(self, key):
+        """Cached [(page number, markdown)] for a file hash, or None"""
+        with self._lock, self._db:
+            if not self._db.execute("UPDATE documents SET last_used = ? WHERE hash = ?", (time.time(), key)).rowcount:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return self._db.execute("SELECT page_num, text FROM pages WHERE hash = ? ORDER BY page_num", (key,)).fetchall()
+
+    def put(self, key, pages):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM pages WHERE hash = ?", (key,))
+            self._db.execute("INSERT OR REPLACE INTO documents (hash, pages, last_used) VALUES (?, ?, ?)",
+                             (key, len(pages), time.time()))
+            self._db.executemany("INSERT INTO pages (hash, page_num, text) VALUES (?, ?, ?)",
+                                 [(key, page_num, text) for page_num, text in pages])
+            excess = self._db.execute("SELECT COUNT(*) FROM documents").fetchone()[0] - self.max_documents
+            if excess > 0:
+                for (old,) in self._db.execute(
+                    "SELECT hash FROM documents ORDER BY last_used LIMIT ?", (excess,)
+                ).fetchall():
+                    self._db.execute("DELETE FROM pages WHERE hash = ?", (old,))
+                    self._db.execute("DELETE FROM documents WHERE hash = ?", (old,))
+                    self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            documents = self._db.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "documents": documents,
+                "max_documents": self.max_documents,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+_cache = None
+_executor = None
+_page_ranges_supported = None
+_lock = threading.Lock()
+
+def get_conversion_cache():
+    """Shared conversion cache, or None when disabled"""
+    global _cache
+    if not CONVERSION_CACHE_ENABLED:
+        return None
+    with _lock:
+        if _cache is None:
+            _cache = ConversionCache(data_dir("conversions"))
+        return _cache
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=CONVERT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _executor
+
+def page_ranges_supported():
+    """Whether PDFs can be split into page ranges, asked of a worker once per process"""
+    global _page_ranges_supported
+    if _page_ranges_supported is None:
+        try:
+            supported = _get_executor().submit(_converter_takes_page_range).result()
+        except Exception as e:
+            print(f"Error checking Docling page range support: {e}")
+            return False
+        _page_ranges_supported = supported
+    return _page_ranges_supported
+
+def _warm_worker():
+    _get_worker_converter()
+    return os.getpid()
+
+def warm_up():
+    """Start the worker pool and load Docling in its workers ahead of the first upload"""
+    executor = _get_executor()
+    for future in [executor.submit(_warm_worker) for _ in range(CONVERT_WORKERS)]:
+        future.result()
+
+def _convert_in_pool(path):
+    """Yield (page number, markdown) as page ranges finish converting, in page order"""
+    executor = _get_executor()
+    page_count = pdf_page_count(path) if path.lower().endswith(".pdf") else None
+    if not page_count or page_count <= CONVERT_PAGES_PER_TASK or not page_ranges_supported():
+        yield from executor.submit(convert_pages, path).result()
+        return
+
+    pending = deque(executor.submit(convert_pages, path, page_range) for page_range in page_ranges(page_count))
+    while pending:
+        yield from pending.popleft().result()
+
+def convert_document(path):
+    """Yield {'page_num', 'text'} dicts for a document, from the cache or by converting it"""
+    cache = get_conversion_cache()
+    key = file_hash(path) if cache else None
+    pages = cache.get(key) if cache else None
+    if pages is not None:
+        for page_num, text in pages:
+            yield {'page_num': page_num, 'text': text}
+        return
+
+    pages = []
+    for page_num, text in _convert_in_pool(path):
+        pages.append((page_num, text))
+        yield {'page_num': page_num, 'text': text}
+    if cache:
+        cache.put(key, pages)
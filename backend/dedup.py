@@ -0,0 +1,229 @@
+import os
+import json
+import shutil
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+from settings import data_dir
+from lexical_index import tokenize
+
+# Near-duplicate detection for ingestion, one SQLite file per reference set.
+# Every chunk gets an exact hash of its normalized text and a MinHash
+# signature over word shingles; signatures are split into LSH bands so that
+# chunks sharing a band bucket are the only candidates compared. A chunk that
+# matches an earlier one (exactly, or with estimated Jaccard similarity of at
+# least DEDUP_THRESHOLD) is linked to it instead of being embedded again.
+# Duplicates keep their metadata here, so that when the chunk they are linked
+# to changes or is deleted one of them can be promoted and embedded instead.
+
+DEDUP_ENABLED = os.getenv("DEDUP", "1") != "0"
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.9"))
+MINHASH_PERMUTATIONS = 128
+LSH_BANDS = 16
+SHINGLE_SIZE = 3
+
+_PRIME = np.uint64(4294967311)  # smallest prime above 2**32
+_rng = np.random.default_rng(1)
+_A = _rng.integers(1, 2 ** 31, MINHASH_PERMUTATIONS, dtype=np.uint64)[:, None]
+_B = _rng.integers(0, 2 ** 31, MINHASH_PERMUTATIONS, dtype=np.uint64)[:, None]
+
+def _token_hashes(tokens):
+    return np.array([int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=4).digest(), "little")
+                     for token in tokens], dtype=np.uint64)
+
+def minhash(tokens, shingle_size=SHINGLE_SIZE):
+    """MinHash signature (uint32 array) of a token list's word shingles"""
+    hashes = _token_hashes(tokens)
+    if len(hashes) > shingle_size:
+        # Combine the token hashes of each window into one 32-bit shingle hash
+        shingles = np.zeros(len(hashes) - shingle_size + 1, dtype=np.uint64)
+        for offset in range(shingle_size):
+            shingles = (shingles * np.uint64(1000003) + hashes[offset:offset + len(shingles)]) & np.uint64(0xFFFFFFFF)
+        hashes = shingles
+    if not len(hashes):
+        return np.full(MINHASH_PERMUTATIONS, 0xFFFFFFFF, dtype=np.uint32)
+    return (((_A * np.unique(hashes) + _B) % _PRIME) & np.uint64(0xFFFFFFFF)).min(axis=1).astype(np.uint32)
+
+def band_buckets(signature, bands=LSH_BANDS):
+    """One bucket id per LSH band of a signature"""
+    return [int.from_bytes(hashlib.blake2b(band.tobytes(), digest_size=8).digest(), "little", signed=True)
+            for band in np.split(signature, bands)]
+
+class DedupIndex:
+    """Exact-hash and MinHash LSH index over the chunks of one reference set"""
+
+    def __init__(self, directory, threshold=DEDUP_THRESHOLD):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(directory, "index.db"), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            "chunk_id TEXT PRIMARY KEY, hash TEXT NOT NULL, signature BLOB NOT NULL, canonical_id TEXT, metadata TEXT);"
+            "CREATE INDEX IF NOT EXISTS chunks_hash ON chunks(hash) WHERE canonical_id IS NULL;"
+            "CREATE INDEX IF NOT EXISTS chunks_canonical ON chunks(canonical_id) WHERE canonical_id IS NOT NULL;"
+            "CREATE TABLE IF NOT EXISTS bands ("
+            "band INTEGER NOT NULL, bucket INTEGER NOT NULL, chunk_id TEXT NOT NULL, "
+            "PRIMARY KEY (band, bucket, chunk_id)) WITHOUT ROWID;"
+        )
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(chunks)")}
+        if "metadata" not in columns:
+            self._db.execute("ALTER TABLE chunks ADD COLUMN metadata TEXT")
+        self._db.commit()
+
+    def _remove(self, chunk_ids):
+        for start in range(0, len(chunk_ids), 500):
+            chunk = chunk_ids[start:start + 500]
+            placeholders = ", ".join("?" * len(chunk))
+            self._db.execute(f"DELETE FROM chunks WHERE chunk_id IN ({placeholders})", chunk)
+            self._db.execute(f"DELETE FROM bands WHERE chunk_id IN ({placeholders})", chunk)
+
+    def _find(self, chunk_id, digest, signature, buckets):
+        """Canonical chunk that (chunk_id, text) duplicates, or None"""
+        row = self._db.execute(
+            "SELECT chunk_id FROM chunks WHERE hash = ? AND canonical_id IS NULL AND chunk_id != ? LIMIT 1",
+            (digest, chunk_id),
+        ).fetchone()
+        if row:
+            return row[0]
+
+        candidates = set()
+        for band, bucket in enumerate(buckets):
+            candidates.update(found for (found,) in self._db.execute(
+                "SELECT chunk_id FROM bands WHERE band = ? AND bucket = ?", (band, bucket)
+            ))
+        candidates.discard(chunk_id)
+        best, best_similarity = None, self.threshold
+        for candidate in sorted(candidates):
+            (blob,) = self._db.execute("SELECT signature FROM chunks WHERE chunk_id = ?", (candidate,)).fetchone()
+            similarity = float(np.mean(np.frombuffer(blob, dtype=np.uint32) == signature))
+            if similarity >= best_similarity:
+                best, best_similarity = candidate, similarity
+        return best
+
+    def check(self, chunks):
+        """Register {'id', 'metadata'} chunks and return, per chunk, the id of the chunk it duplicates (or None)
+
+        Chunks are compared with everything indexed before them, including
+        earlier chunks of the same call. A chunk is never a duplicate of
+        itself, so re-ingesting a file doesn't link its chunks to their old
+        selves.
+        """
+        duplicates = []
+        with self._lock, self._db:
+            self._remove([chunk["id"] for chunk in chunks])
+            for chunk in chunks:
+                tokens = tokenize(str(chunk["metadata"].get("text", "")))
+                digest = hashlib.sha256(" ".join(tokens).encode("utf-8")).hexdigest()
+                signature = minhash(tokens)
+                buckets = band_buckets(signature)
+                canonical = self._find(chunk["id"], digest, signature, buckets)
+                self._db.execute(
+                    "INSERT OR REPLACE INTO chunks (chunk_id, hash, signature, canonical_id, metadata) VALUES (?, ?, ?, ?, ?)",
+                    (chunk["id"], digest, signature.tobytes(), canonical,
+                     json.dumps(chunk["metadata"]) if canonical else None),
+                )
+                if canonical is None:
+                    # Only canonical chunks are LSH candidates; duplicates point at them
+                    self._db.executemany(
+                        "INSERT OR IGNORE INTO bands (band, bucket, chunk_id) VALUES (?, ?, ?)",
+                        [(band, bucket, chunk["id"]) for band, bucket in enumerate(buckets)],
+                    )
+                duplicates.append(canonical)
+        return duplicates
+
+    def release(self, chunk_ids):
+        """Unlink the duplicates of chunks that are about to change or be deleted
+
+        For each chunk in chunk_ids that others are linked to, the first of
+        those duplicates becomes canonical and the rest are repointed at it.
+        Returns the promoted {'id', 'metadata'} chunks, which now need vectors
+        of their own. Duplicates that are themselves in chunk_ids are left to
+        the caller, and ones indexed before their metadata was kept are
+        dropped, since there is nothing to embed them from.
+        """
+        chunk_ids = list(chunk_ids)
+        excluded = set(chunk_ids)
+        groups = {}
+        with self._lock, self._db:
+            for start in range(0, len(chunk_ids), 500):
+                chunk = chunk_ids[start:start + 500]
+                for duplicate, canonical, signature, metadata in self._db.execute(
+                    "SELECT chunk_id, canonical_id, signature, metadata FROM chunks "
+                    f"WHERE canonical_id IN ({', '.join('?' * len(chunk))}) ORDER BY chunk_id",
+                    chunk,
+                ):
+                    if duplicate not in excluded:
+                        groups.setdefault(canonical, []).append((duplicate, signature, metadata))
+
+            promoted = []
+            orphans = []
+            for duplicates in groups.values():
+                orphans.extend(duplicate for duplicate, _, metadata in duplicates if metadata is None)
+                duplicates = [entry for entry in duplicates if entry[2] is not None]
+                if not duplicates:
+                    continue
+                chunk_id, signature, metadata = duplicates[0]
+                self._db.execute("UPDATE chunks SET canonical_id = NULL, metadata = NULL WHERE chunk_id = ?", (chunk_id,))
+                self._db.executemany(
+                    "INSERT OR IGNORE INTO bands (band, bucket, chunk_id) VALUES (?, ?, ?)",
+                    [(band, bucket, chunk_id)
+                     for band, bucket in enumerate(band_buckets(np.frombuffer(signature, dtype=np.uint32)))],
+                )
+                self._db.executemany("UPDATE chunks SET canonical_id = ? WHERE chunk_id = ?",
+                                     [(chunk_id, duplicate) for duplicate, _, _ in duplicates[1:]])
+                promoted.append({"id": chunk_id, "metadata": json.loads(metadata)})
+            self._remove(orphans)
+        return promoted
+
+    def discard(self, chunk_ids):
+        """Forget chunks whose vectors never made it into the store, with the duplicates linked to them
+
+        Returns the ids of those duplicates, which have nothing to point at now.
+        """
+        chunk_ids = list(chunk_ids)
+        duplicates = []
+        with self._lock, self._db:
+            for start in range(0, len(chunk_ids), 500):
+                chunk = chunk_ids[start:start + 500]
+                duplicates.extend(found for (found,) in self._db.execute(
+                    f"SELECT chunk_id FROM chunks WHERE canonical_id IN ({', '.join('?' * len(chunk))})", chunk
+                ))
+            self._remove(chunk_ids + duplicates)
+        return duplicates
+
+    def duplicates_of(self, chunk_id):
+        """Ids of the chunks linked to a canonical chunk"""
+        with self._lock:
+            return [found for (found,) in self._db.execute(
+                "SELECT chunk_id FROM chunks WHERE canonical_id = ? ORDER BY chunk_id", (chunk_id,)
+            )]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def _index_directory(ref_set_id):
+    return os.path.join(data_dir("dedup"), ref_set_id)
+
+def get_dedup_index(ref_set_id):
+    """Shared dedup index for a reference set (created on first use)"""
+    with _indexes_lock:
+        index = _indexes.get(ref_set_id)
+        if index is None:
+            index = _indexes[ref_set_id] = DedupIndex(_index_directory(ref_set_id))
+        return index
+
+def drop_dedup_index(ref_set_id):
+    """Delete a reference set's dedup index"""
+    with _indexes_lock:
+        index = _indexes.pop(ref_set_id, None)
+        if index is not None:
+            index.close()
+        shutil.rmtree(_index_directory(ref_set_id), ignore_errors=True)
@@ -0,0 +1,150 @@
+import os
+import re
+import mmap
+import time
+import hashlib
+import sqlite3
+import threading
+import unicodedata
+from array import array
+
+# Content-addressed embedding cache.
+# Vectors are stored as packed float32 rows in a flat file (memory-mapped),
+# and a small SQLite table maps (model, text hash) -> row slot with an LRU clock.
+
+_WHITESPACE = re.compile(r"\s+")
+
+def normalize_text(text):
+    """Normalize text so trivially different copies share a cache entry"""
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+def cache_key(model, text):
+    """Cache key for an embedding: hash of model name and normalized text"""
+    return hashlib.sha256(f"{model}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+class EmbeddingCache:
+    """Disk-backed embedding cache with LRU eviction"""
+
+    def __init__(self, directory, dimension, max_entries=50000):
+        os.makedirs(directory, exist_ok=True)
+        self.dimension = dimension
+        self.max_entries = max_entries
+        self.row_bytes = dimension * 4
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        self._db = sqlite3.connect(os.path.join(directory, "index.db"), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, slot INTEGER UNIQUE NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries(last_used)")
+        self._db.commit()
+
+        self._file = open(os.path.join(directory, "vectors.f32"), "a+b")
+        self._mmap = None
+        self._capacity = 0
+        self._ensure_capacity(self._entry_count())
+
+    def _entry_count(self):
+        return self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def _ensure_capacity(self, slots):
+        """Grow the vector file (doubling) so it holds at least `slots` rows"""
+        current = os.fstat(self._file.fileno()).st_size // self.row_bytes
+        if slots <= current and self._mmap is not None:
+            return
+        capacity = max(current, 1024)
+        while capacity < slots:
+            capacity *= 2
+        capacity = min(capacity, max(self.max_entries, slots))
+        if capacity > current:
+            self._file.truncate(capacity * self.row_bytes)
+        if self._mmap is not None:
+            self._mmap.close()
+        self._mmap = mmap.mmap(self._file.fileno(), capacity * self.row_bytes)
+        self._capacity = capacity
+
+    def _read_slot(self, slot):
+        offset = slot * self.row_bytes
+        return array("f", self._mmap[offset:offset + self.row_bytes]).tolist()
+
+    def _write_slot(self, slot, vector):
+        offset = slot * self.row_bytes
+        self._mmap[offset:offset + self.row_bytes] = array("f", vector).tobytes()
+
+    def get_many(self, model, texts):
+        """Look up embeddings for texts; misses come back as None"""
+        keys = [cache_key(model, text) for text in texts]
+        results = [None] * len(texts)
+        with self._lock:
+            slots = {}
+            unique_keys = list(set(keys))
+            # Stay well under SQLite's bound-parameter limit
+            for start in range(0, len(unique_keys), 500):
+                batch = unique_keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                slots.update(self._db.execute(
+                    f"SELECT key, slot FROM entries WHERE key IN ({placeholders})", batch
+                ).fetchall())
+
+            for i, key in enumerate(keys):
+                if key in slots:
+                    results[i] = self._read_slot(slots[key])
+                    self.hits += 1
+                else:
+                    self.misses += 1
+
+            if slots:
+                now = time.time()
+                self._db.executemany("UPDATE entries SET last_used = ? WHERE key = ?", [(now, key) for key in slots])
+                self._db.commit()
+        return results
+
+    def put_many(self, model, texts, vectors):
+        """Store embeddings, evicting least recently used entries when full"""
+        with self._lock:
+            now = time.time()
+            for text, vector in zip(texts, vectors):
+                if vector is None or len(vector) != self.dimension:
+                    continue
+                key = cache_key(model, text)
+                row = self._db.execute("SELECT slot FROM entries WHERE key = ?", (key,)).fetchone()
+                if row:
+                    slot = row[0]
+                else:
+                    count = self._entry_count()
+                    if count >= self.max_entries:
+                        # Reuse the slot of the least recently used entry
+                        old_key, slot = self._db.execute(
+                            "SELECT key, slot FROM entries ORDER BY last_used LIMIT 1"
+                        ).fetchone()
+                        self._db.execute("DELETE FROM entries WHERE key = ?", (old_key,))
+                        self.evictions += 1
+                    else:
+                        slot = count
+                        self._ensure_capacity(slot + 1)
+                self._write_slot(slot, vector)
+                self._db.execute(
+                    "INSERT OR REPLACE INTO entries (key, slot, last_used) VALUES (?, ?, ?)", (key, slot, now)
+                )
+            self._db.commit()
+            self._mmap.flush()
+
+    def stats(self):
+        """Hit/miss counters and size of the cache"""
+        with self._lock:
+            entries = self._entry_count()
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "size_bytes": entries * self.row_bytes,
+        }
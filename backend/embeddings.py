@@ -0,0 +1,141 @@
+import os
+import re
+import time
+import hashlib
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from embedding_cache import EmbeddingCache
+from metrics import timed
+from settings import data_dir
+
+# Embedding engine: many chunks per request, several requests in flight
+EMBEDDING_MODEL = "text-embedding-ada-002"
+EMBEDDING_DIMENSION = 1536  # OpenAI embedding dimension
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "openai")  # "openai" or "stub"
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "100"))
+EMBEDDING_MAX_WORKERS = int(os.getenv("EMBEDDING_MAX_WORKERS", "4"))
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", "3"))
+STUB_EMBEDDING_LATENCY = float(os.getenv("STUB_EMBEDDING_LATENCY", "0"))
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE", "1") != "0"
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "50000"))
+
+_executor = None
+_executor_lock = threading.Lock()
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_executor():
+    """Shared worker pool so concurrent uploads together stay within EMBEDDING_MAX_WORKERS requests"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=EMBEDDING_MAX_WORKERS, thread_name_prefix="embed")
+        return _executor
+
+def get_embedding_cache():
+    """Shared on-disk embedding cache, or None when disabled"""
+    global _cache
+    if not EMBEDDING_CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = EmbeddingCache(
+                data_dir("embedding_cache"),
+                EMBEDDING_DIMENSION,
+                max_entries=EMBEDDING_CACHE_MAX_ENTRIES,
+            )
+        return _cache
+
+def openai_embed_batch(texts, model=EMBEDDING_MODEL):
+    """Embed a list of texts with a single embeddings API request"""
+    import openai  # deferred: the client library is slow to import and unused with the stub backend
+    response = openai.embeddings.create(model=model, input=texts)
+    # Each item carries the position of its input, so restore input order explicitly
+    return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+_TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+def stub_embed_batch(texts, model=EMBEDDING_MODEL, latency=None, dimension=EMBEDDING_DIMENSION):
+    """Deterministic local embedder for offline runs and benchmarks
+
+    Words are hashed into signed buckets (feature hashing), so texts that share
+    vocabulary get similar vectors. `latency` simulates one API round-trip per batch.
+    """
+    latency = STUB_EMBEDDING_LATENCY if latency is None else latency
+    if latency:
+        time.sleep(latency)
+
+    embeddings = []
+    for text in texts:
+        vector = [0.0] * dimension
+        for token in _TOKEN_PATTERN.findall(text.lower()):
+            digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % dimension
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = math.sqrt(sum(value * value for value in vector))
+        if norm == 0:
+            # Texts without word characters still need a valid unit vector
+            vector[0] = norm = 1.0
+        embeddings.append([value / norm for value in vector])
+    return embeddings
+
+def get_embed_batch_fn():
+    """Return the batch embedder selected by EMBEDDING_BACKEND"""
+    if EMBEDDING_BACKEND == "stub":
+        return stub_embed_batch
+    return openai_embed_batch
+
+def _embed_with_retry(batch, embed_batch, model):
+    """Embed one batch, backing off on rate limits and transient errors"""
+    for attempt in range(EMBEDDING_MAX_RETRIES + 1):
+        try:
+            return embed_batch(batch, model=model)
+        except Exception as e:
+            if attempt == EMBEDDING_MAX_RETRIES:
+                print(f"Error getting embeddings for batch of {len(batch)}: {e}")
+                return [None] * len(batch)
+            delay = 2 ** attempt
+            print(f"Embedding batch failed ({e}), retrying in {delay}s...")
+            time.sleep(delay)
+
+@timed("embed")
+def embed_texts(texts, model=EMBEDDING_MODEL, batch_size=None, embed_batch=None, cache=None):
+    """Embed texts in batches on the shared worker pool
+
+    Returns one embedding per input text, in input order. Texts whose batch
+    failed after all retries map to None. With the default embedder, texts are
+    looked up in the embedding cache first and only misses are sent out.
+    """
+    texts = list(texts)
+    if not texts:
+        return []
+
+    if embed_batch is None:
+        embed_batch = get_embed_batch_fn()
+        cache = get_embedding_cache()
+    batch_size = batch_size or EMBEDDING_BATCH_SIZE
+    # Keep stub vectors from ever being served as real ones
+    cache_model = model if embed_batch is openai_embed_batch else f"{getattr(embed_batch, '__name__', 'custom')}/{model}"
+
+    embeddings = cache.get_many(cache_model, texts) if cache else [None] * len(texts)
+
+    # Embed each distinct missing text once
+    missing = list(dict.fromkeys(text for text, embedding in zip(texts, embeddings) if embedding is None))
+    if not missing:
+        return embeddings
+
+    executor = get_executor()
+    futures = [
+        executor.submit(_embed_with_retry, missing[start:start + batch_size], embed_batch, model)
+        for start in range(0, len(missing), batch_size)
+    ]
+    fresh = []
+    for future in futures:
+        fresh.extend(future.result())
+
+    if cache:
+        cache.put_many(cache_model, missing, fresh)
+
+    by_text = dict(zip(missing, fresh))
+    return [embedding if embedding is not None else by_text[text] for text, embedding in zip(texts, embeddings)]
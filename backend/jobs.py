@@ -0,0 +1,126 @@
+import os
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Background jobs (file ingestion) run on a local worker pool; progress is
+# kept in memory so /api/jobs/<id> can report it while the job runs. A job can
+# be cancelled (e.g. when its reference set is deleted): it stops the next
+# time it calls check_cancelled().
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", str(24 * 3600)))
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+_cancelled = set()
+_finished = {}  # job id -> Event set once the job has stopped
+_executor = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix="ingest")
+
+def _prune_finished_jobs():
+    """Forget finished jobs older than JOB_RETENTION_SECONDS (caller holds the lock)"""
+    cutoff = time.time() - JOB_RETENTION_SECONDS
+    for job_id in [job_id for job_id, job in _jobs.items()
+                   if job["finished_at"] and job["finished_at"] < cutoff]:
+        del _jobs[job_id]
+        _finished.pop(job_id, None)
+        _cancelled.discard(job_id)
+
+class JobCancelled(Exception):
+    """Raised by check_cancelled() in a job that was cancelled"""
+
+def create_job(kind, **info):
+    """Register a new queued job and return its id"""
+    job_id = str(uuid.uuid4())
+    job = {
+        "id": job_id,
+        "kind": kind,
+        "status": "queued",
+        "stage": "queued",
+        "pages_total": 0,
+        "pages_done": 0,
+        "chunks_embedded": 0,
+        "chunks_unchanged": 0,
+        "chunks_deduplicated": 0,
+        "embedding_calls_saved": 0,
+        "vectors_deleted": 0,
+        "vectors_upserted": 0,
+        "errors": [],
+        "result": None,
+        "created_at": time.time(),
+        "started_at": None,
+        "finished_at": None,
+    }
+    job.update(info)
+    with _jobs_lock:
+        _prune_finished_jobs()
+        _jobs[job_id] = job
+        _finished[job_id] = threading.Event()
+    return job_id
+
+def get_job(job_id):
+    """Return a snapshot of a job, or None if unknown"""
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        return dict(job, errors=list(job["errors"])) if job else None
+
+def update_job(job_id, **fields):
+    """Set fields on a job (e.g. stage, pages_total)"""
+    with _jobs_lock:
+        if job_id in _jobs:
+            _jobs[job_id].update(fields)
+
+def increment_job(job_id, **deltas):
+    """Add to a job's progress counters"""
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        if job:
+            for field, delta in deltas.items():
+                job[field] += delta
+
+def add_job_error(job_id, message):
+    """Record a non-fatal error on a job"""
+    with _jobs_lock:
+        if job_id in _jobs:
+            _jobs[job_id]["errors"].append(message)
+
+def check_cancelled(job_id):
+    """Raise JobCancelled if the job has been cancelled"""
+    with _jobs_lock:
+        if job_id in _cancelled:
+            raise JobCancelled(f"Job {job_id} was cancelled")
+
+def cancel_jobs(timeout=None, **match):
+    """Cancel the unfinished jobs whose fields equal `match` and wait up to timeout seconds for them to stop
+
+    Returns the ids of the cancelled jobs.
+    """
+    with _jobs_lock:
+        job_ids = [job_id for job_id, job in _jobs.items()
+                   if not job["finished_at"] and all(job.get(field) == value for field, value in match.items())]
+        _cancelled.update(job_ids)
+        events = [_finished[job_id] for job_id in job_ids]
+    deadline = None if timeout is None else time.time() + timeout
+    for event in events:
+        event.wait(None if deadline is None else max(deadline - time.time(), 0))
+    return job_ids
+
+def _run_job(job_id, fn, args, kwargs):
+    try:
+        check_cancelled(job_id)
+        update_job(job_id, status="running", started_at=time.time())
+        result = fn(job_id, *args, **kwargs)
+        update_job(job_id, status="completed", stage="done", result=result, finished_at=time.time())
+    except JobCancelled:
+        print(f"Job {job_id} cancelled")
+        update_job(job_id, status="cancelled", stage="cancelled", finished_at=time.time())
+    except Exception as e:
+        print(f"Job {job_id} failed: {e}")
+        add_job_error(job_id, str(e))
+        update_job(job_id, status="failed", finished_at=time.time())
+    finally:
+        _finished[job_id].set()
+
+def submit_job(job_id, fn, *args, **kwargs):
+    """Run fn(job_id, *args, **kwargs) on the worker pool"""
+    _executor.submit(_run_job, job_id, fn, args, kwargs)
@@ -0,0 +1,270 @@
+import os
+import re
+import json
+import math
+import heapq
+import shutil
+import sqlite3
+import threading
+import unicodedata
+from collections import Counter
+import numpy as np
+from settings import data_dir
+from metrics import timed
+from vector_store import Match
+
+# On-disk BM25 keyword index, one SQLite file per reference set. Posting
+# lists are stored as varint-encoded (doc gap, term frequency) pairs. New
+# documents always get higher doc numbers, so each indexed batch appends one
+# segment per term instead of rewriting the list; a term's segments are
+# merged once there are COMPACT_SEGMENTS of them. Posting lists are decoded
+# with NumPy at query time and scored in bulk.
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+RRF_K = 60
+COMPACT_SEGMENTS = 32
+
+_ARABIC_DIACRITICS = re.compile("[\u0610-\u061A\u064B-\u065F\u0670\u06D6-\u06ED]")
+_ALEF_VARIANTS = str.maketrans({"\u0623": "\u0627", "\u0625": "\u0627", "\u0622": "\u0627", "\u0671": "\u0627"})
+_TATWEEL = "\u0640"
+_TOKEN = re.compile(r"\w+")
+
+def normalize_arabic(text):
+    """Strip Arabic diacritics and tatweel and unify alef variants"""
+    return _ARABIC_DIACRITICS.sub("", text).replace(_TATWEEL, "").translate(_ALEF_VARIANTS)
+
+def tokenize(text):
+    """Lowercased, Arabic-normalized word tokens"""
+    return _TOKEN.findall(normalize_arabic(unicodedata.normalize("NFKC", text)).casefold())
+
+def encode_varints(values):
+    """LEB128-style unsigned varint encoding"""
+    out = bytearray()
+    for value in values:
+        while value >= 0x80:
+            out.append((value & 0x7F) | 0x80)
+            value >>= 7
+        out.append(value)
+    return bytes(out)
+
+def decode_varints(data):
+    """Decode a varint byte string into an int64 array (vectorized)"""
+    raw = np.frombuffer(data, dtype=np.uint8)
+    if not len(raw):
+        return np.empty(0, dtype=np.int64)
+    ends = np.flatnonzero(raw < 0x80)
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    shifts = (np.arange(len(raw)) - np.repeat(starts, ends - starts + 1)) * 7
+    return np.add.reduceat((raw & 0x7F).astype(np.int64) << shifts, starts)
+
+class LexicalIndex:
+    """BM25 index over the chunks of one reference set"""
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(directory, "index.db"), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS docs ("
+            "doc INTEGER PRIMARY KEY, chunk_id TEXT NOT NULL, length INTEGER NOT NULL, "
+            "alive INTEGER NOT NULL DEFAULT 1, metadata TEXT NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS docs_chunk_id ON docs(chunk_id);"
+            "CREATE TABLE IF NOT EXISTS terms ("
+            "term TEXT PRIMARY KEY, last_doc INTEGER NOT NULL, segments INTEGER NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS postings ("
+            "term TEXT NOT NULL, segment INTEGER NOT NULL, data BLOB NOT NULL, PRIMARY KEY (term, segment)) WITHOUT ROWID;"
+        )
+        self._db.commit()
+        self._lengths = None
+        self._alive = None
+        self._alive_count = 0
+        self._avg_length = 0.0
+
+    def _load_stats(self):
+        if self._lengths is not None:
+            return
+        rows = self._db.execute("SELECT doc, length, alive FROM docs").fetchall()
+        size = rows[-1][0] + 1 if rows else 0
+        self._lengths = np.zeros(size, dtype=np.float32)
+        self._alive = np.zeros(size, dtype=bool)
+        if rows:
+            table = np.array(rows, dtype=np.int64)
+            self._lengths[table[:, 0]] = table[:, 1]
+            self._alive[table[:, 0]] = table[:, 2].astype(bool)
+        self._alive_count = int(self._alive.sum())
+        self._avg_length = max(float(self._lengths[self._alive].mean()), 1.0) if self._alive_count else 1.0
+
+    def add(self, vectors):
+        """Index upserted {'id', 'metadata'} dicts by their metadata text; re-added ids replace old ones"""
+        vectors = list({vector["id"]: vector for vector in vectors}.values())
+        with self._lock, self._db:
+            next_doc = self._db.execute("SELECT COALESCE(MAX(doc), -1) + 1 FROM docs").fetchone()[0]
+            ids = [vector["id"] for vector in vectors]
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                self._db.execute(
+                    f"UPDATE docs SET alive = 0 WHERE alive = 1 AND chunk_id IN ({', '.join('?' * len(chunk))})", chunk
+                )
+
+            postings = {}
+            docs = []
+            for doc, vector in enumerate(vectors, start=next_doc):
+                metadata = vector.get("metadata") or {}
+                tokens = tokenize(str(metadata.get("text", "")))
+                docs.append((doc, vector["id"], len(tokens), json.dumps(metadata)))
+                for term, tf in Counter(tokens).items():
+                    postings.setdefault(term, []).append((doc, tf))
+            self._db.executemany("INSERT INTO docs (doc, chunk_id, length, metadata) VALUES (?, ?, ?, ?)", docs)
+
+            terms = list(postings)
+            existing = {}
+            for start in range(0, len(terms), 500):
+                chunk = terms[start:start + 500]
+                for term, last_doc, segments in self._db.execute(
+                    f"SELECT term, last_doc, segments FROM terms WHERE term IN ({', '.join('?' * len(chunk))})", chunk
+                ):
+                    existing[term] = (last_doc, segments)
+
+            term_rows, segment_rows, compact = [], [], []
+            for term, entries in postings.items():
+                previous, segments = existing.get(term, (0, 0))
+                values = []
+                for doc, tf in entries:
+                    values.extend((doc - previous, tf))
+                    previous = doc
+                segment_rows.append((term, segments, encode_varints(values)))
+                term_rows.append((term, previous, segments + 1))
+                if segments + 1 >= COMPACT_SEGMENTS:
+                    compact.append(term)
+            self._db.executemany("INSERT OR REPLACE INTO terms (term, last_doc, segments) VALUES (?, ?, ?)", term_rows)
+            self._db.executemany("INSERT INTO postings (term, segment, data) VALUES (?, ?, ?)", segment_rows)
+            for term in compact:
+                self._compact(term)
+            self._lengths = None
+
+    def remove(self, chunk_ids):
+        """Drop chunks from the index (their postings are skipped from now on)"""
+        with self._lock, self._db:
+            for start in range(0, len(chunk_ids), 500):
+                chunk = chunk_ids[start:start + 500]
+                self._db.execute(
+                    f"UPDATE docs SET alive = 0 WHERE alive = 1 AND chunk_id IN ({', '.join('?' * len(chunk))})", chunk
+                )
+            self._lengths = None
+
+    def _compact(self, term):
+        """Merge a term's posting segments into one"""
+        data = b"".join(blob for (blob,) in self._db.execute(
+            "SELECT data FROM postings WHERE term = ? ORDER BY segment", (term,)
+        ))
+        self._db.execute("DELETE FROM postings WHERE term = ?", (term,))
+        self._db.execute("INSERT INTO postings (term, segment, data) VALUES (?, 0, ?)", (term, data))
+        self._db.execute("UPDATE terms SET segments = 1 WHERE term = ?", (term,))
+
+    def search(self, query, top_k=10):
+        """Top BM25 matches for a keyword query, best first"""
+        terms = sorted(set(tokenize(query)))
+        if not terms:
+            return []
+        with self._lock:
+            self._load_stats()
+            if not self._alive_count:
+                return []
+            segments = {}
+            for term, data in self._db.execute(
+                f"SELECT term, data FROM postings WHERE term IN ({', '.join('?' * len(terms))}) ORDER BY term, segment",
+                terms,
+            ):
+                segments.setdefault(term, []).append(data)
+
+            doc_parts, score_parts = [], []
+            for parts in segments.values():
+                pairs = decode_varints(b"".join(parts))
+                docs = np.cumsum(pairs[0::2])
+                tf = pairs[1::2].astype(np.float32)
+                live = self._alive[docs]
+                docs, tf = docs[live], tf[live]
+                if not len(docs):
+                    continue
+                idf = math.log(1 + (self._alive_count - len(docs) + 0.5) / (len(docs) + 0.5))
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self._lengths[docs] / self._avg_length)
+                doc_parts.append(docs)
+                score_parts.append(idf * tf * (BM25_K1 + 1) / (tf + norm))
+            if not doc_parts:
+                return []
+
+            docs, inverse = np.unique(np.concatenate(doc_parts), return_inverse=True)
+            scores = np.bincount(inverse, weights=np.concatenate(score_parts))
+            if len(scores) > top_k:
+                best = np.argpartition(-scores, top_k - 1)[:top_k]
+            else:
+                best = np.arange(len(scores))
+            best = best[np.argsort(-scores[best], kind="stable")]
+
+            top_docs = [int(doc) for doc in docs[best]]
+            found = {
+                doc: (chunk_id, metadata) for doc, chunk_id, metadata in self._db.execute(
+                    f"SELECT doc, chunk_id, metadata FROM docs WHERE doc IN ({', '.join('?' * len(top_docs))})", top_docs
+                )
+            }
+        return [Match(found[doc][0], float(score), json.loads(found[doc][1]))
+                for doc, score in zip(top_docs, scores[best])]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def _index_directory(ref_set_id):
+    return os.path.join(data_dir("lexical_index"), ref_set_id)
+
+def get_lexical_index(ref_set_id):
+    """Shared lexical index for a reference set (created on first use)"""
+    with _indexes_lock:
+        index = _indexes.get(ref_set_id)
+        if index is None:
+            index = _indexes[ref_set_id] = LexicalIndex(_index_directory(ref_set_id))
+        return index
+
+def drop_lexical_index(ref_set_id):
+    """Delete a reference set's lexical index"""
+    with _indexes_lock:
+        index = _indexes.pop(ref_set_id, None)
+        if index is not None:
+            index.close()
+        shutil.rmtree(_index_directory(ref_set_id), ignore_errors=True)
+
+@timed("lexical")
+def search_lexical(query, ref_set_ids, top_k=10):
+    """BM25 search across reference sets
+
+    Each set has its own index and so its own IDF statistics, so when several
+    sets are searched their scores are made comparable by dividing by each
+    set's best score for the query.
+    """
+    result_lists = [get_lexical_index(ref_set_id).search(query, top_k) for ref_set_id in ref_set_ids
+                    if os.path.exists(os.path.join(_index_directory(ref_set_id), "index.db"))]
+    result_lists = [results for results in result_lists if results]
+    if len(result_lists) == 1:
+        return result_lists[0]
+    results = [Match(match.id, match.score / results[0].score, match.metadata, match.values)
+               for results in result_lists for match in results]
+    return heapq.nlargest(top_k, results, key=lambda match: match.score)
+
+def reciprocal_rank_fusion(result_lists, top_k=10, k=RRF_K):
+    """Fuse ranked match lists: each match scores sum(1 / (k + rank)) over the lists it appears in"""
+    scores = {}
+    matches = {}
+    for results in result_lists:
+        for rank, match in enumerate(results, start=1):
+            scores[match.id] = scores.get(match.id, 0.0) + 1.0 / (k + rank)
+            matches.setdefault(match.id, match)
+    best = heapq.nlargest(top_k, scores, key=scores.get)
+    return [Match(id, scores[id], matches[id].metadata, matches[id].values) for id in best]
@@ -0,0 +1,116 @@
+from collections import defaultdict
+import numpy as np
+
+# Inverted index from metadata values to row-id bitmaps for the local vector
+# store. Bitmaps are Python ints (bit i set = row i), which are compact and
+# support fast &, | and ~ on whole sets at once. Filters on indexed fields are
+# resolved with set operations, so a query only touches its candidate rows.
+
+INDEXED_FIELDS = ("reference_set_id", "domain", "document_name", "content_type", "surah_number")
+
+def rows_to_bitmap(rows):
+    """Bitmap with the given row ids set"""
+    rows = np.asarray(rows, dtype=np.int64)
+    if not len(rows):
+        return 0
+    # Pack only the span the rows cover, then shift into place
+    low = int(rows.min())
+    bits = np.zeros(int(rows.max()) - low + 1, dtype=bool)
+    bits[rows - low] = True
+    return int.from_bytes(np.packbits(bits, bitorder="little").tobytes(), "little") << low
+
+def bitmap_to_rows(bitmap):
+    """Sorted row ids set in a bitmap"""
+    if not bitmap:
+        return np.empty(0, dtype=np.int64)
+    data = np.frombuffer(bitmap.to_bytes((bitmap.bit_length() + 7) // 8, "little"), dtype=np.uint8)
+    return np.flatnonzero(np.unpackbits(data, bitorder="little"))
+
+class MetadataIndex:
+    """Value -> bitmap index over a fixed set of metadata fields"""
+
+    def __init__(self, fields=INDEXED_FIELDS):
+        self.fields = fields
+        self.bitmaps = {field: {} for field in fields}
+        self.all_rows = 0
+        # Fields where some row has a non-scalar value can't be answered from the index
+        self.unindexable = set()
+
+    def _group(self, rows, metadatas):
+        groups = defaultdict(list)
+        for row, metadata in zip(rows, metadatas):
+            for field in self.fields:
+                value = metadata.get(field)
+                if value is None:
+                    continue
+                if isinstance(value, (str, int, float, bool)):
+                    groups[(field, value)].append(row)
+                else:
+                    self.unindexable.add(field)
+        return groups
+
+    def add(self, rows, metadatas):
+        """Index rows with their metadata"""
+        self.all_rows |= rows_to_bitmap(rows)
+        for (field, value), group in self._group(rows, metadatas).items():
+            values = self.bitmaps[field]
+            values[value] = values.get(value, 0) | rows_to_bitmap(group)
+
+    def remove(self, rows, metadatas):
+        """Unindex rows, given the metadata they were indexed with"""
+        self.all_rows &= ~rows_to_bitmap(rows)
+        for (field, value), group in self._group(rows, metadatas).items():
+            values = self.bitmaps[field]
+            remaining = values.get(value, 0) & ~rows_to_bitmap(group)
+            if remaining:
+                values[value] = remaining
+            else:
+                values.pop(value, None)
+
+    def _resolve_field(self, field, condition, matches_value):
+        values = self.bitmaps[field]
+        bitmap = 0
+        for value, rows in values.items():
+            if matches_value(value, condition):
+                bitmap |= rows
+        if matches_value(None, condition):
+            # Rows without the field match too (e.g. $ne, $nin, $exists: false)
+            present = 0
+            for rows in values.values():
+                present |= rows
+            bitmap |= self.all_rows & ~present
+        return bitmap
+
+    def resolve(self, filter, matches_value):
+        """Split a filter into (bitmap of candidate rows, residual filter or None)
+
+        A row matches the filter iff it is in the bitmap and matches the
+        residual filter. `matches_value(value, condition)` evaluates a field
+        condition against one scalar value.
+        """
+        bitmap = self.all_rows
+        residual = []
+        for key, condition in filter.items():
+            if key == "$and":
+                for sub in condition:
+                    sub_bitmap, sub_residual = self.resolve(sub, matches_value)
+                    bitmap &= sub_bitmap
+                    if sub_residual:
+                        residual.append(sub_residual)
+            elif key == "$or":
+                resolved = [self.resolve(sub, matches_value) for sub in condition]
+                if all(sub_residual is None for _, sub_residual in resolved):
+                    union = 0
+                    for sub_bitmap, _ in resolved:
+                        union |= sub_bitmap
+                    bitmap &= union
+                else:
+                    residual.append({key: condition})
+            elif key in self.bitmaps and key not in self.unindexable:
+                bitmap &= self._resolve_field(key, condition, matches_value)
+            else:
+                residual.append({key: condition})
+
+        if not residual:
+            return bitmap, None
+        return bitmap, residual[0] if len(residual) == 1 else {"$and": residual}
@@ -0,0 +1,184 @@
+import os
+import time
+import bisect
+import threading
+import contextvars
+from functools import wraps
+from contextlib import contextmanager
+
+# Timing spans and counters, exposed in the Prometheus text format at /metrics.
+# Wrap a stage in `with span("embed"):` (or decorate a function with
+# @timed("storage")) and its duration lands in the stage_duration_seconds
+# histogram. Requests that call start_request_timings() also collect the
+# milliseconds spent per stage, so chat and test search can report a
+# per-request breakdown.
+
+METRICS_ENABLED = os.getenv("METRICS", "1") != "0"  # "0" stops collecting the series served at /metrics
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+class Counter:
+    """Monotonic counter, one series per label combination"""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+class Histogram:
+    """Cumulative-bucket histogram of seconds, one series per label combination"""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ("+Inf",), series):
+                    cumulative += count
+                    labels = _format_labels(self.labelnames, key, [("le", bound)])
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {series[-1]}")
+                lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+_metrics = []
+
+def counter(name, documentation, labelnames=()):
+    _metrics.append(Counter(name, documentation, labelnames))
+    return _metrics[-1]
+
+def histogram(name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+    _metrics.append(Histogram(name, documentation, labelnames, buckets))
+    return _metrics[-1]
+
+STAGE_SECONDS = histogram("stage_duration_seconds", "Time spent in each stage of ingestion and request handling",
+                          ("stage",))
+STAGE_ERRORS = counter("stage_errors_total", "Stages that raised an exception", ("stage",))
+REQUEST_SECONDS = histogram("http_request_duration_seconds", "API request latency", ("method", "endpoint"))
+REQUESTS = counter("http_requests_total", "API requests served", ("method", "endpoint", "status"))
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    return "\n".join(line for metric in _metrics for line in metric.render()) + "\n"
+
+class RequestTimings:
+    """Milliseconds per stage for one request (stages that run more than once are summed)"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, ms):
+        with self._lock:
+            self._stages[stage] = self._stages.get(stage, 0.0) + ms
+
+    def breakdown(self):
+        with self._lock:
+            stages = {stage: round(ms, 2) for stage, ms in self._stages.items()}
+        stages["total"] = round((time.perf_counter() - self.started) * 1000, 2)
+        return stages
+
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+def start_request_timings():
+    """Start collecting stage timings for the current request (context)"""
+    timings = RequestTimings()
+    _request_timings.set(timings)
+    return timings
+
+def current_request_timings():
+    return _request_timings.get()
+
+def record(stage, seconds):
+    """Record a finished stage"""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.add(stage, seconds * 1000)
+
+@contextmanager
+def span(stage):
+    """Time the enclosed block as one run of a stage"""
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException as e:
+        if not isinstance(e, GeneratorExit):
+            STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        record(stage, time.perf_counter() - start)
+
+def timed(stage):
+    """Decorator: time every call of the function as a stage"""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def timed_iter(stage, iterable):
+    """Yield from an iterable, timing only the work of producing items (recorded once, when it is exhausted)"""
+    iterator = iter(iterable)
+    elapsed = 0.0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                elapsed += time.perf_counter() - start
+                return
+            except Exception:
+                STAGE_ERRORS.inc(stage=stage)
+                raise
+            elapsed += time.perf_counter() - start
+            yield item
+    finally:
+        record(stage, elapsed)
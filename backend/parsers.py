@@ -0,0 +1,467 @@
+import os
+import json
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+# Incremental JSON reading: walks a JSON document a token at a time so large
+# uploads (e.g. several Quran translations in one file) are never held in
+# memory whole. Only one record is decoded at a time.
+
+_WHITESPACE = " \t\n\r"
+_decoder = json.JSONDecoder()
+
+class JsonStreamReader:
+    """Pull-style reader over a JSON text file"""
+
+    def __init__(self, file, chunk_size=1 << 16):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self, size=None):
+        """Read the next chunk, dropping already-consumed text; False at end of file"""
+        if self.eof:
+            return False
+        data = self.file.read(max(self.chunk_size, size or 0))
+        if not data:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Return the next non-whitespace character without consuming it ('' at end)"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ""
+
+    def consume(self, char):
+        """Consume an expected structural character"""
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Expected {char!r} but found {found!r}")
+        self.pos += 1
+
+    def value(self):
+        """Decode the next complete JSON value"""
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # Most likely the value continues past the buffer; grow geometrically
+                if not self._fill(len(self.buffer) - self.pos):
+                    raise
+                continue
+            # A number cut off by the buffer edge decodes as a shorter number, so
+            # only trust it once the character after it is visible
+            truncated = end == len(self.buffer) or (
+                isinstance(value, (int, float)) and not isinstance(value, bool)
+                and self.buffer[end] not in _WHITESPACE + ",]}"
+            )
+            if truncated and self._fill():
+                continue
+            self.pos = end
+            return value
+
+    def iter_array(self):
+        """Step through an array; the caller must consume each element before resuming"""
+        self.consume("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield
+            if self.peek() == ",":
+                self.pos += 1
+                continue
+            self.consume("]")
+            return
+
+    def iter_object(self):
+        """Step through an object yielding keys; the caller must consume each value before resuming"""
+        self.consume("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.consume(":")
+            yield key
+            if self.peek() == ",":
+                self.pos += 1
+                continue
+            self.consume("}")
+            return
+
+SURAH_KEYS = ("Surah Number", "Surah Name English", "Surah Name Arabic")
+
+def ayah_record(ayah, surah_number, surah_name_english, surah_name_arabic):
+    """Build the page/entry dict for one ayah of a surah, or None if it has no text"""
+    text_parts = []
+    metadata = {
+        'content_type': 'verse',
+        'surah_number': surah_number,
+        'surah_name_english': surah_name_english,
+        'surah_name_arabic': surah_name_arabic,
+        'chapter': surah_number,  # For compatibility
+    }
+
+    # Extract verse number
+    if 'ayah' in ayah:
+        verse_number = int(ayah['ayah'])
+        metadata['verse_number'] = verse_number
+        metadata['ayah'] = verse_number
+
+    # Extract Arabic text
+    if 'arabic' in ayah:
+        metadata['arabic'] = ayah['arabic']
+        text_parts.append(f"Arabic: {ayah['arabic']}")
+
+    # Extract English translation
+    if 'Clear Quran English' in ayah:
+        metadata['english'] = ayah['Clear Quran English']
+        text_parts.append(f"English: {ayah['Clear Quran English']}")
+
+    # Create searchable text
+    searchable_text = ' | '.join(text_parts)
+    if not searchable_text.strip():
+        return None
+    return {
+        'page_num': f"{surah_number}:{ayah.get('ayah', 'unknown')}",
+        'text': searchable_text,
+        'metadata': metadata,
+        'raw_json': ayah
+    }
+
+def flat_object_record(obj, index):
+    """Build the page/entry dict for a regular flat object in a top-level array"""
+    text_parts = []
+    metadata = {}
+    for key, value in obj.items():
+        if isinstance(value, str) and len(value) > 5:
+            text_parts.append(f"{key}: {value}")
+            metadata[key] = value
+        elif isinstance(value, (int, float, bool)):
+            metadata[key] = value
+
+    searchable_text = ' | '.join(text_parts)
+    if not searchable_text.strip():
+        return None
+    return {
+        'page_num': index + 1,
+        'text': searchable_text,
+        'metadata': metadata,
+        'raw_json': obj
+    }
+
+def dict_document_record(json_data):
+    """Build a single page/entry dict from a top-level JSON object"""
+    def extract_from_dict(data, prefix=""):
+        text_parts = []
+        metadata = {}
+
+        for key, value in data.items():
+            full_key = f"{prefix}.{key}" if prefix else key
+
+            if isinstance(value, str) and len(value) > 5:
+                text_parts.append(f"{full_key}: {value}")
+                metadata[full_key] = value
+            elif isinstance(value, (int, float, bool)):
+                metadata[full_key] = value
+            elif isinstance(value, dict):
+                # Recursively handle nested objects
+                nested_text, nested_meta = extract_from_dict(value, full_key)
+                text_parts.extend(nested_text)
+                metadata.update(nested_meta)
+
+        return text_parts, metadata
+
+    text_parts, metadata = extract_from_dict(json_data)
+    if not text_parts:
+        return None
+    return {
+        'page_num': 1,
+        'text': ' | '.join(text_parts),
+        'metadata': metadata,
+        'raw_json': json_data
+    }
+
+def _surah_ayah_records(obj, ayahs, index):
+    surah_number = int(obj.get('Surah Number', index + 1))
+    surah_name_english = obj.get('Surah Name English', f'Surah {surah_number}')
+    surah_name_arabic = obj.get('Surah Name Arabic', '')
+    for ayah in ayahs:
+        if isinstance(ayah, dict):
+            record = ayah_record(ayah, surah_number, surah_name_english, surah_name_arabic)
+            if record:
+                yield record
+
+def _iter_array_element(reader, index):
+    """Yield records for one element of a top-level array, streaming nested ayahs"""
+    if reader.peek() != "{":
+        reader.value()  # Only objects carry records
+        return
+
+    obj = {}
+    buffered_ayahs = None
+    streamed = False
+    for key in reader.iter_object():
+        if key == "ayahs" and reader.peek() == "[":
+            if all(name in obj for name in SURAH_KEYS):
+                # Surah metadata already known: stream ayahs one at a time
+                streamed = True
+                surah_number = int(obj['Surah Number'])
+                for _ in reader.iter_array():
+                    ayah = reader.value()
+                    if isinstance(ayah, dict):
+                        record = ayah_record(ayah, surah_number, obj['Surah Name English'], obj['Surah Name Arabic'])
+                        if record:
+                            yield record
+            else:
+                # Metadata comes after the ayahs, so hold this surah's ayahs until the object ends
+                buffered_ayahs = reader.value()
+            obj["ayahs"] = []
+        else:
+            obj[key] = reader.value()
+
+    if streamed:
+        return
+    if buffered_ayahs is not None:
+        yield from _surah_ayah_records(obj, buffered_ayahs, index)
+    else:
+        record = flat_object_record(obj, index)
+        if record:
+            yield record
+
+def iter_json_file(file_path):
+    """Yield page/entry dicts from a JSON file without loading it whole
+
+    Top-level arrays are read one element at a time, and Quran surah objects
+    have their `ayahs` arrays streamed verse by verse. A top-level object is
+    treated as a single entry. A malformed or truncated file raises
+    ValueError once the records before the error have been yielded.
+    """
+    try:
+        with open(file_path, 'r', encoding='utf-8') as file:
+            reader = JsonStreamReader(file)
+            first = reader.peek()
+            if first == "[":
+                for index, _ in enumerate(reader.iter_array()):
+                    yield from _iter_array_element(reader, index)
+            elif first == "{":
+                record = dict_document_record(reader.value())
+                if record:
+                    yield record
+
+    except Exception as e:
+        raise ValueError(f"Error processing JSON file: {e}") from e
+
+def jsonl_record(json_obj, line_num):
+    """Build the page/entry dict for one parsed JSONL line, or None if it has no text"""
+    # Create structured content that preserves metadata
+    structured_content = {
+        'line_number': line_num,
+        'raw_data': json_obj,
+        'searchable_text': '',
+        'metadata': {}
+    }
+
+    # Extract searchable text while preserving structure
+    text_parts = []
+
+    # Handle different content structures
+    if 'verse' in json_obj:
+        # Quran/religious text structure
+        structured_content['metadata']['content_type'] = 'verse'
+        if 'chapter' in json_obj:
+            structured_content['metadata']['chapter'] = json_obj['chapter']
+        if 'verse_number' in json_obj:
+            structured_content['metadata']['verse_number'] = json_obj['verse_number']
+
+        # Add verse content
+        if isinstance(json_obj['verse'], str):
+            text_parts.append(f"Verse: {json_obj['verse']}")
+        elif isinstance(json_obj['verse'], dict):
+            for lang, text in json_obj['verse'].items():
+                text_parts.append(f"{lang}: {text}")
+                structured_content['metadata'][f'verse_{lang}'] = text
+
+    # Handle Quran verse structure with ayah, arabic, and English translation
+    if 'ayah' in json_obj:
+        structured_content['metadata']['content_type'] = 'verse'
+        structured_content['metadata']['verse_number'] = int(json_obj['ayah'])
+
+        # Store Arabic text
+        if 'arabic' in json_obj:
+            structured_content['metadata']['arabic'] = json_obj['arabic']
+            text_parts.append(f"Arabic: {json_obj['arabic']}")
+
+        # Store English translation from "Clear Quran English"
+        if 'Clear Quran English' in json_obj:
+            structured_content['metadata']['english'] = json_obj['Clear Quran English']
+            text_parts.append(f"English: {json_obj['Clear Quran English']}")
+
+    # Handle translations
+    for lang_field in ['arabic', 'english', 'translation']:
+        if lang_field in json_obj:
+            if isinstance(json_obj[lang_field], str):
+                text_parts.append(f"{lang_field}: {json_obj[lang_field]}")
+                structured_content['metadata'][lang_field] = json_obj[lang_field]
+
+    # Handle general text fields
+    for field in ['text', 'content', 'title', 'description', 'passage']:
+        if field in json_obj and isinstance(json_obj[field], str):
+            text_parts.append(f"{field}: {json_obj[field]}")
+            structured_content['metadata'][field] = json_obj[field]
+
+    # Preserve all other metadata
+    for key, value in json_obj.items():
+        if key not in ['verse', 'arabic', 'english', 'translation', 'text', 'content', 'title', 'description', 'passage']:
+            if isinstance(value, (str, int, float, bool)):
+                structured_content['metadata'][key] = value
+
+    # Combine all text for searching
+    structured_content['searchable_text'] = ' | '.join(text_parts)
+
+    # Create a "page" for each JSON object to maintain granularity
+    if not structured_content['searchable_text'].strip():
+        return None
+    return {
+        'page_num': line_num,
+        'text': structured_content['searchable_text'],
+        'metadata': structured_content['metadata'],
+        'raw_json': json_obj
+    }
+
+def iter_jsonl_file(file_path):
+    """Yield one page/entry per JSONL line, preserving structure with metadata
+
+    Invalid lines are skipped; an error reading the file raises ValueError.
+    """
+    try:
+        with open(file_path, 'r', encoding='utf-8') as file:
+            line_num = 0
+
+            for line in file:
+                line = line.strip()
+                if not line:
+                    continue
+
+                line_num += 1
+                try:
+                    record = jsonl_record(json.loads(line), line_num)
+                    if record:
+                        yield record
+
+                except json.JSONDecodeError as e:
+                    print(f"Invalid JSON on line {line_num}: {e}")
+                    continue
+
+    except Exception as e:
+        raise ValueError(f"Error processing JSONL file: {e}") from e
+
+# Parallel JSONL parsing: the file is split into newline-aligned byte ranges
+# that are parsed in a process pool and merged back in line order.
+JSONL_PARSE_WORKERS = int(os.getenv("JSONL_PARSE_WORKERS", str(os.cpu_count() or 1)))
+JSONL_PARALLEL_MIN_BYTES = int(os.getenv("JSONL_PARALLEL_MIN_BYTES", str(32 * 2**20)))
+JSONL_RANGE_BYTES = 8 * 2**20
+
+def jsonl_byte_ranges(file_path, range_bytes=JSONL_RANGE_BYTES):
+    """Split a file into (start, end) byte ranges whose boundaries fall just after a newline"""
+    size = os.path.getsize(file_path)
+    ranges = []
+    with open(file_path, 'rb') as file:
+        start = 0
+        while start < size:
+            end = min(start + range_bytes, size)
+            if end < size:
+                file.seek(end)
+                file.readline()  # Move the boundary past the end of the current line
+                end = file.tell()
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+def parse_jsonl_range(file_path, start, end):
+    """Parse the lines in [start, end) of a JSONL file
+
+    Returns (non-empty line count, records, messages, failed). Line numbers in
+    records and messages are relative to the range; `failed` is set when an
+    unexpected error stopped parsing (as it stops the serial parser).
+    """
+    records = []
+    messages = []
+    line_num = 0
+    try:
+        with open(file_path, 'rb') as file:
+            file.seek(start)
+            while file.tell() < end:
+                line = file.readline().decode('utf-8').strip()
+                if not line:
+                    continue
+
+                line_num += 1
+                try:
+                    record = jsonl_record(json.loads(line), line_num)
+                    if record:
+                        records.append(record)
+                except json.JSONDecodeError as e:
+                    messages.append((line_num, str(e)))
+    except Exception as e:
+        return line_num, records, messages, str(e)
+    return line_num, records, messages, None
+
+def iter_jsonl_file_parallel(file_path, workers=None):
+    """Parse a JSONL file on several cores, yielding the same records (and raising the same errors) as iter_jsonl_file
+
+    Workers are spawned rather than forked: uploads are parsed on a background
+    thread of a multithreaded server, and a forked child could inherit locks
+    held by other threads.
+    """
+    workers = workers or JSONL_PARSE_WORKERS
+    line_offset = 0
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            # Keep a bounded number of ranges in flight so memory stays flat
+            pending = deque()
+            ranges = iter(jsonl_byte_ranges(file_path))
+            for start, end in ranges:
+                pending.append(executor.submit(parse_jsonl_range, file_path, start, end))
+                if len(pending) >= workers * 2:
+                    break
+
+            while pending:
+                line_count, records, messages, failure = pending.popleft().result()
+                next_range = next(ranges, None)
+                if next_range:
+                    pending.append(executor.submit(parse_jsonl_range, file_path, *next_range))
+
+                for line_num, message in messages:
+                    print(f"Invalid JSON on line {line_offset + line_num}: {message}")
+                for record in records:
+                    record['page_num'] += line_offset
+                    yield record
+                if failure:
+                    for future in pending:
+                        future.cancel()
+                    raise ValueError(failure)
+                line_offset += line_count
+
+    except Exception as e:
+        # A range that failed (or a worker that died) would leave a gap in the records
+        raise ValueError(f"Error processing JSONL file: {e}") from e
+
+def iter_jsonl_file_auto(file_path):
+    """Parse large JSONL files in parallel and small ones serially"""
+    if JSONL_PARSE_WORKERS > 1 and os.path.getsize(file_path) >= JSONL_PARALLEL_MIN_BYTES:
+        return iter_jsonl_file_parallel(file_path)
+    return iter_jsonl_file(file_path)
@@ -0,0 +1,123 @@
+import time
+import queue
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Streaming pipeline helpers: each stage is a generator function that consumes
+# an iterator and yields results. Stages run in their own threads connected by
+# bounded queues, so they overlap and only a bounded number of items is ever
+# held in memory.
+
+_DONE = object()
+
+def _put(q, item, stop):
+    """Put into a bounded queue, giving up if the pipeline is being torn down"""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def _drain(q, stop):
+    """Iterate over items from a queue until the upstream stage finishes"""
+    while True:
+        try:
+            item = q.get(timeout=0.1)
+        except queue.Empty:
+            if stop.is_set():
+                return
+            continue
+        if item is _DONE:
+            return
+        yield item
+
+def _pump(iterable, out_queue, stop, errors):
+    try:
+        for item in iterable:
+            if not _put(out_queue, item, stop):
+                return
+    except Exception as e:
+        errors.append(e)
+        stop.set()
+    finally:
+        _put(out_queue, _DONE, stop)
+
+def run_pipeline(source, stages, queue_size=8):
+    """Run source -> stage -> stage ... concurrently and yield the last stage's output
+
+    The first exception raised by any stage stops the whole pipeline and is
+    re-raised to the caller.
+    """
+    stop = threading.Event()
+    errors = []
+    threads = []
+
+    upstream = source
+    for stage in stages:
+        q = queue.Queue(maxsize=queue_size)
+        thread = threading.Thread(target=_pump, args=(upstream, q, stop, errors), daemon=True)
+        thread.start()
+        threads.append(thread)
+        upstream = stage(_drain(q, stop))
+
+    try:
+        for item in upstream:
+            yield item
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+    if errors:
+        raise errors[0]
+
+def batched(iterable, size):
+    """Group an iterable into lists of at most `size` items"""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def map_ordered(fn, iterable, window):
+    """Apply fn to items with up to `window` calls in flight, yielding (item, result) in input order"""
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=window) as executor:
+        for item in iterable:
+            pending.append((item, executor.submit(fn, item)))
+            if len(pending) >= window:
+                item, future = pending.popleft()
+                yield item, future.result()
+        while pending:
+            item, future = pending.popleft()
+            yield item, future.result()
+
+def call_with_retry(fn, *args, attempts=3, base_delay=1.0, **kwargs):
+    """Call fn, retrying with exponential backoff; re-raises the last error"""
+    for attempt in range(attempts):
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            if attempt == attempts - 1:
+                raise
+            delay = base_delay * 2 ** attempt
+            print(f"  Retrying after error ({e}) in {delay}s...")
+            time.sleep(delay)
+
+async def async_call_with_retry(fn, *args, attempts=3, base_delay=1.0, **kwargs):
+    """Await fn(...), retrying with exponential backoff without blocking the event loop; re-raises the last error"""
+    for attempt in range(attempts):
+        try:
+            return await fn(*args, **kwargs)
+        except Exception as e:
+            if attempt == attempts - 1:
+                raise
+            delay = base_delay * 2 ** attempt
+            print(f"  Retrying after error ({e}) in {delay}s...")
+            await asyncio.sleep(delay)
@@ -0,0 +1,234 @@
+import os
+import re
+import json
+import sqlite3
+import threading
+import unicodedata
+from settings import data_dir
+
+# Direct surah:ayah lookup for Quran reference sets. Ingestion records every
+# chunk that carries a surah and verse number; queries that are plain
+# citations ("2:255", "Al-Baqarah 255", "Surah Yasin 1-5") are answered from
+# this index instead of embedding the query and searching the vector store.
+# Inside longer prose a number only counts as a citation if the query also
+# says surah, verse or Quran, so "meeting at 10:30" is still searched.
+
+MAX_CITATION_VERSES = 20
+
+SURAH_NAMES = (
+    "Al-Fatihah", "Al-Baqarah", "Ali 'Imran", "An-Nisa", "Al-Ma'idah", "Al-An'am", "Al-A'raf", "Al-Anfal",
+    "At-Tawbah", "Yunus", "Hud", "Yusuf", "Ar-Ra'd", "Ibrahim", "Al-Hijr", "An-Nahl", "Al-Isra", "Al-Kahf",
+    "Maryam", "Taha", "Al-Anbya", "Al-Hajj", "Al-Mu'minun", "An-Nur", "Al-Furqan", "Ash-Shu'ara", "An-Naml",
+    "Al-Qasas", "Al-'Ankabut", "Ar-Rum", "Luqman", "As-Sajdah", "Al-Ahzab", "Saba", "Fatir", "Ya-Sin",
+    "As-Saffat", "Sad", "Az-Zumar", "Ghafir", "Fussilat", "Ash-Shuraa", "Az-Zukhruf", "Ad-Dukhan",
+    "Al-Jathiyah", "Al-Ahqaf", "Muhammad", "Al-Fath", "Al-Hujurat", "Qaf", "Adh-Dhariyat", "At-Tur",
+    "An-Najm", "Al-Qamar", "Ar-Rahman", "Al-Waqi'ah", "Al-Hadid", "Al-Mujadila", "Al-Hashr", "Al-Mumtahanah",
+    "As-Saf", "Al-Jumu'ah", "Al-Munafiqun", "At-Taghabun", "At-Talaq", "At-Tahrim", "Al-Mulk", "Al-Qalam",
+    "Al-Haqqah", "Al-Ma'arij", "Nuh", "Al-Jinn", "Al-Muzzammil", "Al-Muddaththir", "Al-Qiyamah", "Al-Insan",
+    "Al-Mursalat", "An-Naba", "An-Nazi'at", "'Abasa", "At-Takwir", "Al-Infitar", "Al-Mutaffifin",
+    "Al-Inshiqaq", "Al-Buruj", "At-Tariq", "Al-A'la", "Al-Ghashiyah", "Al-Fajr", "Al-Balad", "Ash-Shams",
+    "Al-Layl", "Ad-Duhaa", "Ash-Sharh", "At-Tin", "Al-'Alaq", "Al-Qadr", "Al-Bayyinah", "Az-Zalzalah",
+    "Al-'Adiyat", "Al-Qari'ah", "At-Takathur", "Al-'Asr", "Al-Humazah", "Al-Fil", "Quraysh", "Al-Ma'un",
+    "Al-Kawthar", "Al-Kafirun", "An-Nasr", "Al-Masad", "Al-Ikhlas", "Al-Falaq", "An-Nas",
+)
+
+# Common alternative spellings not covered by normalize_surah_name()
+SURAH_ALIASES = {
+    "Al Imran": 3, "Aal-e-Imran": 3, "Al-Tawba": 9, "Bani Isra'il": 17, "Yaseen": 36, "Ya Seen": 36,
+    "Ha-Mim Sajdah": 41, "Al-Mumin": 40, "Al-Ala": 87, "Al-Lahab": 111, "Tabbat": 111,
+}
+
+_ARTICLES = {"al", "an", "ar", "as", "at", "ash", "az", "ad", "adh", "ath", "the"}
+_SURAH_WORDS = {"surah", "sura", "surat", "suran"}
+_VERSE_WORDS = {"verse", "verses", "ayah", "ayat", "aya", "ayahs"}
+_QURAN_WORDS = {"quran", "qur'an", "qur’an", "koran"} | _SURAH_WORDS | _VERSE_WORDS
+_WORD = re.compile(r"[^\W\d_][\w'’`]*(?:-[^\W\d_][\w'’`]*)*")
+_NUMERIC_CITATION = re.compile(r"(?<![\w:])(\d{1,3})\s*:\s*(\d{1,3})(?:\s*[-–]\s*(\d{1,3}))?(?![\w:])")
+_SPELLED_CITATION = re.compile(
+    r"\b(?:surah|sura|surat|chapter)\s+(\d{1,3})\s*,?\s*(?:verse|verses|ayah|ayat|aya)\s+(\d{1,3})(?:\s*[-–]\s*(\d{1,3}))?(?![\w:])",
+    re.IGNORECASE,
+)
+_NUMBER = re.compile(r"(?<![\w:])(\d{1,3})(?:\s*[-–]\s*(\d{1,3}))?(?![\w:])")
+
+def normalize_surah_name(name):
+    """Spelling-insensitive key for a surah name ("Al-Baqarah", "al baqara" -> "baqara")"""
+    name = unicodedata.normalize("NFKD", name)
+    name = "".join(ch for ch in name if not unicodedata.combining(ch)).lower()
+    words = [word for word in re.split(r"[\s\-]+", name) if word]
+    if len(words) > 1 and words[0] in _ARTICLES:
+        words = words[1:]
+    key = re.sub(r"[\W_]", "", "".join(words))
+    key = re.sub(r"(.)\1+", r"\1", key)  # doubled letters: Muzzammil / Muzammil
+    return key[:-1] if key.endswith("ah") or key.endswith("ih") else key
+
+def _verse_range(surah, start, end):
+    surah, start = int(surah), int(start)
+    end = int(end) if end else start
+    if not 1 <= surah <= 114 or start < 1 or end < start:
+        return None
+    return surah, start, min(end, start + MAX_CITATION_VERSES - 1)
+
+def _only_citations(query, spans):
+    """Whether the query is nothing but the (start, end) spans, joined by "and" or punctuation"""
+    rest, position = [], 0
+    for start, end in sorted(spans):
+        rest.append(query[position:start])
+        position = max(position, end)
+    rest.append(query[position:])
+    return all(word.lower() == "and" for word in _WORD.findall(" ".join(rest)))
+
+def parse_citations(query, names):
+    """Find verse citations in a query as (surah, first verse, last verse) tuples
+
+    `names` maps normalize_surah_name() keys to surah numbers. Citations are
+    only returned if they make up the whole query or the query mentions a
+    surah, verse or the Quran.
+    """
+    marked = any(word.lower() in _QURAN_WORDS for word in _WORD.findall(query))
+    citations, spans = [], []
+    for pattern in (_NUMERIC_CITATION, _SPELLED_CITATION):
+        for match in pattern.finditer(query):
+            citation = _verse_range(*match.groups())
+            if citation:
+                citations.append(citation)
+                spans.append(match.span())
+    if citations and (marked or _only_citations(query, spans)):
+        return citations
+
+    citations, spans = [], []
+    for match in _NUMBER.finditer(query):
+        words = list(_WORD.finditer(query[:match.start()]))[-5:]
+        if words and words[-1].group().lower() in _VERSE_WORDS:
+            words = words[:-1]
+        for size in (3, 2, 1):
+            if len(words) < size:
+                continue
+            candidate = [word.group() for word in words[-size:]]
+            preceded_by_surah = len(words) > size and words[-size - 1].group().lower() in _SURAH_WORDS
+            # A bare lowercase English word ("sad 5") is too ambiguous to treat as a surah name
+            if not (preceded_by_surah or "-" in candidate[0] or not candidate[0].isascii() or candidate[0][0].isupper()
+                    or candidate[0].lower() in _ARTICLES):
+                continue
+            surah = names.get(normalize_surah_name(" ".join(candidate)))
+            if surah:
+                citation = _verse_range(surah, *match.groups())
+                if citation:
+                    citations.append(citation)
+                    spans.append((words[-size].start(), match.end()))
+                break
+    if citations and (marked or _only_citations(query, spans)):
+        return citations
+    return []
+
+def verse_key(metadata):
+    """(surah, verse) for chunk metadata, or None if it isn't a verse"""
+    surah = metadata.get("surah_number", metadata.get("chapter"))
+    verse = metadata.get("verse_number", metadata.get("ayah"))
+    try:
+        return int(surah), int(verse)
+    except (TypeError, ValueError):
+        return None
+
+class ReferenceIndex:
+    """SQLite index of reference set -> (surah, verse) -> chunks"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._names_lock = threading.Lock()
+        self._names = None
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(
+                "CREATE TABLE IF NOT EXISTS verses ("
+                "surah INTEGER NOT NULL, verse INTEGER NOT NULL, reference_set_id TEXT NOT NULL, "
+                "chunk_id TEXT NOT NULL, chunk_index INTEGER NOT NULL DEFAULT 0, metadata TEXT NOT NULL, "
+                "PRIMARY KEY (surah, verse, reference_set_id, chunk_id));"
+                "CREATE INDEX IF NOT EXISTS verses_reference_set ON verses(reference_set_id);"
+                "CREATE TABLE IF NOT EXISTS surah_names (name TEXT PRIMARY KEY, surah INTEGER NOT NULL);"
+            )
+            self._local.conn = conn
+        return conn
+
+    def names(self):
+        """Surah name key -> number, from the built-in table plus names seen at ingest"""
+        with self._names_lock:
+            if self._names is None:
+                names = {normalize_surah_name(name): number for name, number in SURAH_ALIASES.items()}
+                names.update((normalize_surah_name(name), number) for number, name in enumerate(SURAH_NAMES, start=1))
+                names.update(self._connection().execute("SELECT name, surah FROM surah_names"))
+                self._names = names
+            return self._names
+
+    def add(self, ref_set_id, vectors):
+        """Index the verse chunks among upserted {'id', 'metadata'} dicts"""
+        rows = []
+        names = {}
+        for vector in vectors:
+            metadata = vector.get("metadata") or {}
+            key = verse_key(metadata)
+            if key is None:
+                continue
+            rows.append((key[0], key[1], ref_set_id, vector["id"], int(metadata.get("chunk_index", 0) or 0),
+                         json.dumps(metadata)))
+            for field in ("surah_name_english", "surah_name_arabic"):
+                name = metadata.get(field)
+                if isinstance(name, str) and name.strip():
+                    names[normalize_surah_name(name)] = key[0]
+        if not rows:
+            return 0
+
+        conn = self._connection()
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO verses VALUES (?, ?, ?, ?, ?, ?)", rows)
+            conn.executemany("INSERT OR IGNORE INTO surah_names VALUES (?, ?)", names.items())
+        with self._names_lock:
+            if self._names is not None:
+                for name, surah in names.items():
+                    self._names.setdefault(name, surah)
+        return len(rows)
+
+    def lookup(self, citations, ref_set_ids=None):
+        """Chunks for the cited verses as (chunk id, metadata) pairs, in citation order"""
+        conn = self._connection()
+        results = []
+        for surah, first, last in citations:
+            sql = "SELECT chunk_id, metadata FROM verses WHERE surah = ? AND verse BETWEEN ? AND ?"
+            params = [surah, first, last]
+            if ref_set_ids:
+                sql += f" AND reference_set_id IN ({', '.join('?' * len(ref_set_ids))})"
+                params.extend(ref_set_ids)
+            sql += " ORDER BY verse, reference_set_id, chunk_index"
+            results.extend((chunk_id, json.loads(metadata)) for chunk_id, metadata in conn.execute(sql, params))
+        return results
+
+    def remove(self, ref_set_id, chunk_ids):
+        """Drop chunks of a reference set from the index"""
+        conn = self._connection()
+        with conn:
+            for start in range(0, len(chunk_ids), 500):
+                chunk = chunk_ids[start:start + 500]
+                conn.execute(
+                    f"DELETE FROM verses WHERE reference_set_id = ? AND chunk_id IN ({', '.join('?' * len(chunk))})",
+                    [ref_set_id, *chunk],
+                )
+
+    def delete_reference_set(self, ref_set_id):
+        conn = self._connection()
+        with conn:
+            conn.execute("DELETE FROM verses WHERE reference_set_id = ?", (ref_set_id,))
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_reference_index():
+    """Shared surah:ayah reference index"""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = ReferenceIndex(os.path.join(data_dir("reference_index"), "index.db"))
+        return _index
@@ -0,0 +1,67 @@
+import os
+import numpy as np
+
+# Maximal marginal relevance re-ranking. Retrieval fetches a wider candidate
+# pool (with vectors), and MMR picks a top set that balances relevance against
+# similarity to what has already been picked, so overlapping chunks and
+# repeated translations don't crowd out other sources.
+
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.5"))
+MMR_POOL_SIZE = int(os.getenv("MMR_POOL_SIZE", "40"))
+
+def mmr_select(relevance, vectors, k, lambda_=MMR_LAMBDA):
+    """Indices of k items chosen by maximal marginal relevance, in pick order
+
+    `relevance` is one score per candidate; `vectors` holds one row per
+    candidate (all-zero rows for candidates without a vector, which are then
+    never penalized as redundant).
+    """
+    relevance = np.asarray(relevance, dtype=np.float32)
+    n = len(relevance)
+    k = min(k, n)
+    if k <= 0:
+        return []
+
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    unit = np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+    # Only the similarity rows of picked items are needed: k matrix-vector
+    # products instead of the full n x n similarity matrix
+    selected = [int(np.argmax(relevance))]
+    available = np.ones(n, dtype=bool)
+    available[selected[0]] = False
+    # Highest similarity of each candidate to anything selected so far
+    redundancy = unit @ unit[selected[0]]
+    for _ in range(k - 1):
+        scores = lambda_ * relevance - (1 - lambda_) * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(redundancy, unit @ unit[best], out=redundancy)
+    return selected
+
+def diversify_matches(matches, k, lambda_=MMR_LAMBDA):
+    """Re-rank matches with MMR, using their scores as relevance and their values as vectors
+
+    Returns at most k matches with their vector values dropped.
+    """
+    if not matches:
+        return []
+    dimension = next((len(match.values) for match in matches if match.values is not None), 0)
+    if not dimension or len(matches) <= 1:
+        picked = matches[:k]
+    else:
+        scores = np.array([match.score for match in matches], dtype=np.float32)
+        # Scale relevance to [0, 1] so it is comparable with cosine similarity whatever the score type
+        top = scores.max()
+        relevance = scores / top if top > 0 else scores
+        vectors = np.zeros((len(matches), dimension), dtype=np.float32)
+        for row, match in enumerate(matches):
+            if match.values is not None and len(match.values) == dimension:
+                vectors[row] = match.values
+        picked = [matches[i] for i in mmr_select(relevance, vectors, k, lambda_)]
+    for match in picked:
+        match.values = None
+    return picked
@@ -0,0 +1,98 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from embedding_cache import normalize_text
+
+# In-memory cache of retrieval results (query -> matches). Every reference set
+# has a version counter that is bumped whenever its vectors change; entries are
+# keyed on the versions they were computed against, so a bump makes older
+# entries unreachable and they age out through TTL/LRU eviction.
+
+RETRIEVAL_CACHE_ENABLED = os.getenv("RETRIEVAL_CACHE", "1") != "0"
+RETRIEVAL_CACHE_TTL = float(os.getenv("RETRIEVAL_CACHE_TTL", "300"))
+RETRIEVAL_CACHE_MAX_ENTRIES = int(os.getenv("RETRIEVAL_CACHE_MAX_ENTRIES", "1024"))
+
+# Version slot for searches across all reference sets; bumped on every change
+ALL_REFERENCE_SETS = "*"
+
+class RetrievalCache:
+    """TTL + LRU cache of search results, invalidated per reference set"""
+
+    def __init__(self, ttl=RETRIEVAL_CACHE_TTL, max_entries=RETRIEVAL_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def bump(self, ref_set_id):
+        """Invalidate cached results that cover a reference set"""
+        with self._lock:
+            for key in (ref_set_id, ALL_REFERENCE_SETS):
+                self._versions[key] = self._versions.get(key, 0) + 1
+
+    def key(self, query, ref_set_ids, **options):
+        """Cache key for a search (query, scope and search options) against the current reference set versions
+
+        Take the key before searching and store the result under it, so a
+        result computed while a reference set changed is never served as fresh.
+        """
+        scope = tuple(sorted(set(ref_set_ids))) if ref_set_ids else (ALL_REFERENCE_SETS,)
+        with self._lock:
+            versions = tuple(self._versions.get(ref_set_id, 0) for ref_set_id in scope)
+        return (normalize_text(query), scope, versions, tuple(sorted(options.items())))
+
+    def get(self, key):
+        """Cached result for a key, or None"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < now:
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, result):
+        """Cache a search result"""
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "entries": len(self._entries),
+            }
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_retrieval_cache():
+    """Shared retrieval cache, or None when disabled"""
+    global _cache
+    if not RETRIEVAL_CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = RetrievalCache()
+        return _cache
@@ -0,0 +1,168 @@
+import os
+import time
+import threading
+from settings import data_dir
+
+# External service clients, created on first use instead of at import so the
+# API starts serving (e.g. /api/hello) without waiting on Supabase, Pinecone,
+# the OpenAI client library or Docling. SERVICE_WARM_UP=1 initializes them in
+# a background thread at startup; /api/ready reports progress.
+
+SERVICE_WARM_UP = os.getenv("SERVICE_WARM_UP", "0") != "0"
+PINECONE_INDEX_NAME = "research-assistant"
+
+_instances = {}
+_init_ms = {}
+_errors = {}
+_locks = {}
+_locks_lock = threading.Lock()
+
+def _lazy(name, factory):
+    """The named service, created by factory() on first call (once, even under concurrent callers)"""
+    if name in _instances:
+        return _instances[name]
+    with _locks_lock:
+        lock = _locks.setdefault(name, threading.Lock())
+    with lock:
+        if name not in _instances:
+            start = time.perf_counter()
+            try:
+                _instances[name] = factory()
+            except Exception as e:
+                _errors[name] = str(e)
+                raise
+            _errors.pop(name, None)
+            _init_ms[name] = (time.perf_counter() - start) * 1000
+        return _instances[name]
+
+def _create_openai():
+    from completions import COMPLETION_BACKEND, StubOpenAI
+    if COMPLETION_BACKEND == "stub":
+        return StubOpenAI()
+    import openai
+    openai.api_key = os.getenv("OPENAI_API_KEY")
+    return openai
+
+def get_openai():
+    """The openai module, configured with OPENAI_API_KEY (or the stand-in when COMPLETION_BACKEND=stub)"""
+    return _lazy("openai", _create_openai)
+
+def _create_supabase():
+    from supabase import create_client
+    return create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY"))
+
+def get_supabase():
+    """Supabase client (used for auth)"""
+    return _lazy("supabase", _create_supabase)
+
+def _create_pinecone_index():
+    pinecone_api_key = os.getenv("PINECONE_API_KEY")
+    if not pinecone_api_key:
+        return None
+    from pinecone import Pinecone
+    from embeddings import EMBEDDING_DIMENSION
+    pinecone_client = Pinecone(api_key=pinecone_api_key)
+    try:
+        # Try to get existing index
+        return pinecone_client.Index(PINECONE_INDEX_NAME)
+    except Exception:
+        # Create index if it doesn't exist
+        try:
+            pinecone_client.create_index(
+                name=PINECONE_INDEX_NAME,
+                dimension=EMBEDDING_DIMENSION,
+                metric="cosine",
+                spec={
+                    "serverless": {
+                        "cloud": "aws",
+                        "region": "us-east-1"
+                    }
+                }
+            )
+            return pinecone_client.Index(PINECONE_INDEX_NAME)
+        except Exception as e:
+            print(f"Error creating Pinecone index: {e}")
+            return None
+
+def get_pinecone_index():
+    """Pinecone index, or None if Pinecone isn't configured or reachable"""
+    return _lazy("pinecone", _create_pinecone_index)
+
+def _create_vector_store():
+    from embeddings import EMBEDDING_DIMENSION
+    from vector_store import PineconeVectorStore, LocalVectorStore, MemoryVectorStore
+    # Pinecone when configured, otherwise the local in-process store
+    # (VECTOR_BACKEND=local forces the local store even if Pinecone is configured,
+    # VECTOR_BACKEND=memory keeps vectors in memory only, for benchmarks).
+    # Read here rather than at import so values from .env apply.
+    backend = os.getenv("VECTOR_BACKEND", "pinecone" if os.getenv("PINECONE_API_KEY") else "local")
+    index = get_pinecone_index() if backend == "pinecone" else None
+    if backend == "memory":
+        vector_store = MemoryVectorStore()
+    elif index:
+        vector_store = PineconeVectorStore(index)
+    else:
+        vector_store = LocalVectorStore(data_dir("vectors"), EMBEDDING_DIMENSION)
+    print(f"Using {type(vector_store).__name__}")
+    return vector_store
+
+def get_vector_store():
+    """The vector store backend (see VECTOR_BACKEND)"""
+    return _lazy("vector_store", _create_vector_store)
+
+def _create_converter():
+    from conversion import warm_up
+    warm_up()
+    return True
+
+def _create_tokenizer():
+    from context_packer import count_tokens
+    count_tokens("warm up")
+    return True
+
+# Initialized in this order by warm_up(); the vector store first since every search and upload needs it
+WARM_UP_SERVICES = (
+    ("pinecone", get_pinecone_index),
+    ("vector_store", get_vector_store),
+    ("openai", get_openai),
+    ("supabase", get_supabase),
+    ("tokenizer", lambda: _lazy("tokenizer", _create_tokenizer)),
+    ("converter", lambda: _lazy("converter", _create_converter)),
+)
+
+_warm_up_thread = None
+_warm_up_done = threading.Event()
+
+def warm_up():
+    """Initialize every service now; failures are recorded, not raised"""
+    try:
+        for name, accessor in WARM_UP_SERVICES:
+            try:
+                accessor()
+            except Exception as e:
+                print(f"Warm-up of {name} failed: {e}")
+    finally:
+        _warm_up_done.set()
+
+def start_warm_up():
+    """Run warm_up() in a background thread (once)"""
+    global _warm_up_thread
+    with _locks_lock:
+        if _warm_up_thread is None:
+            _warm_up_thread = threading.Thread(target=warm_up, name="warm-up", daemon=True)
+            _warm_up_thread.start()
+
+def service_status():
+    """Readiness report: whether warm-up (if started) has finished, and the state of each service"""
+    services = {}
+    for name, _ in WARM_UP_SERVICES:
+        services[name] = {
+            "initialized": name in _instances,
+            "init_ms": round(_init_ms[name], 1) if name in _init_ms else None,
+            "error": _errors.get(name),
+        }
+    return {
+        "ready": _warm_up_thread is None or _warm_up_done.is_set(),
+        "warm_up": "off" if _warm_up_thread is None else ("done" if _warm_up_done.is_set() else "running"),
+        "services": services,
+    }
@@ -0,0 +1,10 @@
+import os
+
+# Local on-disk state (caches, indexes) lives under DATA_DIR
+DATA_DIR = os.getenv("DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+
+def data_dir(*parts):
+    """Return a directory under DATA_DIR, creating it if needed"""
+    path = os.path.join(DATA_DIR, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
@@ -0,0 +1,317 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from settings import data_dir
+from metrics import timed
+
+# Record storage for reference sets and inquiries: one SQLite row per record,
+# so saves touch only the record being changed and counters are updated
+# atomically in the database instead of read-modify-write in Python.
+STORAGE_PATH = os.getenv("STORAGE_PATH") or os.path.join(data_dir(), "research_assistant.db")
+
+_local = threading.local()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reference_sets (
+    id TEXT PRIMARY KEY,
+    domain TEXT NOT NULL,
+    description TEXT NOT NULL DEFAULT '',
+    file_count INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS reference_sets_created_at ON reference_sets(created_at);
+
+CREATE TABLE IF NOT EXISTS inquiries (
+    id TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    description TEXT NOT NULL DEFAULT '',
+    reference_sets TEXT NOT NULL DEFAULT '[]',
+    created_at REAL NOT NULL,
+    message_count INTEGER NOT NULL DEFAULT 0,
+    last_message_at REAL
+);
+CREATE INDEX IF NOT EXISTS inquiries_created_at ON inquiries(created_at);
+
+-- Append-only chat log: one row per turn, read back a page at a time
+CREATE TABLE IF NOT EXISTS inquiry_messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    inquiry_id TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    query TEXT NOT NULL,
+    response TEXT NOT NULL,
+    citations TEXT NOT NULL DEFAULT '[]',
+    chunk_ids TEXT NOT NULL DEFAULT '[]',
+    latency_ms REAL
+);
+CREATE INDEX IF NOT EXISTS inquiry_messages_inquiry ON inquiry_messages(inquiry_id, id);
+
+-- Per-document manifest of chunk content hashes, diffed on re-upload so only changed chunks are re-embedded
+CREATE TABLE IF NOT EXISTS documents (
+    reference_set_id TEXT NOT NULL,
+    document_name TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (reference_set_id, document_name)
+);
+
+CREATE TABLE IF NOT EXISTS document_chunks (
+    reference_set_id TEXT NOT NULL,
+    document_name TEXT NOT NULL,
+    chunk_id TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    PRIMARY KEY (reference_set_id, document_name, chunk_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS storage_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+def get_connection():
+    """Per-thread SQLite connection (created on first use)"""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(STORAGE_PATH, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+        _upgrade_schema(conn)
+        _local.conn = conn
+    return conn
+
+def _upgrade_schema(conn):
+    """Add columns introduced after a database was created"""
+    columns = {row["name"] for row in conn.execute("PRAGMA table_info(inquiries)")}
+    with conn:
+        if "message_count" not in columns:
+            conn.execute("ALTER TABLE inquiries ADD COLUMN message_count INTEGER NOT NULL DEFAULT 0")
+        if "last_message_at" not in columns:
+            conn.execute("ALTER TABLE inquiries ADD COLUMN last_message_at REAL")
+
+def _reference_set_from_row(row):
+    return {
+        "id": row["id"],
+        "domain": row["domain"],
+        "description": row["description"],
+        "file_count": row["file_count"],
+    }
+
+def _inquiry_from_row(row):
+    return {
+        "id": row["id"],
+        "title": row["title"],
+        "description": row["description"],
+        "reference_sets": json.loads(row["reference_sets"]),
+        "message_count": row["message_count"],
+        "last_message_at": row["last_message_at"],
+    }
+
+def _message_from_row(row):
+    return {
+        "id": row["id"],
+        "inquiry_id": row["inquiry_id"],
+        "created_at": row["created_at"],
+        "query": row["query"],
+        "response": row["response"],
+        "citations": json.loads(row["citations"]),
+        "chunk_ids": json.loads(row["chunk_ids"]),
+        "latency_ms": row["latency_ms"],
+    }
+
+@timed("storage")
+def list_reference_sets():
+    """All reference sets, oldest first"""
+    rows = get_connection().execute("SELECT * FROM reference_sets ORDER BY created_at, rowid")
+    return [_reference_set_from_row(row) for row in rows]
+
+@timed("storage")
+def get_reference_set(ref_set_id):
+    """One reference set, or None"""
+    row = get_connection().execute("SELECT * FROM reference_sets WHERE id = ?", (ref_set_id,)).fetchone()
+    return _reference_set_from_row(row) if row else None
+
+@timed("storage")
+def save_reference_set(ref_set_id, reference_set):
+    """Insert or update one reference set (file_count is left to increment_file_count on update)"""
+    conn = get_connection()
+    with conn:
+        conn.execute(
+            "INSERT INTO reference_sets (id, domain, description, file_count, created_at) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET domain = excluded.domain, description = excluded.description",
+            (ref_set_id, reference_set.get("domain", ""), reference_set.get("description", ""),
+             reference_set.get("file_count", 0), time.time()),
+        )
+
+@timed("storage")
+def increment_file_count(ref_set_id, delta=1):
+    """Atomically add to a reference set's file_count; returns the new count or None if missing"""
+    conn = get_connection()
+    with conn:
+        cursor = conn.execute("UPDATE reference_sets SET file_count = file_count + ? WHERE id = ?", (delta, ref_set_id))
+        if not cursor.rowcount:
+            return None
+        return conn.execute("SELECT file_count FROM reference_sets WHERE id = ?", (ref_set_id,)).fetchone()[0]
+
+@timed("storage")
+def delete_reference_set(ref_set_id):
+    """Delete one reference set and its document manifests; returns whether it existed"""
+    conn = get_connection()
+    with conn:
+        conn.execute("DELETE FROM document_chunks WHERE reference_set_id = ?", (ref_set_id,))
+        conn.execute("DELETE FROM documents WHERE reference_set_id = ?", (ref_set_id,))
+        return conn.execute("DELETE FROM reference_sets WHERE id = ?", (ref_set_id,)).rowcount > 0
+
+@timed("storage")
+def get_document_manifest(ref_set_id, document_name):
+    """{chunk_id: content hash} of a document's last ingestion, or None if it was never ingested"""
+    conn = get_connection()
+    if not conn.execute("SELECT 1 FROM documents WHERE reference_set_id = ? AND document_name = ?",
+                        (ref_set_id, document_name)).fetchone():
+        return None
+    rows = conn.execute("SELECT chunk_id, hash FROM document_chunks WHERE reference_set_id = ? AND document_name = ?",
+                        (ref_set_id, document_name))
+    return {row["chunk_id"]: row["hash"] for row in rows}
+
+@timed("storage")
+def save_document_manifest(ref_set_id, document_name, manifest):
+    """Replace a document's chunk manifest; returns whether the document is new to the reference set"""
+    conn = get_connection()
+    with conn:
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO documents (reference_set_id, document_name, updated_at) VALUES (?, ?, ?)",
+            (ref_set_id, document_name, time.time()),
+        )
+        is_new = cursor.rowcount > 0
+        if not is_new:
+            conn.execute("UPDATE documents SET updated_at = ? WHERE reference_set_id = ? AND document_name = ?",
+                         (time.time(), ref_set_id, document_name))
+        conn.execute("DELETE FROM document_chunks WHERE reference_set_id = ? AND document_name = ?",
+                     (ref_set_id, document_name))
+        conn.executemany(
+            "INSERT INTO document_chunks (reference_set_id, document_name, chunk_id, hash) VALUES (?, ?, ?, ?)",
+            [(ref_set_id, document_name, chunk_id, content_hash) for chunk_id, content_hash in manifest.items()],
+        )
+    return is_new
+
+@timed("storage")
+def list_inquiries():
+    """Summaries of all inquiries (no message bodies), oldest first"""
+    rows = get_connection().execute("SELECT * FROM inquiries ORDER BY created_at, rowid")
+    return [_inquiry_from_row(row) for row in rows]
+
+@timed("storage")
+def get_inquiry(inquiry_id):
+    """One inquiry, or None"""
+    row = get_connection().execute("SELECT * FROM inquiries WHERE id = ?", (inquiry_id,)).fetchone()
+    return _inquiry_from_row(row) if row else None
+
+@timed("storage")
+def save_inquiry(inquiry_id, inquiry):
+    """Insert or update one inquiry (messages are appended separately with append_message)"""
+    conn = get_connection()
+    with conn:
+        conn.execute(
+            "INSERT INTO inquiries (id, title, description, reference_sets, created_at) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET title = excluded.title, description = excluded.description, "
+            "reference_sets = excluded.reference_sets",
+            (inquiry_id, inquiry.get("title", ""), inquiry.get("description", ""),
+             json.dumps(list(inquiry.get("reference_sets", []))), time.time()),
+        )
+
+@timed("storage")
+def delete_inquiry(inquiry_id):
+    """Delete one inquiry and its messages; returns whether it existed"""
+    conn = get_connection()
+    with conn:
+        conn.execute("DELETE FROM inquiry_messages WHERE inquiry_id = ?", (inquiry_id,))
+        return conn.execute("DELETE FROM inquiries WHERE id = ?", (inquiry_id,)).rowcount > 0
+
+def _append_message(conn, inquiry_id, query, response, citations, chunk_ids, latency_ms, created_at):
+    if not conn.execute(
+        "UPDATE inquiries SET message_count = message_count + 1, last_message_at = ? WHERE id = ?",
+        (created_at, inquiry_id),
+    ).rowcount:
+        return None
+    return conn.execute(
+        "INSERT INTO inquiry_messages (inquiry_id, created_at, query, response, citations, chunk_ids, latency_ms) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (inquiry_id, created_at, query, response, json.dumps(citations), json.dumps(chunk_ids), latency_ms),
+    ).lastrowid
+
+@timed("storage")
+def append_message(inquiry_id, query, response, citations=(), chunk_ids=(), latency_ms=None):
+    """Append one chat turn to an inquiry's log; returns the message id, or None if the inquiry is missing"""
+    conn = get_connection()
+    with conn:
+        return _append_message(conn, inquiry_id, query, response, list(citations), list(chunk_ids),
+                               latency_ms, time.time())
+
+@timed("storage")
+def list_messages(inquiry_id, cursor=None, limit=50):
+    """One page of an inquiry's chat log, newest page first
+
+    Returns (messages in chronological order, cursor for the next older page
+    or None). Pass the returned cursor back to continue paging.
+    """
+    params = [inquiry_id]
+    where = "inquiry_id = ?"
+    if cursor is not None:
+        where += " AND id < ?"
+        params.append(int(cursor))
+    rows = get_connection().execute(
+        f"SELECT * FROM inquiry_messages WHERE {where} ORDER BY id DESC LIMIT ?", params + [limit + 1]
+    ).fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    messages = [_message_from_row(row) for row in reversed(rows)]
+    return messages, (str(rows[-1]["id"]) if has_more else None)
+
+def migrate_from_kv(kv):
+    """Copy reference sets and inquiries from the old whole-dict KV layout, once
+
+    The KV store kept everything under two keys ("reference_sets" and
+    "inquiries"), each a dict of id -> record. Records already present in
+    SQLite are left alone; the KV data is not modified.
+    """
+    conn = get_connection()
+    if conn.execute("SELECT 1 FROM storage_meta WHERE key = 'kv_migrated'").fetchone():
+        return
+
+    try:
+        reference_sets = dict(kv.get("reference_sets", {}))
+        inquiries = dict(kv.get("inquiries", {}))
+    except Exception as e:
+        print(f"Error reading KV store for migration: {e}")
+        return
+
+    now = time.time()
+    with conn:
+        for i, (ref_set_id, ref_set) in enumerate(reference_sets.items()):
+            ref_set = dict(ref_set)
+            conn.execute(
+                "INSERT OR IGNORE INTO reference_sets (id, domain, description, file_count, created_at) VALUES (?, ?, ?, ?, ?)",
+                (ref_set_id, ref_set.get("domain", ""), ref_set.get("description", ""),
+                 int(ref_set.get("file_count", 0)), now + i * 1e-6),
+            )
+        for i, (inquiry_id, inquiry) in enumerate(inquiries.items()):
+            inquiry = dict(inquiry)
+            if not conn.execute(
+                "INSERT OR IGNORE INTO inquiries (id, title, description, reference_sets, created_at) VALUES (?, ?, ?, ?, ?)",
+                (inquiry_id, inquiry.get("title", ""), inquiry.get("description", ""),
+                 json.dumps([str(r) for r in inquiry.get("reference_sets", [])]), now + i * 1e-6),
+            ).rowcount:
+                continue
+            # Old inquiries kept a role/content message list; pair user and assistant messages into turns
+            query = None
+            for message in inquiry.get("messages", []):
+                message = dict(message)
+                if message.get("role") == "user":
+                    query = message.get("content", "")
+                elif message.get("role") == "assistant" and query is not None:
+                    _append_message(conn, inquiry_id, query, message.get("content", ""),
+                                    list(message.get("citations", [])), [], None, now)
+                    query = None
+        conn.execute("INSERT INTO storage_meta (key, value) VALUES ('kv_migrated', ?)", (str(now),))
+    print(f"Migrated {len(reference_sets)} reference sets and {len(inquiries)} inquiries from the KV store")
@@ -0,0 +1,512 @@
+import os
+import json
+import math
+import shutil
+import sqlite3
+import threading
+import numpy as np
+from metadata_index import MetadataIndex, bitmap_to_rows
+
+# Vector store interface used by the API. Mirrors the subset of the Pinecone
+# index API we rely on (upsert / query / delete with metadata filters and
+# namespaces) so the Pinecone backend and the local backend are interchangeable.
+
+class Match:
+    """One query result"""
+
+    def __init__(self, id, score, metadata=None, values=None):
+        self.id = id
+        self.score = score
+        self.metadata = metadata or {}
+        self.values = values
+
+class QueryResult:
+    """Query results, best match first"""
+
+    def __init__(self, matches):
+        self.matches = matches
+
+class VectorStore:
+    """Interface for vector store backends"""
+
+    def upsert(self, vectors, namespace=""):
+        """Insert or replace vectors given as {'id', 'values', 'metadata'} dicts"""
+        raise NotImplementedError
+
+    def query(self, vector, top_k=10, filter=None, include_metadata=True, include_values=False, namespace=""):
+        """Return the top_k most similar vectors (cosine) matching the metadata filter"""
+        raise NotImplementedError
+
+    def delete(self, ids=None, filter=None, delete_all=False, namespace=""):
+        """Delete vectors by id, by metadata filter, or the whole namespace"""
+        raise NotImplementedError
+
+    def namespace_size(self, namespace=""):
+        """Number of vectors stored in a namespace"""
+        raise NotImplementedError
+
+class PineconeVectorStore(VectorStore):
+    """Vector store backed by a Pinecone index"""
+
+    def __init__(self, index):
+        self.index = index
+
+    def upsert(self, vectors, namespace=""):
+        self.index.upsert(vectors=vectors, namespace=namespace)
+
+    def query(self, vector, top_k=10, filter=None, include_metadata=True, include_values=False, namespace=""):
+        results = self.index.query(
+            vector=vector,
+            top_k=top_k,
+            filter=filter,
+            include_metadata=include_metadata,
+            include_values=include_values,
+            namespace=namespace,
+        )
+        return QueryResult([
+            Match(match.id, float(match.score), match.metadata, match.values if include_values else None)
+            for match in results.matches
+        ])
+
+    def delete(self, ids=None, filter=None, delete_all=False, namespace=""):
+        if delete_all:
+            self.index.delete(delete_all=True, namespace=namespace)
+        elif ids:
+            self.index.delete(ids=ids, namespace=namespace)
+        elif filter:
+            self.index.delete(filter=filter, namespace=namespace)
+
+    def namespace_size(self, namespace=""):
+        namespaces = self.index.describe_index_stats().namespaces or {}
+        summary = namespaces.get(namespace)
+        return summary.vector_count if summary else 0
+
+class MemoryVectorStore(VectorStore):
+    """Vectors held in process memory only (nothing persisted): exact search, for benchmarks and offline runs"""
+
+    def __init__(self):
+        self._namespaces = {}  # namespace -> {id: (unit vector, metadata)}
+        self._snapshots = {}  # namespace -> (ids, matrix, metadata list), rebuilt after writes
+        self._lock = threading.Lock()
+
+    def upsert(self, vectors, namespace=""):
+        values = _normalize(np.asarray([v["values"] for v in vectors], dtype=np.float32)) if vectors else []
+        with self._lock:
+            stored = self._namespaces.setdefault(namespace, {})
+            for vector, row in zip(vectors, values):
+                stored[vector["id"]] = (row, vector.get("metadata") or {})
+            self._snapshots.pop(namespace, None)
+
+    def _snapshot(self, namespace):
+        with self._lock:
+            snapshot = self._snapshots.get(namespace)
+            if snapshot is None:
+                stored = self._namespaces.get(namespace, {})
+                ids = list(stored)
+                matrix = np.stack([stored[i][0] for i in ids]) if ids else np.empty((0, 0), dtype=np.float32)
+                snapshot = self._snapshots[namespace] = (ids, matrix, [stored[i][1] for i in ids])
+            return snapshot
+
+    def query(self, vector, top_k=10, filter=None, include_metadata=True, include_values=False, namespace=""):
+        ids, matrix, metadata = self._snapshot(namespace)
+        if not ids or top_k <= 0:
+            return QueryResult([])
+        rows = np.array([i for i, meta in enumerate(metadata) if matches_filter(meta, filter)], dtype=np.int64) \
+            if filter else np.arange(len(ids))
+        if not len(rows):
+            return QueryResult([])
+        query = _normalize(np.asarray([vector], dtype=np.float32))[0]
+        scores = matrix[rows] @ query
+        top = np.argsort(-scores, kind="stable")[:top_k]
+        return QueryResult([
+            Match(ids[rows[i]], float(scores[i]), dict(metadata[rows[i]]) if include_metadata else {},
+                  matrix[rows[i]].copy() if include_values else None)
+            for i in top
+        ])
+
+    def delete(self, ids=None, filter=None, delete_all=False, namespace=""):
+        with self._lock:
+            self._snapshots.pop(namespace, None)
+            if delete_all:
+                self._namespaces.pop(namespace, None)
+                return
+            stored = self._namespaces.get(namespace, {})
+            if ids:
+                doomed = [vector_id for vector_id in ids if vector_id in stored]
+            elif filter:
+                doomed = [vector_id for vector_id, (_, metadata) in stored.items() if matches_filter(metadata, filter)]
+            else:
+                doomed = []
+            for vector_id in doomed:
+                del stored[vector_id]
+
+    def namespace_size(self, namespace=""):
+        with self._lock:
+            return len(self._namespaces.get(namespace, {}))
+
+def _value_matches(value, condition):
+    """Evaluate one field condition from a Pinecone-style filter"""
+    if not isinstance(condition, dict):
+        condition = {"$eq": condition}
+    values = value if isinstance(value, list) else [value]
+    for op, operand in condition.items():
+        if op == "$eq":
+            ok = operand in values
+        elif op == "$ne":
+            ok = operand not in values
+        elif op == "$in":
+            ok = any(v in operand for v in values)
+        elif op == "$nin":
+            ok = not any(v in operand for v in values)
+        elif op == "$exists":
+            ok = (value is not None) == bool(operand)
+        elif op in ("$gt", "$gte", "$lt", "$lte"):
+            if not isinstance(value, (int, float)) or isinstance(value, bool):
+                return False
+            ok = {"$gt": value > operand, "$gte": value >= operand,
+                  "$lt": value < operand, "$lte": value <= operand}[op]
+        else:
+            raise ValueError(f"Unsupported filter operator: {op}")
+        if not ok:
+            return False
+    return True
+
+def matches_filter(metadata, filter):
+    """Evaluate a Pinecone-style metadata filter ($eq, $ne, $in, $nin, $gt(e), $lt(e), $exists, $and, $or)"""
+    for key, condition in filter.items():
+        if key == "$and":
+            if not all(matches_filter(metadata, sub) for sub in condition):
+                return False
+        elif key == "$or":
+            if not any(matches_filter(metadata, sub) for sub in condition):
+                return False
+        elif not _value_matches(metadata.get(key), condition):
+            return False
+    return True
+
+# Local backend tuning
+LOCAL_IVF_MIN_VECTORS = int(os.getenv("LOCAL_IVF_MIN_VECTORS", "20000"))
+LOCAL_IVF_NPROBE = int(os.getenv("LOCAL_IVF_NPROBE", "16"))
+IVF_KMEANS_ITERATIONS = 8
+IVF_REBUILD_RATIO = 0.2  # Rebuild once this fraction of rows changed since the last build
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+class _Partition:
+    """Vectors of one namespace: float32 rows in a memory-mapped file plus ids/metadata in SQLite
+
+    Search is exact (one matrix-vector product) until the partition holds
+    LOCAL_IVF_MIN_VECTORS vectors; beyond that an IVF index (spherical k-means
+    coarse quantizer) is built in the background and queries scan only the
+    LOCAL_IVF_NPROBE closest lists plus rows changed since the build.
+    """
+
+    def __init__(self, directory, dimension):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.dimension = dimension
+        self.lock = threading.RLock()
+        self.dropped = False
+
+        self.db = sqlite3.connect(os.path.join(directory, "rows.db"), check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS rows (row INTEGER PRIMARY KEY, id TEXT UNIQUE NOT NULL, metadata TEXT NOT NULL)")
+        self.db.commit()
+
+        self.ids = []
+        self.metadata = []
+        self.row_of = {}
+        self.free_rows = []
+        self.metadata_index = MetadataIndex()
+        for row, vector_id, metadata in self.db.execute("SELECT row, id, metadata FROM rows ORDER BY row"):
+            while len(self.ids) < row:
+                self.free_rows.append(len(self.ids))
+                self.ids.append(None)
+                self.metadata.append(None)
+            self.ids.append(vector_id)
+            self.metadata.append(json.loads(metadata))
+            self.row_of[vector_id] = row
+        self.metadata_index.add(list(self.row_of.values()), [self.metadata[row] for row in self.row_of.values()])
+
+        self.path = os.path.join(directory, "vectors.f32")
+        if not os.path.exists(self.path):
+            open(self.path, "wb").close()
+        self.capacity = 0
+        self.vectors = None
+        self._ensure_capacity(len(self.ids))
+        self.alive = np.zeros(self.capacity, dtype=bool)
+        if self.row_of:
+            self.alive[list(self.row_of.values())] = True
+
+        self.ivf = None  # (centroids, list_offsets, list_rows)
+        self.ivf_changed = set()  # Rows written since the IVF snapshot was taken
+        self.ivf_changed_during_build = None
+        self.ivf_building = False
+
+    @property
+    def count(self):
+        return len(self.ids)
+
+    def _ensure_capacity(self, rows):
+        if rows <= self.capacity and self.vectors is not None:
+            return
+        capacity = max(self.capacity, 1024)
+        while capacity < rows:
+            capacity *= 2
+        row_bytes = self.dimension * 4
+        if os.path.getsize(self.path) < capacity * row_bytes:
+            with open(self.path, "r+b") as f:
+                f.truncate(capacity * row_bytes)
+        self.vectors = np.memmap(self.path, dtype=np.float32, mode="r+", shape=(capacity, self.dimension))
+        if hasattr(self, "alive"):
+            alive = np.zeros(capacity, dtype=bool)
+            alive[:len(self.alive)] = self.alive
+            self.alive = alive
+        self.capacity = capacity
+
+    def upsert(self, vectors):
+        values = _normalize(np.asarray([v["values"] for v in vectors], dtype=np.float32))
+        with self.lock:
+            rows = []
+            replaced = {}
+            for vector in vectors:
+                row = self.row_of.get(vector["id"])
+                if row is not None and row not in replaced:
+                    replaced[row] = self.metadata[row]
+                if row is None:
+                    if self.free_rows:
+                        row = self.free_rows.pop()
+                    else:
+                        row = self.count
+                        self.ids.append(None)
+                        self.metadata.append(None)
+                    self.row_of[vector["id"]] = row
+                self.ids[row] = vector["id"]
+                self.metadata[row] = vector.get("metadata") or {}
+                rows.append(row)
+            self._ensure_capacity(self.count)
+            self.vectors[rows] = values
+            self.vectors.flush()
+            self.alive[rows] = True
+            if replaced:
+                self.metadata_index.remove(list(replaced), list(replaced.values()))
+            unique_rows = list(dict.fromkeys(rows))
+            self.metadata_index.add(unique_rows, [self.metadata[row] for row in unique_rows])
+            self.ivf_changed.update(rows)
+            if self.ivf_changed_during_build is not None:
+                self.ivf_changed_during_build.update(rows)
+            self.db.executemany(
+                "INSERT OR REPLACE INTO rows (row, id, metadata) VALUES (?, ?, ?)",
+                [(row, self.ids[row], json.dumps(self.metadata[row])) for row in rows],
+            )
+            self.db.commit()
+
+    def delete_rows(self, rows):
+        with self.lock:
+            self.metadata_index.remove(rows, [self.metadata[row] for row in rows])
+            for row in rows:
+                del self.row_of[self.ids[row]]
+                self.ids[row] = None
+                self.metadata[row] = None
+                self.alive[row] = False
+                self.free_rows.append(row)
+            self.db.executemany("DELETE FROM rows WHERE row = ?", [(row,) for row in rows])
+            self.db.commit()
+
+    def drop(self):
+        """Delete the partition's files; the partition is unusable afterwards"""
+        with self.lock:
+            self.dropped = True
+            self.db.close()
+            self.vectors = None
+            self.alive[:] = False
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    def filter_rows(self, filter):
+        """Row ids whose metadata matches the filter
+
+        Conditions on indexed fields are answered from the bitmap index; only
+        the remaining (residual) conditions are checked row by row, and only
+        on the rows the index left as candidates.
+        """
+        bitmap, residual = self.metadata_index.resolve(filter, _value_matches)
+        rows = bitmap_to_rows(bitmap)
+        if residual:
+            rows = np.array([row for row in rows if matches_filter(self.metadata[row], residual)], dtype=np.int64)
+        return rows
+
+    def _maybe_build_ivf(self):
+        """Start a background IVF build when the partition is large or the index is stale"""
+        if self.ivf_building:
+            return
+        alive = len(self.row_of)
+        if alive < LOCAL_IVF_MIN_VECTORS:
+            self.ivf = None
+            return
+        if self.ivf is not None and len(self.ivf_changed) < IVF_REBUILD_RATIO * alive:
+            return
+        self.ivf_building = True
+        threading.Thread(target=self._build_ivf, daemon=True).start()
+
+    def _build_ivf(self):
+        try:
+            with self.lock:
+                count = self.count
+                rows = np.flatnonzero(self.alive[:count])
+                changed_during_build = self.ivf_changed_during_build = set()
+            data = self.vectors[rows]
+
+            nlist = int(min(4096, max(16, math.sqrt(len(rows)))))
+            rng = np.random.default_rng(0)
+            sample = data[rng.choice(len(rows), size=min(len(rows), nlist * 32), replace=False)]
+            centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+            for _ in range(IVF_KMEANS_ITERATIONS):
+                assignment = np.argmax(sample @ centroids.T, axis=1)
+                for c in range(nlist):
+                    members = sample[assignment == c]
+                    centroids[c] = members.sum(axis=0) if len(members) else sample[rng.integers(len(sample))]
+                centroids = _normalize(centroids)
+
+            assignment = np.concatenate([
+                np.argmax(data[start:start + 65536] @ centroids.T, axis=1)
+                for start in range(0, len(rows), 65536)
+            ])
+            order = np.argsort(assignment, kind="stable")
+            list_rows = rows[order]
+            list_offsets = np.searchsorted(assignment[order], np.arange(nlist + 1))
+
+            with self.lock:
+                self.ivf = (centroids, list_offsets, list_rows)
+                self.ivf_changed = changed_during_build
+                print(f"Built IVF index: {len(rows)} vectors in {nlist} lists")
+        except Exception as e:
+            print(f"Error building IVF index: {e}")
+        finally:
+            with self.lock:
+                self.ivf_building = False
+                self.ivf_changed_during_build = None
+
+    def candidate_rows(self, query):
+        """Rows to score exactly for a query: IVF probe lists plus changed rows, or None for all rows"""
+        with self.lock:
+            self._maybe_build_ivf()
+            if self.ivf is None:
+                return None
+            centroids, list_offsets, list_rows = self.ivf
+            nprobe = min(LOCAL_IVF_NPROBE, len(centroids))
+            probes = np.argpartition(-(centroids @ query), nprobe - 1)[:nprobe]
+            parts = [list_rows[list_offsets[c]:list_offsets[c + 1]] for c in probes]
+            parts.append(np.fromiter(self.ivf_changed, dtype=np.int64, count=len(self.ivf_changed)))
+            return np.unique(np.concatenate(parts))
+
+class LocalVectorStore(VectorStore):
+    """In-process vector store persisted under a directory (one partition per namespace)"""
+
+    def __init__(self, directory, dimension):
+        self.directory = directory
+        self.dimension = dimension
+        self._partitions = {}
+        self._lock = threading.Lock()
+
+    def _partition_path(self, namespace):
+        """Directory of a namespace's partition; raises ValueError for names that would leave the store"""
+        name = namespace or "__default__"
+        separators = [sep for sep in (os.sep, os.altsep) if sep]
+        if name in (".", "..") or ".." in name or any(sep in name for sep in separators):
+            raise ValueError(f"Invalid namespace: {namespace!r}")
+        root = os.path.realpath(self.directory)
+        path = os.path.realpath(os.path.join(root, name))
+        if os.path.dirname(path) != root:
+            raise ValueError(f"Invalid namespace: {namespace!r}")
+        return name, path
+
+    def _partition(self, namespace, create=True):
+        name, path = self._partition_path(namespace)
+        with self._lock:
+            partition = self._partitions.get(name)
+            if partition is None:
+                if not create and not os.path.isdir(path):
+                    return None
+                partition = self._partitions[name] = _Partition(path, self.dimension)
+            return partition
+
+    def upsert(self, vectors, namespace=""):
+        if vectors:
+            self._partition(namespace).upsert(vectors)
+
+    def query(self, vector, top_k=10, filter=None, include_metadata=True, include_values=False, namespace=""):
+        partition = self._partition(namespace, create=False)
+        if partition is None or top_k <= 0:
+            return QueryResult([])
+        query = _normalize(np.asarray([vector], dtype=np.float32))[0]
+
+        candidates = partition.candidate_rows(query)
+        with partition.lock:
+            if partition.dropped:
+                return QueryResult([])
+            count = partition.count
+            if filter:
+                rows = partition.filter_rows(filter)
+                if candidates is not None and len(rows) > LOCAL_IVF_MIN_VECTORS:
+                    rows = np.intersect1d(rows, candidates, assume_unique=True)
+                scores = partition.vectors[rows] @ query if len(rows) else np.empty(0, dtype=np.float32)
+            elif candidates is not None:
+                rows = candidates[partition.alive[candidates]]
+                scores = partition.vectors[rows] @ query
+            else:
+                rows = np.arange(count)
+                scores = np.asarray(partition.vectors[:count] @ query)
+                scores[~partition.alive[:count]] = -np.inf
+
+            k = min(top_k, len(rows))
+            if k == 0:
+                return QueryResult([])
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top], kind="stable")]
+
+            matches = []
+            for i in top:
+                row = int(rows[i])
+                if not partition.alive[row]:
+                    continue
+                matches.append(Match(
+                    partition.ids[row],
+                    float(scores[i]),
+                    dict(partition.metadata[row]) if include_metadata else {},
+                    np.array(partition.vectors[row]) if include_values else None,
+                ))
+            return QueryResult(matches)
+
+    def delete(self, ids=None, filter=None, delete_all=False, namespace=""):
+        if delete_all:
+            # Dropping the whole partition costs the same however many vectors it holds
+            name, path = self._partition_path(namespace)
+            with self._lock:
+                partition = self._partitions.pop(name, None)
+                if partition is None:
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    partition.drop()
+            return
+        partition = self._partition(namespace, create=False)
+        if partition is None:
+            return
+        with partition.lock:
+            if ids:
+                rows = [partition.row_of[i] for i in ids if i in partition.row_of]
+            elif filter:
+                rows = [int(row) for row in partition.filter_rows(filter)]
+            else:
+                rows = []
+            if rows:
+                partition.delete_rows(rows)
+
+    def namespace_size(self, namespace=""):
+        partition = self._partition(namespace, create=False)
+        if partition is None:
+            return 0
+        with partition.lock:
+            return len(partition.row_of)
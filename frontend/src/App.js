@@ -165,8 +165,7 @@ function App() {
           id: data.inquiry_id,
           title,
           description,
-          reference_sets: selectedReferenceSets,
-          messages: []
+          reference_sets: selectedReferenceSets
         };
         setActiveInquiry(newInquiry);
         setShowCreateInquiryModal(false);
@@ -374,10 +373,30 @@ function ReferenceSets({ referenceSets, onCreateReferenceSet, onDeleteReferenceS
 
       const data = await response.json();
 
-      if (data.success) {
-        setUploadMessage(`Successfully processed ${data.stats.filename}: ${data.stats.chunks} chunks across ${data.stats.pages} pages`);
-      } else {
+      if (!data.success) {
         setUploadMessage(`Upload failed: ${data.error}`);
+        return;
+      }
+
+      // Ingestion runs in the background; poll the job until it finishes
+      let job = null;
+      do {
+        await new Promise(resolve => setTimeout(resolve, 1000));
+        const jobRes = await fetch(data.status_url);
+        job = await jobRes.json();
+        if (job.status === "queued" || job.status === "running") {
+          // The page total is only known up front for PDFs
+          const pages = job.pages_total ? `${job.pages_done}/${job.pages_total}` : job.pages_done;
+          setUploadMessage(`Processing ${job.filename}: ${job.stage} (${pages} pages, ${job.chunks_embedded} chunks embedded)`);
+        }
+      } while (job.status === "queued" || job.status === "running");
+
+      if (job.status === "completed") {
+        setUploadMessage(`Successfully processed ${job.result.filename}: ${job.result.chunks} chunks across ${job.result.pages} pages`);
+      } else if (job.status === "cancelled") {
+        setUploadMessage(`Processing of ${job.filename} was cancelled`);
+      } else {
+        setUploadMessage(`Upload failed: ${job.errors.join("; ") || "unknown error"}`);
       }
     } catch (error) {
       setUploadMessage(`Upload error: ${error.message}`);
@@ -394,7 +413,7 @@ function ReferenceSets({ referenceSets, onCreateReferenceSet, onDeleteReferenceS
       <button className="create-btn" onClick={onCreateReferenceSet}>Create New Reference Set</button>
 
       {uploadMessage && (
-        <div className={`upload-message ${uploadMessage.includes('Successfully') ? 'success' : 'error'}`}>
+        <div className={`upload-message ${uploadMessage.includes('Successfully') || uploadMessage.startsWith('Processing') ? 'success' : 'error'}`}>
           {uploadMessage}
         </div>
       )}
@@ -619,7 +638,13 @@ function TestSearch({ referenceSets }) {
             <div>
               <h3>Search Results for: "{results.query}"</h3>
               <p>Found {results.results_found} results out of {results.total_candidates} candidates in {results.ref_set_filter}</p>
-              <p>Minimum similarity score: {results.min_score_used}</p>
+              {results.min_score_used === null ? (
+                <p>Keyword search: the minimum similarity score does not apply</p>
+              ) : results.mode === "hybrid" ? (
+                <p>Minimum similarity score: {results.min_score_used} (applied to vector matches before they are fused with keyword matches; scores shown are fused ranks)</p>
+              ) : (
+                <p>Minimum similarity score: {results.min_score_used}</p>
+              )}
               
               {results.results.map((result, index) => (
                 <div key={index} className="result-card">
@@ -743,10 +768,39 @@ function CreateInquiryModal({ onClose, onSubmit, referenceSets }) {
   );
 }
 
+// Each stored turn becomes a user message followed by the assistant's reply
+const turnsToMessages = (turns) =>
+  turns.flatMap(turn => {
+    const timestamp = new Date(turn.created_at * 1000).toISOString();
+    return [
+      { role: "user", content: turn.query, timestamp },
+      { role: "assistant", content: turn.response, citations: turn.citations || [], timestamp }
+    ];
+  });
+
 function InquiryChat({ inquiry, onClose }) {
-  const [messages, setMessages] = useState(inquiry.messages || []);
+  const [messages, setMessages] = useState([]);
   const [inputMessage, setInputMessage] = useState("");
   const [isLoading, setIsLoading] = useState(false);
+  const [historyCursor, setHistoryCursor] = useState(null);
+
+  const loadHistory = async (cursor = null) => {
+    try {
+      const params = cursor ? `?cursor=${cursor}` : "";
+      const response = await fetch(`/api/inquiries/${inquiry.id}/messages${params}`);
+      if (!response.ok) return;
+      const data = await response.json();
+      setMessages(prev => [...turnsToMessages(data.messages || []), ...(cursor ? prev : [])]);
+      setHistoryCursor(data.next_cursor);
+    } catch (error) {
+      console.error("Error loading chat history:", error);
+    }
+  };
+
+  useEffect(() => {
+    loadHistory();
+    // eslint-disable-next-line react-hooks/exhaustive-deps
+  }, [inquiry.id]);
 
   const sendMessage = async (e) => {
     e.preventDefault();
@@ -762,8 +816,22 @@ function InquiryChat({ inquiry, onClose }) {
     setInputMessage("");
     setIsLoading(true);
 
+    // The reply streams in over Server-Sent Events: citations first, then tokens
+    const assistantMessage = {
+      role: "assistant",
+      content: "",
+      citations: [],
+      sources: [],
+      timestamp: new Date().toISOString()
+    };
+    let streaming = false;
+    const updateAssistant = (changes) => {
+      Object.assign(assistantMessage, changes);
+      setMessages(prev => [...prev.slice(0, -1), { ...assistantMessage }]);
+    };
+
     try {
-      const response = await fetch("/api/chat", {
+      const response = await fetch("/api/chat/stream", {
         method: "POST",
         headers: { "Content-Type": "application/json" },
         body: JSON.stringify({
@@ -772,25 +840,53 @@ function InquiryChat({ inquiry, onClose }) {
           reference_sets: inquiry.reference_sets
         })
       });
+      if (!response.ok || !response.body) {
+        throw new Error(`Chat request failed: ${response.status}`);
+      }
 
-      const data = await response.json();
-
-      const assistantMessage = {
-        role: "assistant",
-        content: data.response,
-        citations: data.citations || [],
-        sources: data.sources || [],
-        timestamp: new Date().toISOString()
-      };
+      setMessages(prev => [...prev, { ...assistantMessage }]);
+      streaming = true;
+      setIsLoading(false);
 
-      setMessages(prev => [...prev, assistantMessage]);
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        let boundary;
+        while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+          const rawEvent = buffer.slice(0, boundary);
+          buffer = buffer.slice(boundary + 2);
+          const eventLine = rawEvent.split("\n").find(line => line.startsWith("event: "));
+          const dataLine = rawEvent.split("\n").find(line => line.startsWith("data: "));
+          if (!eventLine || !dataLine) continue;
+          const eventType = eventLine.slice(7);
+          const data = JSON.parse(dataLine.slice(6));
+
+          if (eventType === "citations") {
+            updateAssistant({ citations: data.citations || [], sources: data.sources || [] });
+          } else if (eventType === "token") {
+            updateAssistant({ content: assistantMessage.content + data.text });
+          } else if (eventType === "error") {
+            updateAssistant({ content: assistantMessage.content || "Sorry, I encountered an error while processing your query. Please try again." });
+          }
+        }
+      }
     } catch (error) {
-      const errorMessage = {
-        role: "assistant",
-        content: "Sorry, I encountered an error while processing your query. Please try again.",
-        timestamp: new Date().toISOString()
-      };
-      setMessages(prev => [...prev, errorMessage]);
+      const errorText = "Sorry, I encountered an error while processing your query. Please try again.";
+      if (streaming) {
+        updateAssistant({ content: assistantMessage.content || errorText });
+      } else {
+        const errorMessage = {
+          role: "assistant",
+          content: errorText,
+          timestamp: new Date().toISOString()
+        };
+        setMessages(prev => [...prev, errorMessage]);
+      }
     } finally {
       setIsLoading(false);
     }
@@ -808,6 +904,12 @@ function InquiryChat({ inquiry, onClose }) {
 
       <div className="chat-container">
         <div className="chat-messages">
+          {historyCursor && (
+            <button onClick={() => loadHistory(historyCursor)} className="load-history-btn">
+              Load earlier messages
+            </button>
+          )}
+
           {messages.length === 0 && (
             <div className="welcome-message">
               <p>Welcome to your inquiry: <strong>{inquiry.title}</strong></p>